@@ -0,0 +1,93 @@
+"""Measures the throughput of a running aggregator under concurrent load.
+
+Fires requests at one endpoint from a number of concurrent clients for a fixed
+duration and reports the requests per second and latency percentiles. Run it
+against the API before and after a change to compare, for example with the
+coefficient cache disabled so every request reaches the database:
+
+    COEFFICIENT_CACHE_TTL=0 uvicorn main:app --port 8080
+    python benchmarks/concurrency.py --url http://localhost:8080/score -c 64
+"""
+
+import argparse
+import asyncio
+import json
+from time import perf_counter
+import httpx
+
+
+async def client(
+    http: httpx.AsyncClient, url: str, deadline: float, latencies: list, errors: list
+) -> None:
+    """Requests the URL back to back until the deadline."""
+    while perf_counter() < deadline:
+        start = perf_counter()
+        try:
+            response = await http.get(url)
+            response.raise_for_status()
+        except httpx.HTTPError as err:
+            errors.append(str(err))
+            continue
+        latencies.append(perf_counter() - start)
+
+
+async def run(url: str, concurrency: int, duration: float) -> dict:
+    """Runs the load test and summarises the latencies.
+
+    Args:
+        url (str): The URL to request.
+        concurrency (int): Number of clients requesting at the same time.
+        duration (float): Seconds to run for.
+
+    Returns:
+        dict: Requests per second, latency percentiles in milliseconds and the
+        number of failed requests.
+    """
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as http:
+        # Warm up the connections and the server before measuring.
+        await asyncio.gather(*(http.get(url) for _ in range(concurrency)))
+
+        start = perf_counter()
+        deadline = start + duration
+        await asyncio.gather(
+            *(
+                client(http, url, deadline, latencies, errors)
+                for _ in range(concurrency)
+            )
+        )
+        elapsed = perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(fraction: float) -> float:
+        if not latencies:
+            return None
+        return round(latencies[int(fraction * (len(latencies) - 1))] * 1000, 2)
+
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(0.5),
+        "p99_ms": percentile(0.99),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8080/score")
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("-d", "--duration", type=float, default=10)
+    arguments = parser.parse_args()
+
+    print(
+        json.dumps(
+            asyncio.run(run(arguments.url, arguments.concurrency, arguments.duration)),
+            indent=2,
+        )
+    )
@@ -0,0 +1,189 @@
+"""Generates synthetic air and heat datasets of any size for the benchmarks.
+
+The air dataset follows the OWID layout, one row per country and year with
+country,year,co2,nitrous_oxide columns. The heat dataset follows the Berkeley
+Earth layout, one row per country and month with Date,AverageTemperature,
+Country columns. Both have trends, noise and gaps like the real datasets and
+are written in blocks of countries, so 50 million rows don't have to fit in
+memory:
+
+    python benchmarks/generate.py heat --rows 10000000 heat.csv
+"""
+
+import argparse
+import math
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+# Rows generated and written at a time.
+BLOCK_ROWS = 1_000_000
+
+# The spans of the real datasets, 1750 to 2020 for both. Larger datasets get
+# more countries rather than more years.
+AIR_YEARS = 271
+HEAT_MONTHS = 271 * 12
+
+
+def layout(rows: Optional[int], periods: int, countries: int = None) -> tuple:
+    """Splits the rows into countries of a number of periods each.
+
+    Args:
+        rows (Optional[int]): The number of rows, ignored if the number of
+            countries is given.
+        periods (int): The periods per country.
+        countries (int, optional): The number of countries. Defaults to as
+            many as the rows need.
+
+    Returns:
+        tuple: The number of countries and periods per country.
+    """
+    if countries is not None:
+        return countries, periods
+
+    periods = max(1, min(periods, rows))
+    return math.ceil(rows / periods), periods
+
+
+def write_blocks(path: str, countries: int, periods: int, block) -> int:
+    """Writes the blocks of countries returned by block(first, count).
+
+    Returns:
+        int: The number of rows written.
+    """
+    per_block = max(1, BLOCK_ROWS // periods)
+    written = 0
+    for first in range(0, countries, per_block):
+        frame = block(first, min(per_block, countries - first))
+        frame.to_csv(
+            path, mode="w" if first == 0 else "a", header=first == 0, index=False
+        )
+        written += len(frame)
+    return written
+
+
+def generate_air(
+    path: str,
+    rows: Optional[int] = None,
+    seed: int = 0,
+    countries: int = None,
+    years: int = AIR_YEARS,
+) -> int:
+    """Writes an OWID style country,year,co2,nitrous_oxide CSV.
+
+    Emissions grow roughly linearly from a per country level, nitrous oxide is
+    only reported for recent years and a share of readings are missing.
+
+    Args:
+        path (str): Where to write the CSV.
+        rows (Optional[int], optional): The number of rows to write, rounded
+            up to whole countries. Ignored if countries is given.
+        seed (int, optional): Seed of the random values. Defaults to 0.
+        countries (int, optional): The number of countries to write.
+            Defaults to as many as the rows need.
+        years (int, optional): The years per country, up to 2020. Defaults
+            to AIR_YEARS.
+
+    Returns:
+        int: The number of rows written.
+    """
+    generator = np.random.default_rng(seed)
+    countries, years = layout(rows, years, countries)
+    year = np.arange(2021 - years, 2021)
+
+    def block(first: int, count: int) -> pd.DataFrame:
+        level = generator.uniform(0, 300, (count, 1))
+        growth = generator.uniform(-0.5, 2, (count, 1))
+        trend = level + growth * (year - year[0])
+        co2 = (trend + generator.normal(0, 5, trend.shape)).clip(0).round(3)
+        nitrous_oxide = (trend * 1.2 + generator.normal(0, 8, trend.shape)).round(3)
+
+        co2[generator.random(co2.shape) < 0.1] = np.nan
+        nitrous_oxide[:, year < 1990] = np.nan
+        nitrous_oxide[generator.random(co2.shape) < 0.1] = np.nan
+
+        names = [f"Country {index}" for index in range(first, first + count)]
+        return pd.DataFrame(
+            {
+                "country": np.repeat(names, years),
+                "year": np.tile(year, count),
+                "co2": co2.ravel(),
+                "nitrous_oxide": nitrous_oxide.ravel(),
+            }
+        )
+
+    return write_blocks(path, countries, years, block)
+
+
+def generate_heat(
+    path: str,
+    rows: Optional[int] = None,
+    seed: int = 0,
+    countries: int = None,
+    years: int = HEAT_MONTHS // 12,
+) -> int:
+    """Writes a Berkeley Earth style Date,AverageTemperature,Country CSV.
+
+    Temperatures follow a seasonal cycle around a per country mean with a
+    slow warming trend, and a share of the months are missing.
+
+    Args:
+        path (str): Where to write the CSV.
+        rows (Optional[int], optional): The number of rows to write, rounded
+            up to whole countries. Ignored if countries is given.
+        seed (int, optional): Seed of the random values. Defaults to 0.
+        countries (int, optional): The number of countries to write.
+            Defaults to as many as the rows need.
+        years (int, optional): The years of months per country, up to 2020.
+            Defaults to HEAT_MONTHS / 12.
+
+    Returns:
+        int: The number of rows written.
+    """
+    generator = np.random.default_rng(seed)
+    countries, months = layout(rows, years * 12, countries)
+    dates = pd.date_range(end="2020-12-01", periods=months, freq="MS")
+    formatted = np.asarray(dates.strftime("%Y-%m-%d"))
+    season = np.cos((dates.month.to_numpy() - 7) * np.pi / 6)
+    warming = np.arange(months) / 12 * 0.01
+
+    def block(first: int, count: int) -> pd.DataFrame:
+        mean = generator.uniform(-10, 30, (count, 1))
+        swing = generator.uniform(1, 15, (count, 1))
+        temperature = mean + swing * season + warming
+        temperature = (temperature + generator.normal(0, 1, temperature.shape)).round(3)
+        temperature[generator.random(temperature.shape) < 0.05] = np.nan
+
+        names = [f"Country {index}" for index in range(first, first + count)]
+        return pd.DataFrame(
+            {
+                "Date": np.tile(formatted, count),
+                "AverageTemperature": temperature.ravel(),
+                "Country": np.repeat(names, months),
+            }
+        )
+
+    return write_blocks(path, countries, months, block)
+
+
+GENERATORS = {"air": generate_air, "heat": generate_heat}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("kind", choices=sorted(GENERATORS))
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--countries", type=int, help="overrides --rows")
+    parser.add_argument("--years", type=int, default=AIR_YEARS)
+    arguments = parser.parse_args()
+
+    written = GENERATORS[arguments.kind](
+        arguments.path,
+        arguments.rows,
+        arguments.seed,
+        countries=arguments.countries,
+        years=arguments.years,
+    )
+    print(f"Wrote {written} rows to {arguments.path}")
@@ -0,0 +1,60 @@
+"""Times heat.process_dataset on a synthetic Berkeley Earth sized dataset.
+
+Generates monthly temperatures for 200 countries over 250 years (600,000
+rows) with benchmarks/generate.py and reports how long the heat ingest takes
+to fit every country:
+
+    python benchmarks/heat_ingest.py --countries 200 --years 250
+
+Pass --rows instead of --countries to size the dataset by rows, it's rounded
+up to whole countries of --years each.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from generate import generate_heat, layout  # noqa: E402
+from models import heat  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--countries", type=int, default=200)
+    parser.add_argument("--years", type=int, default=250)
+    parser.add_argument("--rows", type=int, help="overrides --countries")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data-dir", default=tempfile.gettempdir())
+    arguments = parser.parse_args()
+
+    countries, months = layout(
+        arguments.rows,
+        arguments.years * 12,
+        None if arguments.rows else arguments.countries,
+    )
+
+    os.makedirs(arguments.data_dir, exist_ok=True)
+    path = os.path.join(arguments.data_dir, f"heat_{countries}x{arguments.years}.csv")
+    if not os.path.exists(path):
+        generate_heat(path, countries=countries, years=arguments.years)
+
+    timings = []
+    for _ in range(arguments.repeat):
+        start = perf_counter()
+        models = heat.process_dataset(path)
+        timings.append(perf_counter() - start)
+
+    print(
+        json.dumps(
+            {
+                "rows": countries * months,
+                "countries": len(models),
+                "best_seconds": round(min(timings), 3),
+            },
+            indent=2,
+        )
+    )
@@ -0,0 +1,237 @@
+"""Benchmarks the ingest path on synthetic datasets and records the results.
+
+Times process_dataset, linear_regression, get_hash and update_database on
+generated air and heat datasets at each of the scales, reporting the best wall
+time, rows per second and peak RSS. Every benchmark runs in a fresh process so
+the peak RSS is its own. The results are written to a JSON file, pass the file
+of an earlier commit to compare against it:
+
+    python benchmarks/ingest.py --rows 10000 1000000 --output before.json
+    python benchmarks/ingest.py --rows 10000 1000000 --compare before.json
+
+update_database writes to a throwaway SQLite database unless --database-url
+points elsewhere, only ever point it at a scratch database.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from time import perf_counter
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from generate import AIR_YEARS, GENERATORS, HEAT_MONTHS, layout  # noqa: E402
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident set size of this process in megabytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def dataset_rows(kind: str, rows: int) -> int:
+    """Returns the rows the generator writes for the scale, it rounds up to
+    whole countries."""
+    countries, periods = layout(rows, AIR_YEARS if kind == "air" else HEAT_MONTHS)
+    return countries * periods
+
+
+def bench_process_dataset(kind: str, path: str, rows: int, database_url: str):
+    """Fits the dataset, streaming it past the threshold as ingest does."""
+    from models import air, heat
+    from models.env import INGEST_CHUNK_SIZE, INGEST_STREAM_THRESHOLD
+
+    module = air if kind == "air" else heat
+    count = dataset_rows(kind, rows)
+    if os.path.getsize(path) > INGEST_STREAM_THRESHOLD:
+        return lambda: module.stream_dataset(path, INGEST_CHUNK_SIZE), count
+    return lambda: module.process_dataset(path), count
+
+
+def bench_linear_regression(kind: str, path: str, rows: int, database_url: str):
+    """Fits a single line through as many points as the dataset has rows."""
+    from models.maths import linear_regression
+
+    generator = np.random.default_rng(0)
+    x_axis = pd.Series(1750 + np.arange(rows) % AIR_YEARS, dtype=float)
+    y_axis = pd.Series(x_axis * 0.5 + generator.normal(0, 10, rows))
+    return lambda: linear_regression(x_axis, y_axis), rows
+
+
+def bench_get_hash(kind: str, path: str, rows: int, database_url: str):
+    """Hashes the dataset file."""
+    from models.maths import get_hash
+
+    return lambda: get_hash(path), dataset_rows(kind, rows)
+
+
+def bench_update_database(kind: str, path: str, rows: int, database_url: str):
+    """Upserts the coefficients of every country in the dataset into a table
+    already holding them, the steady state of re-ingesting a dataset."""
+    import sqlalchemy
+    from sqlalchemy.orm import sessionmaker
+    from models import air, heat
+    from models.schemas import AirSchema, Base, HeatSchema
+
+    countries, _ = layout(rows, AIR_YEARS if kind == "air" else HEAT_MONTHS)
+    names = [f"Country {index}" for index in range(countries)]
+    if kind == "air":
+        models = [AirSchema(name, 1.0, 0.5, 2.0, 0.25) for name in names]
+        update_database = air.update_database
+    else:
+        models = [HeatSchema(name, 1.0, 0.5, 2.0, 0.25, 3.0, 0.125) for name in names]
+        update_database = heat.update_database
+
+    if database_url is None:
+        database_url = "sqlite:///{}".format(
+            os.path.join(tempfile.mkdtemp(), "benchmark.db")
+        )
+    engine = sqlalchemy.create_engine(database_url)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    update_database(models, session)
+
+    return lambda: update_database(models, session), countries
+
+
+# Benchmarks that don't depend on the kind of dataset are only run once.
+BENCHMARKS = {
+    "process_dataset": (bench_process_dataset, ("air", "heat")),
+    "linear_regression": (bench_linear_regression, ("air",)),
+    "get_hash": (bench_get_hash, ("air", "heat")),
+    "update_database": (bench_update_database, ("air", "heat")),
+}
+
+
+def run_benchmark(
+    name: str, kind: str, path: str, rows: int, repeat: int, database_url: str
+) -> dict:
+    """Runs one benchmark, inside its own process.
+
+    Returns:
+        dict: The rows handled, the best wall time, rows per second and the
+        peak RSS of the process.
+    """
+    setup, _ = BENCHMARKS[name]
+    function, count = setup(kind, path, rows, database_url)
+
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        timings.append(perf_counter() - start)
+
+    seconds = min(timings)
+    return {
+        "benchmark": name,
+        "kind": kind if len(BENCHMARKS[name][1]) > 1 else None,
+        "scale": rows,
+        "rows": count,
+        "seconds": round(seconds, 6),
+        "rows_per_second": round(count / seconds, 1) if seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def dataset(kind: str, rows: int, directory: str) -> str:
+    """Returns the path of the synthetic dataset, generating it on first use."""
+    path = os.path.join(directory, f"benchmark_{kind}_{rows}.csv")
+    if not os.path.exists(path):
+        print(f"Generating {rows} {kind} rows...", file=sys.stderr)
+        GENERATORS[kind](path, rows)
+    return path
+
+
+def current_commit() -> str:
+    """Returns the commit the benchmarks ran on, if run from a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, baseline: list) -> None:
+    """Prints the change in wall time of every benchmark in both runs."""
+    previous = {
+        (entry["benchmark"], entry["kind"], entry["scale"]): entry for entry in baseline
+    }
+    for entry in results:
+        before = previous.get((entry["benchmark"], entry["kind"], entry["scale"]))
+        if before is None or not entry["seconds"]:
+            continue
+
+        name = "/".join(filter(None, (entry["benchmark"], entry["kind"])))
+        print(
+            f"{name:<24} {entry['scale']:>10} rows "
+            f"{before['seconds']:>10.4f}s -> {entry['seconds']:>10.4f}s "
+            f"({before['seconds'] / entry['seconds']:.2f}x)",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000])
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--database-url")
+    parser.add_argument("--data-dir", default=tempfile.gettempdir())
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare")
+    arguments = parser.parse_args()
+    os.makedirs(arguments.data_dir, exist_ok=True)
+
+    results = []
+    for rows in arguments.rows:
+        for name in arguments.only or BENCHMARKS:
+            for kind in BENCHMARKS[name][1]:
+                path = dataset(kind, rows, arguments.data_dir)
+
+                # A fresh process per benchmark, so the peak RSS is its own.
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    result = executor.submit(
+                        run_benchmark,
+                        name,
+                        kind,
+                        path,
+                        rows,
+                        arguments.repeat,
+                        arguments.database_url,
+                    ).result()
+
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+
+    report = {
+        "commit": current_commit(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "database": (arguments.database_url or "sqlite").split(":")[0],
+        "results": results,
+    }
+    with open(arguments.output, "w") as output:
+        json.dump(report, output, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as baseline:
+            compare(results, json.load(baseline)["results"])
@@ -0,0 +1,55 @@
+"""TCP proxy that delays traffic, to simulate a database across the network.
+
+Point DATABASE_URL at the proxy to measure how the API behaves when every
+round-trip to Postgres costs a few milliseconds, as it does in production:
+
+    python benchmarks/latency_proxy.py --target localhost:5432 --port 6432 --delay 5
+"""
+
+import argparse
+import asyncio
+
+
+async def pipe(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, delay: float
+) -> None:
+    """Copies data from the reader to the writer, delaying every chunk."""
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            await asyncio.sleep(delay)
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(port: int, host: str, target_port: int, delay: float) -> None:
+    """Accepts connections on the port and forwards them to the target."""
+
+    async def handle(reader, writer):
+        target_reader, target_writer = await asyncio.open_connection(host, target_port)
+        await asyncio.gather(
+            pipe(reader, target_writer, 0), pipe(target_reader, writer, delay)
+        )
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", default="localhost:5432")
+    parser.add_argument("--port", type=int, default=6432)
+    parser.add_argument("--delay", type=float, default=5, help="milliseconds")
+    arguments = parser.parse_args()
+
+    target_host, target_port = arguments.target.rsplit(":", 1)
+    asyncio.run(
+        serve(arguments.port, target_host, int(target_port), arguments.delay / 1000)
+    )
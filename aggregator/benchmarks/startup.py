@@ -0,0 +1,138 @@
+"""Measures how long an API worker takes to import and how much memory it holds.
+
+Imports main in a fresh interpreter, as every uvicorn worker does, reporting
+the best import time, the RSS once imported and once warmed up, and which of
+the heavy optional modules the import pulled in. Point --app-dir at another
+checkout's aggregator folder to measure it instead, and pass the file of an
+earlier run to compare against it:
+
+    python benchmarks/startup.py --output before.json
+    python benchmarks/startup.py --compare before.json
+
+The warm up creates the tables in a throwaway SQLite database unless
+--database-url points elsewhere, only ever point it at a scratch database.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+# Modules a serving worker shouldn't need unless they're configured.
+HEAVY_MODULES = ("pandas", "psycopg2", "redis", "watchdog", "models.air", "models.heat")
+
+# Run in the fresh interpreter, prints the measurements as JSON.
+MEASURE = """
+import json, resource, sys
+from time import perf_counter
+
+def rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+start = perf_counter()
+import main
+seconds = perf_counter() - start
+imported = rss_mb()
+
+# Checkouts from before the warm up was split out of startup aren't warmed.
+warm = None
+if {warm} and hasattr(main, "prepare"):
+    import asyncio
+    asyncio.run(main.prepare())
+    warm = rss_mb()
+
+print(json.dumps({{
+    "seconds": seconds,
+    "rss_mb": imported,
+    "warm_rss_mb": warm,
+    "modules": [name for name in {modules} if name in sys.modules],
+}}))
+"""
+
+
+def measure(app_dir: str, database_url: str, warm: bool) -> dict:
+    """Imports main in a new interpreter and returns its measurements."""
+    environment = {**os.environ, "DATABASE_URL": database_url}
+    code = MEASURE.format(warm=warm, modules=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=app_dir,
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def current_commit(app_dir: str) -> str:
+    """Returns the commit of the measured checkout, if it's a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=app_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--app-dir", default=os.path.join(os.path.dirname(__file__), "..")
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--database-url")
+    parser.add_argument("--output", default="startup.json")
+    parser.add_argument("--compare")
+    arguments = parser.parse_args()
+
+    database_url = arguments.database_url or "sqlite:///{}".format(
+        os.path.join(tempfile.mkdtemp(), "startup.db")
+    )
+
+    # The first run also warms the disk cache, so it isn't counted.
+    runs = [
+        measure(arguments.app_dir, database_url, warm=index == 0)
+        for index in range(arguments.repeat + 1)
+    ]
+    result = {
+        "import_seconds": round(min(run["seconds"] for run in runs[1:]), 4),
+        "import_rss_mb": min(run["rss_mb"] for run in runs[1:]),
+        "warm_rss_mb": runs[0]["warm_rss_mb"],
+        "modules": runs[0]["modules"],
+    }
+    print(json.dumps(result), file=sys.stderr)
+
+    report = {
+        "commit": current_commit(arguments.app_dir),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "database": database_url.split(":")[0],
+        "result": result,
+    }
+    with open(arguments.output, "w") as output:
+        json.dump(report, output, indent=2)
+
+    if arguments.compare:
+        with open(arguments.compare) as baseline:
+            before = json.load(baseline)["result"]
+        for name in ("import_seconds", "import_rss_mb", "warm_rss_mb"):
+            if before.get(name) and result[name]:
+                print(
+                    f"{name:<16} {before[name]:>10} -> {result[name]:>10} "
+                    f"({before[name] / result[name]:.2f}x)",
+                    file=sys.stderr,
+                )
+        print(
+            f"modules          {before['modules']} -> {result['modules']}",
+            file=sys.stderr,
+        )
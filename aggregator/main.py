@@ -1,37 +1,149 @@
+import asyncio
+from contextlib import AsyncExitStack, suppress
 from datetime import datetime, timedelta
-import shutil
-from fastapi import Depends, FastAPI, File, UploadFile
+import os
+import random
+import tempfile
+from typing import Any, Awaitable, Callable, List, Optional, Tuple, Union
+import numpy as np
+from fastapi import Depends, FastAPI, File, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import sqlalchemy
-from sqlalchemy.orm import Session, sessionmaker
-from models.env import COUNTRIES, DATABASE_URL
-from models.schemas import AirSchema, HeatSchema
-from models.heat import generate_heat
-from models.air import generate_air
-from time import sleep
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from models.cache import CoefficientCache
+from models.env import (
+    ASYNC_DATABASE_URL,
+    COEFFICIENT_CACHE_SIZE,
+    COEFFICIENT_CACHE_TTL,
+    COEFFICIENT_SNAPSHOT,
+    COUNTRIES,
+    DATABASE_CONNECT_TIMEOUT,
+    DATABASE_URL,
+    HTTP_CACHE_MAX_AGE,
+    INGEST_JOB_HISTORY,
+    INGEST_UPLOAD_DIR,
+    INGEST_WORKERS,
+    MAX_RANGE_YEARS,
+    READY_TIMEOUT,
+    REDIS_URL,
+    STARTUP_RETRY_INITIAL,
+    STARTUP_RETRY_MAX,
+    WATCH_AIR_DIR,
+    WATCH_HEAT_DIR,
+)
+from models.jobs import IngestJob, JobQueue
+from models.maths import copy_and_hash
+from models.metrics import (
+    MetricsMiddleware,
+    instrument_engine,
+    register_caches,
+)
+from models.profiling import ProfilingMiddleware, report
+from models.registry import completed_datasets, find_job, record_job
+from models.schemas import AirSchema, DatasetSchema, HeatSchema, JobSchema, ScoreSchema
+from models.scores import (
+    country_scores,
+    range_scores,
+    refresh_scores,
+    scores_stale,
+    year_scores,
+)
+from models import snapshot
 
 try:
+    # The ingest path writes through the synchronous engine, the read
+    # endpoints go through the asyncio engine so they don't block the loop.
     engine = sqlalchemy.create_engine(DATABASE_URL)
     session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, connect_args={"timeout": DATABASE_CONNECT_TIMEOUT}
+    )
+    async_session_local = sessionmaker(
+        bind=async_engine, class_=AsyncSession, expire_on_commit=False
+    )
+
 except Exception as err:
     print("Unable to connect databse")
     raise SystemExit(-1) from err
 
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
+# Coefficients are served from memory, reloaded whenever an upload commits.
+coefficients = CoefficientCache(COEFFICIENT_CACHE_SIZE, COEFFICIENT_CACHE_TTL)
+
+# Computed prediction maps are shared between workers through Redis, if set.
+# The client is only imported then, it's a sizeable import for every worker,
+# see benchmarks/startup.py.
+results = None
+if REDIS_URL is not None:
+    from models.results import results_from_env
+
+    results = results_from_env()
+
+# Read when /metrics is scraped, the caches count their own hits and misses.
+register_caches(
+    lambda: {
+        "coefficients": coefficients.stats(),
+        **({"results": results.stats()} if results is not None else {}),
+    }
+)
+
+
+async def reload_coefficients(job: IngestJob) -> None:
+    """Reloads the coefficient cache once an ingest job has committed."""
+    # A skipped dataset may only be claimed by an ingest that's still running
+    # elsewhere and can yet fail, it's only known completed once ingested.
+    if job.file_hash is not None and not job.skipped:
+        completed_datasets.add(job.file_hash)
+
+    async with async_session_local() as session:
+        await coefficients.load(session)
 
-def get_session():
-    """Gets the local database session
+    # Tell the other workers and replicas to reload too, a dataset that was
+    # already ingested changed nothing.
+    if results is not None and not job.skipped:
+        await results.invalidate()
+
+
+async def share_job(job: IngestJob) -> None:
+    """Records the job's state, so every API worker can report it."""
+    async with async_session_local() as session:
+        await record_job(session, job)
+
+
+# Uploads are ingested in worker processes, off the event loop.
+jobs = JobQueue(INGEST_WORKERS, reload_coefficients, INGEST_JOB_HISTORY, share_job)
+
+# Datasets dropped into the watched folders go through the same queue.
+watcher = None
+if WATCH_AIR_DIR or WATCH_HEAT_DIR:
+    from models.watcher import watcher_from_env
+
+    watcher = watcher_from_env(jobs)
+
+# The tables the API needs, created on startup and checked by /readyz.
+TABLES = (AirSchema, HeatSchema, DatasetSchema, JobSchema, ScoreSchema)
+
+# Set by warm_up once the tables exist and the caches are loaded, it runs in
+# the background so /healthz answers while the database is still coming up.
+warm = False
+warm_up_task: Optional[asyncio.Task] = None
+
+
+async def get_async_session():
+    """Gets an asyncio database session for the read endpoints.
 
-    Uses SQL alchemy to create a generator function which returns the session.
     Yields:
-        SessionLocal: Session object
+        AsyncSession: Session object
     """
-    session = session_local()
-    try:
+    async with async_session_local() as session:
         yield session
-    finally:
-        session.close()
 
 
 app = FastAPI()
@@ -46,14 +158,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
+
 
-def query(session, schema, country) -> classmethod:
-    """Queries the database for the input class schema and country.
+async def query(session, schema, country) -> classmethod:
+    """Looks up the input class schema and country in the coefficient cache.
 
     Returns:
         classmethod: Returns a class based on the input class in schema.
     """
-    return session.query(schema).filter(schema.country == country).first()
+    return await coefficients.get(session, schema, country)
 
 
 def calculate_score(heat_prediction_score: dict, air_predictions: dict) -> float:
@@ -90,43 +205,338 @@ def calculate_score(heat_prediction_score: dict, air_predictions: dict) -> float
     return counter / division_counter
 
 
-@app.on_event("startup")
-async def startup():
-    """On API startup, connect the SQL database."""
-    while True:
-        try:
-            engine.connect()
+def year_range(start_year: int, end_year: int) -> Union[np.ndarray, dict]:
+    """Validates the requested years and returns them as an array.
+
+    Args:
+        start_year (int): First year of the range, defaults to this year.
+        end_year (int): Last year of the range, defaults to the start year.
+
+    Returns:
+        Union[np.ndarray, dict]: The years from start to end inclusive, or the
+        error to return to the user.
+    """
+    current_year = datetime.now().year
+    start_year = start_year or current_year
+    end_year = end_year or start_year
+
+    if start_year < current_year:
+        return {"error": "The date entered was in the past"}
+
+    if end_year < start_year:
+        return {"error": "The end year is before the start year"}
+
+    if end_year - start_year >= MAX_RANGE_YEARS:
+        return {"error": f"The range can't be longer than {MAX_RANGE_YEARS} years"}
+
+    return np.arange(start_year, end_year + 1)
+
 
-            print("Connected to the database...")
-            # Create the tables if they don't exist
-            AirSchema.__table__.create(bind=engine, checkfirst=True)
-            HeatSchema.__table__.create(bind=engine, checkfirst=True)
+def range_response(predictions: dict, years: np.ndarray, countries: List[str]) -> dict:
+    """Wraps the country by year predictions of the range endpoints.
+
+    Args:
+        predictions (dict): The per year predictions keyed by country.
+        years (np.ndarray): The years predicted.
+        countries (List[str]): The countries requested, if any.
+
+    Returns:
+        dict: The years and predictions, or an error if none of the requested
+        countries are in the dataset.
+    """
+    if countries and not predictions:
+        return {"error": "Country doesn't exist in the dataset"}
+
+    return {"years": years.tolist(), "countries": predictions}
 
-            print("Tables created...")
 
-            # Make sure completed.txt exists
-            with open("completed.txt", "a") as _:
-                pass
+def precomputed() -> bool:
+    """Whether or not to read the precomputed scores.
+
+    Until the warm up reads the database the API serves the coefficient
+    snapshot, the database may be down and only fail after the connect
+    timeout, so the predictions are worked out from the snapshot instead.
+    """
+    return coefficients.source != "snapshot"
+
+
+async def world_map(session: AsyncSession, kind: str, year: int) -> dict:
+    """Returns the prediction of every country in the year, from the
+    precomputed scores when the year is in them.
+
+    Args:
+        session (AsyncSession): Session to read the scores with.
+        kind (str): Either "air", "heat" or "score".
+        year (int): The year to predict.
 
+    Returns:
+        dict: The predictions keyed by country.
+    """
+    predictions = await year_scores(session, kind, year) if precomputed() else {}
+    if predictions:
+        return predictions
+
+    # Past the precomputed years, work them out from the coefficients.
+    prediction_engine = await coefficients.engine(session)
+    return getattr(prediction_engine, kind)(year)
+
+
+async def range_map(
+    session: AsyncSession,
+    kind: str,
+    years: np.ndarray,
+    countries: Optional[List[str]],
+) -> dict:
+    """Returns the range response of the countries for every year, from the
+    precomputed scores when all the years are in them.
+
+    Args:
+        session (AsyncSession): Session to read the scores with.
+        kind (str): Either "air", "heat" or "score".
+        years (np.ndarray): The years to predict.
+        countries (Optional[List[str]]): The countries requested, if any.
+
+    Returns:
+        dict: The years and predictions, see range_response.
+    """
+    predictions = None
+    if precomputed():
+        predictions = await range_scores(session, kind, years, countries)
+    if predictions is None:
+        prediction_engine = await coefficients.engine(session)
+        predictions = getattr(prediction_engine, f"{kind}_range")(years, countries)
+    return range_response(predictions, years, countries)
+
+
+async def shared_result(
+    session: AsyncSession,
+    endpoint: str,
+    year: str,
+    countries: Optional[List[str]],
+    compute: Callable[[], Awaitable[Any]],
+) -> Any:
+    """Returns a prediction map from the shared result cache, computing and
+    storing it on a miss.
+
+    Args:
+        session (AsyncSession): Session used if the coefficients are stale.
+        endpoint (str): The endpoint the map is for.
+        year (str): The year, or years, being predicted.
+        countries (Optional[List[str]]): The countries requested, if any.
+        compute (Callable[[], Awaitable[Any]]): Computes the map.
+
+    Returns:
+        Any: The prediction map.
+    """
+    version = await coefficients.version(session)
+    if results is None or version is None:
+        return await compute()
+
+    selected = ",".join(countries or [])
+    result = await results.get(version, endpoint, year, selected)
+    if result is None:
+        result = await compute()
+        await results.set(version, endpoint, year, selected, result)
+    return result
+
+
+async def not_modified(
+    request: Request, response: Response, session: AsyncSession, year: str
+) -> Optional[Response]:
+    """Tags the response with an ETag of the dataset version and prediction
+    year, and checks it against the one the client already has.
+
+    The predictions only change when a dataset is ingested or the year they
+    are for changes, so the ETag holds both. Nothing is tagged while the
+    tables are too big to cache, as there's no version to go by.
+
+    Args:
+        request (Request): The request, for its If-None-Match header.
+        response (Response): The response to set the caching headers on.
+        session (AsyncSession): Session used if the coefficients are stale.
+        year (str): The year, or years, being predicted.
+
+    Returns:
+        Optional[Response]: A 304 response if the client's copy is current,
+        otherwise None and the request carries on.
+    """
+    version = await coefficients.version(session)
+    if version is None:
+        return None
+
+    headers = {
+        "ETag": f'"{version[:20]}-{year}"',
+        "Cache-Control": f"public, max-age={HTTP_CACHE_MAX_AGE}",
+    }
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags or headers["ETag"] in [tag.replace("W/", "", 1) for tag in tags]:
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+def reconcile_snapshot(version: Optional[str]) -> None:
+    """Rewrites the coefficient snapshot if it doesn't hold the tables the
+    database does, e.g. it was never written or is from another ingest."""
+    if COEFFICIENT_SNAPSHOT is None:
+        return
+
+    current = snapshot.load(COEFFICIENT_SNAPSHOT)
+    if current is None or current.version != version:
+        print("Writing the coefficient snapshot...")
+        with session_local() as session:
+            snapshot.write_snapshot(session, COEFFICIENT_SNAPSHOT)
+
+
+def refresh_stale_scores() -> None:
+    """Refreshes the precomputed scores if they don't cover the horizon."""
+    with session_local() as session:
+        if scores_stale(session):
+            print("Precomputing scores...")
+            refresh_scores(session)
+
+
+async def prepare() -> None:
+    """Creates the tables, warms the connection pool and loads the caches."""
+    async with async_engine.begin() as connection:
+        print("Connected to the database...")
+        # Create the tables if they don't exist
+        for schema in TABLES:
+            await connection.run_sync(schema.__table__.create, checkfirst=True)
+
+    print("Tables created...")
+
+    # Open the pool's connections up front rather than on the first requests.
+    async with AsyncExitStack() as stack:
+        for _ in range(getattr(async_engine.pool, "size", lambda: 1)()):
+            await stack.enter_async_context(async_engine.connect())
+
+    async with async_session_local() as session:
+        await coefficients.load(session)
+        await completed_datasets.load(session)
+
+        # Carry over the datasets completed before the registry.
+        if os.path.exists("completed.txt"):
+            with open("completed.txt") as complete:
+                hashes = [line.strip() for line in complete if line.strip()]
+            await completed_datasets.import_hashes(session, hashes)
+
+        version = await coefficients.version(session)
+
+    print("Coefficients and completed datasets cached...")
+
+    await run_in_threadpool(reconcile_snapshot, version)
+
+    # Precompute the scores on first boot or when the year turned over.
+    await run_in_threadpool(refresh_stale_scores)
+
+
+async def warm_up() -> None:
+    """Prepares the API, retrying with exponential backoff until the database
+    is reachable, then starts the watcher."""
+    global warm
+    delay = STARTUP_RETRY_INITIAL
+    while True:
+        try:
+            await prepare()
             break
         except Exception as err:
-            print("Connection refused, restarting...", err)
-            sleep(5)
+            # Jittered, so replicas restarting together don't retry in step.
+            wait = random.uniform(delay / 2, delay)
+            print(f"Database unavailable, retrying in {wait:.1f}s...", err)
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, STARTUP_RETRY_MAX)
+
+    warm = True
+    print("Ready...")
+
+    if watcher is not None:
+        watcher.start()
+
+
+@app.on_event("startup")
+async def startup():
+    """On API startup, connect the SQL database in the background."""
+    global warm, warm_up_task
+    warm = False
+    if results is not None:
+        results.listen(coefficients.invalidate)
+
+    # Serve the last snapshot of the coefficients until the database is read.
+    if COEFFICIENT_SNAPSHOT is not None:
+        last = snapshot.load(COEFFICIENT_SNAPSHOT)
+        if last is not None:
+            coefficients.load_snapshot(last, until_loaded=True)
+            print(f"Serving the coefficient snapshot {last.version[:12]}...")
+
+    warm_up_task = asyncio.create_task(warm_up())
 
 
 @app.on_event("shutdown")
 async def shutdown():
     """On API shutdown, cleanly disconnect from the database."""
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await warm_up_task
+    if watcher is not None:
+        await watcher.stop()
+    jobs.shutdown()
+    if results is not None:
+        await results.close()
     engine.dispose()
+    await async_engine.dispose()
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness probe, answers as long as the event loop does."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz(response: Response):
+    """Readiness probe, the API is ready once the database is reachable, the
+    tables exist and the caches are loaded. While the database is unreachable
+    it's also ready, degraded, if the coefficients were loaded from the
+    snapshot or before the outage, as the predictions are served from them.
+
+    Returns:
+        dict: Each check, the status is 503 while any of them fail and the API
+        isn't degraded.
+    """
+
+    async def tables_present() -> bool:
+        async with async_engine.connect() as connection:
+            names = await connection.run_sync(
+                lambda sync: set(sqlalchemy.inspect(sync).get_table_names())
+            )
+        return all(schema.__tablename__ in names for schema in TABLES)
+
+    checks = {"database": False, "tables": False, "caches": warm}
+    try:
+        checks["tables"] = await asyncio.wait_for(tables_present(), READY_TIMEOUT)
+        checks["database"] = True
+    except Exception:
+        pass
+
+    degraded = not checks["database"] and coefficients.source is not None
+    if not all(checks.values()) and not degraded:
+        response.status_code = 503
+    return {**checks, "degraded": degraded}
 
 
 @app.get("/score")
 async def score(
+    request: Request,
+    response: Response,
     country: str = None,
     day: int = None,
     month: int = None,
     year: int = None,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     """Returns the score for the country and date inputted.
 
@@ -170,77 +580,51 @@ async def score(
         if country not in COUNTRIES:
             return {"error": "Country doesn't match schema."}
 
-        db_air_result = (
-            session.query(AirSchema).filter(AirSchema.country == country).first()
-        )
-        if db_air_result:
-            air_prediction_score = db_air_result.predict(prediction_date)
-
-        db_heat_result = (
-            session.query(HeatSchema).filter(HeatSchema.country == country).first()
-        )
-        if db_heat_result:
-            heat_prediction_score = db_heat_result.predict(prediction_date)
-
-        if not db_air_result and not db_heat_result:
-            return {"error": "Country doesn't exist in the dataset"}
+        scores = None
+        if precomputed():
+            scores = await country_scores(session, country, prediction_date)
+        if scores is not None:
+            prediction = scores.score
+        else:
+            db_air_result = await query(session, AirSchema, country)
+            if db_air_result:
+                air_prediction_score = db_air_result.predict(prediction_date)
 
-        return calculate_score(heat_prediction_score, air_prediction_score)
+            db_heat_result = await query(session, HeatSchema, country)
+            if db_heat_result:
+                heat_prediction_score = db_heat_result.predict(prediction_date)
 
-    # NOT EFFICIENT. MUST BE A BETTER WAY
-    country_scores = {}
-    countries_from_air_table = [row.country for row in session.query(AirSchema).all()]
-    countries_from_heat_table = [row.country for row in session.query(HeatSchema).all()]
+            if not db_air_result and not db_heat_result:
+                return {"error": "Country doesn't exist in the dataset"}
 
-    for iso3 in countries_from_air_table:
-        if iso3 in countries_from_heat_table:
-            db_air_result = query(session, AirSchema, iso3)
-            db_heat_result = query(session, HeatSchema, iso3)
-
-            country_scores[iso3] = calculate_score(
-                db_heat_result.predict(prediction_date) if db_heat_result else None,
-                db_air_result.predict(prediction_date) if db_air_result else None,
-            )
-
-        elif iso3 not in countries_from_heat_table:
-            db_air_result = query(session, AirSchema, iso3)
-
-            # Do this check here, don't want to run the function if both results are
-            # null
-            if not db_air_result:
-                continue
-
-            country_scores[iso3] = calculate_score(
-                None, db_air_result.predict(prediction_date)
-            )
+            prediction = calculate_score(heat_prediction_score, air_prediction_score)
 
-    for iso3 in countries_from_heat_table:
+        # Only a prediction is tagged, so errors aren't cached.
+        cached = await not_modified(request, response, session, str(prediction_date))
+        return prediction if cached is None else cached
 
-        # We want to ignore already traversed ISOs
-        if iso3 in countries_from_air_table:
-            continue
+    cached = await not_modified(request, response, session, str(prediction_date))
+    if cached is not None:
+        return cached
 
-        db_heat_result = query(session, HeatSchema, iso3)
-
-        # Do this check here, don't want to run the function if both results are
-        # null
-        if not db_heat_result:
-            continue
-
-        country_scores[iso3] = calculate_score(
-            db_heat_result.predict(prediction_date), None
-        )
-
-    return country_scores
+    return await shared_result(
+        session,
+        "score",
+        str(prediction_date),
+        None,
+        lambda: world_map(session, "score", prediction_date),
+    )
 
 
 @app.get("/air_pollution_prediction")
 async def air_pollution_prediction(
+    request: Request,
+    response: Response,
     country: str = None,
     day: int = None,
     month: int = None,
     year: int = None,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     """Returns a score from 0 to 1 for air quality for a country.
 
@@ -254,8 +638,10 @@ async def air_pollution_prediction(
             Defaults to None.
         year (int, optional): A user can specify a specific year to predict.
             Defaults to None.
-        session (Session, optional): Session yield to connect to the database.
-            Defaults to Depends(get_session).
+        session (AsyncSession, optional): Session yield to connect to the database.
+            Defaults to Depends(get_async_session).
+        request (Request): The request, for its If-None-Match header.
+        response (Response): The response the caching headers are set on.
 
     Returns:
         list: An array of dictionaries containing the country name and the
@@ -287,27 +673,44 @@ async def air_pollution_prediction(
         if country not in COUNTRIES:
             return {"error": "Country doesn't match schema"}
 
-        iso3_air_result = query(session, AirSchema, country)
-        if iso3_air_result:
-            return iso3_air_result.predict(prediction_date)
-
-        # Was null, entered country didn't fit in the database.
-        return {"error": "Country doesn't exist in the dataset"}
-
-    return {
-        item.country: item.predict(prediction_date)
-        for item in session.query(AirSchema).all()
-        if item is not None
-    }
+        scores = None
+        if precomputed():
+            scores = await country_scores(session, country, prediction_date)
+        if scores is not None and scores.has_air:
+            prediction = scores.air
+        else:
+            iso3_air_result = await query(session, AirSchema, country)
+            if not iso3_air_result:
+                # Was null, entered country didn't fit in the database.
+                return {"error": "Country doesn't exist in the dataset"}
+            prediction = iso3_air_result.predict(prediction_date)
+
+        # Only a prediction is tagged, so errors aren't cached.
+        cached = await not_modified(request, response, session, str(prediction_date))
+        return prediction if cached is None else cached
+
+    cached = await not_modified(request, response, session, str(prediction_date))
+    if cached is not None:
+        return cached
+
+    return await shared_result(
+        session,
+        "air_pollution_prediction",
+        str(prediction_date),
+        None,
+        lambda: world_map(session, "air", prediction_date),
+    )
 
 
 @app.get("/heat_prediction")
 async def heat_prediction(
+    request: Request,
+    response: Response,
     country: str = None,
     day: int = None,
     month: int = None,
     year: int = None,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     """Housing risk returns the current predictions on the input location and
     date
@@ -350,21 +753,212 @@ async def heat_prediction(
         if country not in COUNTRIES:
             return {"error": "Country doesn't match schema."}
 
-        iso3_heat_result = (
-            session.query(HeatSchema).filter(HeatSchema.country == country).first()
-        )
-        if iso3_heat_result:
-            return iso3_heat_result.predict(prediction_date)
+        scores = None
+        if precomputed():
+            scores = await country_scores(session, country, prediction_date)
+        if scores is not None and scores.has_heat:
+            prediction = scores.heat
+        else:
+            iso3_heat_result = await query(session, HeatSchema, country)
+            if not iso3_heat_result:
+                # The entered country may have been in the country list but
+                # not in the database yet.
+                return {"error": "Country doesn't exist in the dataset"}
+            prediction = iso3_heat_result.predict(prediction_date)
+
+        # Only a prediction is tagged, so errors aren't cached.
+        cached = await not_modified(request, response, session, str(prediction_date))
+        return prediction if cached is None else cached
+
+    cached = await not_modified(request, response, session, str(prediction_date))
+    if cached is not None:
+        return cached
+
+    return await shared_result(
+        session,
+        "heat_prediction",
+        str(prediction_date),
+        None,
+        lambda: world_map(session, "heat", prediction_date),
+    )
+
+
+@app.get("/score/range")
+async def score_range(
+    request: Request,
+    response: Response,
+    start_year: int = None,
+    end_year: int = None,
+    countries: List[str] = Query(None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Returns the score of each country for every year in the range.
 
-        # The entered country may have been in the country list but not in the
-        # database yet.
-        return {"error": "Country doesn't exist in the dataset"}
+    Args:
+        start_year (int, optional): First year to predict. Defaults to the
+            current year.
+        end_year (int, optional): Last year to predict. Defaults to the start
+            year.
+        countries (List[str], optional): Countries to return, defaults to
+            every country.
+        session (AsyncSession, optional): Session yield to connect to the database.
+            Defaults to Depends(get_async_session).
+        request (Request): The request, for its If-None-Match header.
+        response (Response): The response the caching headers are set on.
 
-    return {
-        item.country: item.predict(prediction_date)
-        for item in session.query(HeatSchema).all()
-        if item is not None
-    }
+    Returns:
+        dict: The years predicted and a list of scores per country, one for
+        each year.
+    """
+    years = year_range(start_year, end_year)
+    if isinstance(years, dict):
+        return years
+
+    if countries and any(country not in COUNTRIES for country in countries):
+        return {"error": "Country doesn't match schema."}
+
+    cached = await not_modified(request, response, session, f"{years[0]}-{years[-1]}")
+    if cached is not None:
+        return cached
+
+    return await shared_result(
+        session,
+        "score/range",
+        f"{years[0]}-{years[-1]}",
+        countries,
+        lambda: range_map(session, "score", years, countries),
+    )
+
+
+@app.get("/air_pollution_prediction/range")
+async def air_pollution_prediction_range(
+    request: Request,
+    response: Response,
+    start_year: int = None,
+    end_year: int = None,
+    countries: List[str] = Query(None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Returns the air quality score of each country for every year in the
+    range.
+
+    Args:
+        start_year (int, optional): First year to predict. Defaults to the
+            current year.
+        end_year (int, optional): Last year to predict. Defaults to the start
+            year.
+        countries (List[str], optional): Countries to return, defaults to
+            every country.
+        session (AsyncSession, optional): Session yield to connect to the database.
+            Defaults to Depends(get_async_session).
+        request (Request): The request, for its If-None-Match header.
+        response (Response): The response the caching headers are set on.
+
+    Returns:
+        dict: The years predicted and a list of pollution scores per country,
+        one for each year.
+    """
+    years = year_range(start_year, end_year)
+    if isinstance(years, dict):
+        return years
+
+    if countries and any(country not in COUNTRIES for country in countries):
+        return {"error": "Country doesn't match schema"}
+
+    cached = await not_modified(request, response, session, f"{years[0]}-{years[-1]}")
+    if cached is not None:
+        return cached
+
+    return await shared_result(
+        session,
+        "air_pollution_prediction/range",
+        f"{years[0]}-{years[-1]}",
+        countries,
+        lambda: range_map(session, "air", years, countries),
+    )
+
+
+@app.get("/heat_prediction/range")
+async def heat_prediction_range(
+    request: Request,
+    response: Response,
+    start_year: int = None,
+    end_year: int = None,
+    countries: List[str] = Query(None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Returns the heat score of each country for every year in the range.
+
+    Args:
+        start_year (int, optional): First year to predict. Defaults to the
+            current year.
+        end_year (int, optional): Last year to predict. Defaults to the start
+            year.
+        countries (List[str], optional): Countries to return, defaults to
+            every country.
+        session (AsyncSession, optional): Session yield to connect to the database.
+            Defaults to Depends(get_async_session).
+        request (Request): The request, for its If-None-Match header.
+        response (Response): The response the caching headers are set on.
+
+    Returns:
+        dict: The years predicted and a list of heat scores per country, one
+        for each year.
+    """
+    years = year_range(start_year, end_year)
+    if isinstance(years, dict):
+        return years
+
+    if countries and any(country not in COUNTRIES for country in countries):
+        return {"error": "Country doesn't match schema."}
+
+    cached = await not_modified(request, response, session, f"{years[0]}-{years[-1]}")
+    if cached is not None:
+        return cached
+
+    return await shared_result(
+        session,
+        "heat_prediction/range",
+        f"{years[0]}-{years[-1]}",
+        countries,
+        lambda: range_map(session, "heat", years, countries),
+    )
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Returns the hit, miss and reload counters of the coefficient cache,
+    along with the shared result cache's if there is one."""
+    stats = coefficients.stats()
+    if results is not None:
+        stats["results"] = results.stats()
+    return stats
+
+
+@app.get("/metrics")
+async def metrics():
+    """Returns the request, database, cache and ingest metrics in the
+    Prometheus text format."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/profiles/{profile_id}")
+async def profile_report(profile_id: str):
+    """Returns a profile taken while PROFILING_ENABLED is set.
+
+    Args:
+        profile_id (str): The id from the X-Profile-Id header of the profiled
+            response, or the profile of an upload's job.
+
+    Returns:
+        PlainTextResponse: The pstats report of the request and, for an
+        upload, of the ingest once it has finished.
+    """
+    text = await run_in_threadpool(report, profile_id)
+    if text is None:
+        return {"error": "Profile doesn't exist"}
+
+    return PlainTextResponse(text)
 
 
 @app.get("/upl/air")
@@ -393,27 +987,109 @@ async def main():
     return HTMLResponse(content=content)
 
 
-@app.post("/upl/air/file")
+async def save_upload(file: UploadFile) -> Tuple[str, str]:
+    """Writes the upload to a temporary file, hashing it in the same pass.
+
+    Args:
+        file (UploadFile): The uploaded dataset.
+
+    Returns:
+        Tuple[str, str]: The path of the temporary file and its hash.
+    """
+
+    def save() -> Tuple[str, str]:
+        suffix = os.path.splitext(file.filename or "")[1]
+        descriptor, path = tempfile.mkstemp(suffix=suffix, dir=INGEST_UPLOAD_DIR)
+        try:
+            with os.fdopen(descriptor, "wb") as buffer:
+                return path, copy_and_hash(file.file, buffer)
+        except BaseException:
+            os.remove(path)
+            raise
+
+    # Disk writes block, keep them off the event loop.
+    return await run_in_threadpool(save)
+
+
+async def queue_upload(
+    kind: str, file: UploadFile, request: Request, response: Response
+) -> dict:
+    """Saves the upload and queues it for ingest, unless the same dataset was
+    already ingested.
+
+    Args:
+        kind (str): Either "air" or "heat".
+        file (UploadFile): The uploaded dataset.
+        request (Request): The request, if it's being profiled the ingest is
+            profiled under the same id.
+        response (Response): The response, its status is set to 200 rather
+            than 202 when the dataset is skipped.
+
+    Returns:
+        dict: The job, poll /jobs/{id} for its progress.
+    """
+    path, file_hash = await save_upload(file)
+
+    if file_hash in completed_datasets:
+        os.remove(path)
+        response.status_code = 200
+        job = jobs.skip(kind, file.filename, file_hash)
+    else:
+        # The worker gets the hash, so it doesn't read the file again for it.
+        profile = getattr(request.state, "profile", None)
+        job = jobs.submit(
+            kind, path, file.filename, file_hash, remove=True, profile=profile
+        )
+
+    # Recorded before answering, the client may poll another worker.
+    await jobs.record(job)
+    return job.to_dict()
+
+
+@app.post("/upl/air/file", status_code=202)
 async def create_upload_file(
-    file: UploadFile = File(...), session: Session = Depends(get_session)
+    request: Request, response: Response, file: UploadFile = File(...)
 ):
-    # You can now save the file, process it, etc. For example, you can save it to disk with:
-    with open(file.filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    """Saves the uploaded air dataset and queues it for ingest.
 
-    generate_air(file.filename, session)
-    # Return a message or any information you want
-    return {"filename": file.filename}
+    Returns:
+        dict: The queued job, poll /jobs/{id} for its progress.
+    """
+    return await queue_upload("air", file, request, response)
 
 
-@app.post("/upl/heat/file")
+@app.post("/upl/heat/file", status_code=202)
 async def create_upload_file(
-    file: UploadFile = File(...), session: Session = Depends(get_session)
+    request: Request, response: Response, file: UploadFile = File(...)
 ):
-    # You can now save the file, process it, etc. For example, you can save it to disk with:
-    with open(file.filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    """Saves the uploaded heat dataset and queues it for ingest.
+
+    Returns:
+        dict: The queued job, poll /jobs/{id} for its progress.
+    """
+    return await queue_upload("heat", file, request, response)
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, session: AsyncSession = Depends(get_async_session)):
+    """Returns the state of an ingest job, accepted by this or another API
+    worker.
+
+    Args:
+        job_id (str): The id returned when the dataset was uploaded.
+        session (AsyncSession, optional): Session used to read the jobs of
+            the other workers. Defaults to Depends(get_async_session).
+
+    Returns:
+        dict: The job's state, rows read, countries fitted, seconds elapsed
+        and error if it failed.
+    """
+    job = jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+
+    recorded = await find_job(session, job_id)
+    if recorded is None:
+        return {"error": "Job doesn't exist"}
 
-    generate_heat(file.filename, session)
-    # Return a message or any information you want
-    return {"filename": file.filename}
+    return recorded
@@ -1,9 +1,22 @@
 from typing import Union
+import numpy as np
 import pandas as pd
 import os
+from models.datasets import read_chunks, read_dataset, read_header
+from models.env import INGEST_CHUNK_SIZE, INGEST_STREAM_THRESHOLD
 from models.logger import setup_logging_config
-from models.maths import linear_regression, get_hash, hash_already_completed
-from models.schemas import AirSchema
+from models.metrics import phase, timed
+from models.maths import (
+    grouped_linear_regression,
+    linear_regression_from_sums,
+    regression_terms,
+    get_hash,
+)
+from models.registry import claim
+from models.schemas import AirSchema, upsert
+from models.scores import refresh_scores
+from models.snapshot import write_snapshot
+import sqlalchemy
 from sqlalchemy.orm import Session
 
 log = setup_logging_config(__name__, "air.log")
@@ -35,32 +48,34 @@ def update_database(update_values: list[AirSchema], session: Session) -> bool:
     Returns:
         bool: Returns a bool based on the success of the function.
     """
-    for model in update_values:
-
-        result = (
-            session.query(AirSchema).filter(AirSchema.country == model.country).all()
-        )
-        result_length = len(result)
-
-        if result_length == 0:
-            session.add(model)
-
-        elif result_length == 1:
-            existing_record = result[0]
-
-            # Update co2_gradient and co2_offset if co2_gradient is provided
-            if model.co2_gradient is not None:
-                existing_record.co2_gradient = model.co2_gradient
-                existing_record.co2_offset = model.co2_offset
-
-            # Update no_gradient and no_offset if no_gradient is provided
-            if model.no_gradient is not None:
-                existing_record.no_gradient = model.no_gradient
-                existing_record.no_offset = model.no_offset
-
-        else:
-            log.error("This shouldn't happen.")
-            continue
+    table = AirSchema.__table__
+
+    def keep_existing_when_null(excluded, gradient: str, offset: str) -> dict:
+        # A NULL fit means the level wasn't in the dataset, keep the old one.
+        missing = excluded[gradient].is_(None)
+        return {
+            name: sqlalchemy.case((missing, table.c[name]), else_=excluded[name])
+            for name in (gradient, offset)
+        }
+
+    upsert(
+        session,
+        table,
+        [
+            {
+                "country": model.country,
+                "co2_gradient": model.co2_gradient,
+                "co2_offset": model.co2_offset,
+                "no_gradient": model.no_gradient,
+                "no_offset": model.no_offset,
+            }
+            for model in update_values
+        ],
+        lambda excluded: {
+            **keep_existing_when_null(excluded, "co2_gradient", "co2_offset"),
+            **keep_existing_when_null(excluded, "no_gradient", "no_offset"),
+        },
+    )
 
     log.info(
         "Successfully inserted Linear Regression Coefficients into the database..."
@@ -69,33 +84,25 @@ def update_database(update_values: list[AirSchema], session: Session) -> bool:
     return True
 
 
-def process_dataset(dataset_path: str) -> Union[list[AirSchema], None]:
-    """Parses the dataset and extracts the countries and their average
-    temperatures per date.
-
-    Uses pandas to read the CSV for the location that was returned by watchdog
-    it then checks to make sure that all the headers of the CSV match up. Then
-    parses them based on date and runs them through linear regression models.
+def locate_columns(columns: list[str]) -> Union[tuple, None]:
+    """Finds the columns needed for the regressions in the dataset headers.
 
     Args:
-        dataset_path (str): The path to the dataset CSV
+        columns (list[str]): The column headers of the dataset.
 
     Returns:
-        Union[list[LinearModel], None]: Returns a list of LinearModels schema
-        defined in the database, if there was an error. It will return nothing.
+        Union[tuple, None]: The country, date, carbon dioxide and nitrous oxide
+        column names, either of the last two may be None. Returns nothing if
+        the required columns weren't found.
     """
-
     date_column_name = None
     carbon_dioxide_levels = None
     nitrogen_oxide_levels = None
     country_column_name = None
 
-    # Read in the CSV file into pandas.
-    data = pd.read_csv(dataset_path)
-
     # Fuzz the column headers identified by pandas, both the date and
     # average temperature are needed to be passed.
-    for col in data.columns:
+    for col in columns:
         if col == "year":
             date_column_name = col
         elif col == "co2":
@@ -122,117 +129,237 @@ def process_dataset(dataset_path: str) -> Union[list[AirSchema], None]:
         )
         return
 
-    # Split the dataframes based on the country names
-    grouped = data.groupby(data[country_column_name])
+    return (
+        country_column_name,
+        date_column_name,
+        carbon_dioxide_levels,
+        nitrogen_oxide_levels,
+    )
+
 
-    nitrogen_linear_regression = None
-    carbon_linear_regression = None
+def build_models(
+    countries: pd.Index, columns: tuple, regressions: dict
+) -> list[AirSchema]:
+    """Creates the AirSchema rows from the regressions of every country.
 
-    # Iterates the dataframe by country
-    linear_models = []
-    for key in grouped.groups.keys():
-        country_dataframe = grouped.get_group(key)
+    Args:
+        countries (pd.Index): The countries, in the order of the regressions.
+        columns (tuple): The columns found by locate_columns.
+        regressions (dict): The gradients, offsets and degenerate masks keyed
+            by the level column they were fitted to.
 
-        # Iterate through the pandas group using itertuples, much faster than
-        # iterrows. Additionally, remove the enumerator added by pandas. Not
-        # necessary.
-        if nitrogen_oxide_levels and carbon_dioxide_levels:
-            nitrogen_linear_regression = linear_regression(
-                country_dataframe[date_column_name],
-                country_dataframe[nitrogen_oxide_levels],
-            )
+    Returns:
+        list[AirSchema]: The coefficients of every country.
+    """
+    carbon_dioxide_levels, nitrogen_oxide_levels = columns[2:]
 
-            carbon_linear_regression = linear_regression(
-                country_dataframe[date_column_name],
-                country_dataframe[carbon_dioxide_levels],
+    for name, (_, _, degenerate) in regressions.items():
+        if degenerate.any():
+            log.debug(
+                f"Not enough {name} readings to fit "
+                f"{', '.join(countries[degenerate])}, left as NaN."
             )
 
-            linear_models.append(
-                AirSchema(
-                    key,
-                    carbon_linear_regression.gradient,
-                    carbon_linear_regression.offset,
-                    nitrogen_linear_regression.gradient,
-                    nitrogen_linear_regression.offset,
-                )
-            )
+    def coefficients(name: str, index: int) -> tuple:
+        if name is None:
+            return None, None
+        gradient, offset, _ = regressions[name]
+        return float(gradient[index]), float(offset[index])
+
+    return [
+        AirSchema(
+            key,
+            *coefficients(carbon_dioxide_levels, index),
+            *coefficients(nitrogen_oxide_levels, index),
+        )
+        for index, key in enumerate(countries)
+    ]
 
-        elif nitrogen_oxide_levels and not carbon_dioxide_levels:
-            nitrogen_linear_regression = linear_regression(
-                country_dataframe[date_column_name],
-                country_dataframe[nitrogen_oxide_levels],
-            )
 
-            linear_models.append(
-                AirSchema(
-                    key,
-                    None,
-                    None,
-                    nitrogen_linear_regression.gradient,
-                    nitrogen_linear_regression.offset,
-                )
-            )
+def process_dataset(
+    dataset_path: str, stats: dict = None
+) -> Union[list[AirSchema], None]:
+    """Parses the dataset and extracts the countries and their average
+    temperatures per date.
+
+    Reads only the needed columns of the CSV, Parquet or Arrow file at the
+    location that was returned by watchdog, checking all the headers match
+    up. Then fits the linear regressions of every country at once.
+
+    Args:
+        dataset_path (str): The path to the dataset
+        stats (dict, optional): Filled in with the number of rows read.
+
+    Returns:
+        Union[list[LinearModel], None]: Returns a list of LinearModels schema
+        defined in the database, if there was an error. It will return nothing.
+    """
+    with phase(stats, "read"):
+        columns = locate_columns(read_header(dataset_path))
+        if columns is None:
+            return
+
+        country_column_name, date_column_name = columns[:2]
+        levels = [name for name in columns[2:] if name is not None]
+
+        # Read in the dataset into pandas.
+        data = read_dataset(
+            dataset_path, [country_column_name, date_column_name, *levels]
+        )
+    if stats is not None:
+        stats["rows"] = len(data)
+
+    # Number the countries in sorted order, the same order groupby gives.
+    with phase(stats, "parse"):
+        country_ids, countries = pd.factorize(data[country_column_name], sort=True)
 
-        elif carbon_dioxide_levels and not nitrogen_oxide_levels:
-            carbon_linear_regression = linear_regression(
-                country_dataframe[date_column_name],
-                country_dataframe[carbon_dioxide_levels],
+    with phase(stats, "regress"):
+        regressions = {
+            name: grouped_linear_regression(
+                data[date_column_name], data[name], country_ids, len(countries)
             )
+            for name in levels
+        }
+        return build_models(pd.Index(countries), columns, regressions)
+
+
+def stream_dataset(
+    dataset_path: str, chunksize: int = INGEST_CHUNK_SIZE, stats: dict = None
+) -> Union[list[AirSchema], None]:
+    """Streaming version of process_dataset for datasets too big for memory.
+
+    Reads the dataset in chunks and only keeps the per country sums the
+    regressions are solved from, so memory stays constant in the file size.
+    The resulting coefficients are the same as process_dataset's.
+
+    Args:
+        dataset_path (str): The path to the dataset
+        chunksize (int, optional): Number of rows read per chunk. Defaults to
+            INGEST_CHUNK_SIZE.
+        stats (dict, optional): Filled in with the number of rows read.
+
+    Returns:
+        Union[list[LinearModel], None]: Returns a list of LinearModels schema
+        defined in the database, if there was an error. It will return nothing.
+    """
+    columns = locate_columns(read_header(dataset_path))
+    if columns is None:
+        return
 
-            linear_models.append(
-                AirSchema(
-                    key,
-                    carbon_linear_regression.gradient,
-                    carbon_linear_regression.offset,
-                    None,
-                    None,
+    (
+        country_column_name,
+        date_column_name,
+        carbon_dioxide_levels,
+        nitrogen_oxide_levels,
+    ) = columns
+    levels = [name for name in columns[2:] if name is not None]
+
+    # Summed regression terms per country, one frame per level.
+    totals = {}
+    x_shift = None
+    rows = 0
+
+    chunks = read_chunks(
+        dataset_path, [country_column_name, date_column_name, *levels], chunksize
+    )
+    for chunk in timed(chunks, stats, "read"):
+        rows += len(chunk)
+        with phase(stats, "parse"):
+            x_axis = chunk[date_column_name].to_numpy(dtype=float)
+
+        # Shift the years by the first one seen to keep the squares small.
+        if x_shift is None and not np.isnan(x_axis).all():
+            x_shift = float(np.nanmin(x_axis))
+
+        with phase(stats, "regress"):
+            for name in levels:
+                terms = pd.DataFrame(
+                    regression_terms(x_axis - (x_shift or 0), chunk[name]),
+                    index=chunk.index,
+                )
+                part = terms.groupby(chunk[country_column_name]).sum()
+                totals[name] = (
+                    part if name not in totals else totals[name].add(part, fill_value=0)
                 )
-            )
 
-        else:
-            log.error("Neither carbon nor nitrogen found, this shouldn't happen...")
-            return
+    if stats is not None:
+        stats["rows"] = rows
 
-    return linear_models
+    if not totals:
+        log.error("The supplied dataset didn't contain any rows.")
+        return
+
+    with phase(stats, "regress"):
+        regressions = {
+            name: linear_regression_from_sums(
+                {column: totals[name][column].to_numpy() for column in totals[name]},
+                x_shift or 0,
+            )
+            for name in levels
+        }
+        return build_models(totals[levels[0]].index, columns, regressions)
 
 
-def generate_air(file: str, session: Session) -> None:
+def generate_air(
+    file: str, session: Session, stats: dict = None, file_hash: str = None
+) -> None:
     """Callback function from watchdog, called when a new file is created.
 
     This callback function is called when watchdog events detect that a new file
     was created in the specified directory. It will check to see if the file has
-    been seen already by checking the hash of the file and checking it against
-    the completed.txt file. If the file has not been seen before, it will parse.
+    been seen already by claiming the hash of the file in the dataset registry.
+    If the file hasn't been ingested, or isn't being ingested elsewhere, it
+    will parse.
 
     Args:
         event (_type_): Class of the event that was triggered.
+        stats (dict, optional): Filled in with the number of rows read and
+            countries fitted, whether the dataset was skipped as already
+            completed and the error if it couldn't be ingested.
+        file_hash (str, optional): The hash of the file if it's already
+            known, otherwise the file is read to hash it.
     """
+    stats = {} if stats is None else stats
+    stats.update(rows=0, countries=0, skipped=False, error=None, phases={})
+
     log.debug(f"File {file} has been identified, parsing...")
-    # Get the file path of the completed.txt file. Should be in the same
-    # directory as the datasets.
-    completed_file_path = "completed.txt"
 
-    # Get the fie hash
-    file_hash = get_hash(file)
+    # Get the fie hash, unless it was taken while the file was uploaded.
+    if file_hash is None:
+        with phase(stats, "read"):
+            file_hash = get_hash(file)
 
-    # Iterate through the completed file and check to see if the found hash
-    # was already processed successfully.
-    if hash_already_completed(completed_file_path, file_hash):
+    # Claim the dataset in the registry, if it was already processed, or
+    # another worker is processing it, there's nothing to do.
+    dataset = claim(session, file_hash, "air")
+    if dataset is None:
         log.warning(f"Moved {file_hash} has already been processed once...")
+        stats["skipped"] = True
         return
 
-    linear_regression_models = process_dataset(file)
-    if not linear_regression_models:
-        log.error("No linear regression models were found.")
-        return
+    # Leaving the block without completing the dataset releases the claim.
+    with dataset:
+        # Stream large datasets so they don't have to fit in memory.
+        if os.path.getsize(file) > INGEST_STREAM_THRESHOLD:
+            linear_regression_models = stream_dataset(file, INGEST_CHUNK_SIZE, stats)
+        else:
+            linear_regression_models = process_dataset(file, stats)
+        if not linear_regression_models:
+            log.error("No linear regression models were found.")
+            stats["error"] = "No linear regression models were found."
+            return
 
-    result = update_database(linear_regression_models, session)
-    if not result:
-        log.error("Unable to upload dataset to database...")
-        return
+        with phase(stats, "commit"):
+            result = update_database(linear_regression_models, session)
+            if not result:
+                log.error("Unable to upload dataset to database...")
+                stats["error"] = "Unable to upload dataset to database."
+                return
+            stats["countries"] = len(linear_regression_models)
+
+            # Serve the new coefficients' predictions straight away.
+            refresh_scores(session)
+            write_snapshot(session)
 
-    # If it returned successfully write the hash to the completed file.
-    if len(linear_regression_models) > 0:
-        with open(completed_file_path, "a+") as complete:
-            complete.write(file_hash + "\n")
-        log.info("Successfully updated completed file to include new dataset...")
+            dataset.complete(stats["rows"], stats["countries"])
+        log.info("Successfully registered the dataset as completed...")
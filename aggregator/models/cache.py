@@ -0,0 +1,285 @@
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+from time import monotonic
+from typing import Optional, Union
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.engine import PredictionEngine
+from models.logger import setup_logging_config
+from models.schemas import AirSchema, HeatSchema
+
+log = setup_logging_config(__name__, "cache.log")
+
+Schema = Union[AirSchema, HeatSchema]
+
+
+def fingerprint(tables: dict) -> str:
+    """Hashes the contents of the tables, equal tables give the same version
+    in every process.
+
+    Args:
+        tables (dict): The rows of each schema, keyed by country.
+
+    Returns:
+        str: The hex SHA-1 of the tables.
+    """
+    sha = sha1()
+    for schema, table in tables.items():
+        columns = [column.name for column in schema.__table__.columns]
+        for country in sorted(table):
+            row = table[country]
+            sha.update(repr([getattr(row, name) for name in columns]).encode())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+class CoefficientCache:
+    """Read-through cache for the air and heat coefficient tables.
+
+    The coefficient tables only change when a dataset is ingested, so the rows
+    are loaded into memory on startup and every prediction is served from the
+    cached copy. A reload builds a fresh snapshot and swaps it in one
+    assignment, readers never see a half loaded table. Each table holds at most
+    `max_size` countries, if a table is larger than that the cache falls back to
+    reading single countries through to the database. The TTL forces a reload
+    for when ingest happens in another process.
+
+    The cache can also be loaded from a coefficient snapshot, see
+    models.snapshot, so predictions are served while the database is down.
+    Once the cache holds the tables a failed reload keeps serving them.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300) -> None:
+        """Initializes an empty cache, call load to populate it.
+
+        Args:
+            max_size (int, optional): Maximum number of countries kept per
+                table. Defaults to 1024.
+            ttl (float, optional): Seconds before the cached tables are
+                considered stale and reloaded. Defaults to 300.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+        self._lock = Lock()
+        self._tables = {AirSchema: OrderedDict(), HeatSchema: OrderedDict()}
+        self._complete = False
+        self._engine = PredictionEngine([], [])
+        self._version = None
+        self._loaded_at = None
+
+        # Set while a snapshot is served until load is called, the tables
+        # aren't reloaded in between.
+        self._held = False
+
+        # Where the tables were last loaded from, "database" or "snapshot".
+        self.source = None
+
+    def _stale(self) -> bool:
+        """Whether or not the snapshot was invalidated or outlived the TTL."""
+        if self._held:
+            return False
+        return self._loaded_at is None or monotonic() - self._loaded_at >= self.ttl
+
+    async def load(self, session: AsyncSession) -> None:
+        """Loads both coefficient tables and atomically swaps them in.
+
+        Args:
+            session (AsyncSession): Session used to read the coefficient tables.
+        """
+        tables = {}
+        complete = True
+        for schema in (AirSchema, HeatSchema):
+            result = await session.execute(select(schema).limit(self.max_size + 1))
+            rows = result.scalars().all()
+            if len(rows) > self.max_size:
+                complete = False
+                rows = rows[: self.max_size]
+
+            tables[schema] = OrderedDict((row.country, row) for row in rows)
+
+        # The rows are only read from here on, detach them so they outlive the
+        # session that loaded them.
+        session.expunge_all()
+
+        self._swap(tables, complete, "database")
+        self._held = False
+
+    def load_snapshot(self, snapshot, until_loaded: bool = False) -> None:
+        """Swaps in the tables of a coefficient snapshot, e.g. while the
+        database is unreachable on startup.
+
+        Args:
+            snapshot (models.snapshot.Snapshot): A loaded snapshot.
+            until_loaded (bool, optional): Whether or not to serve the
+                snapshot until load is called, e.g. by the warm up, rather
+                than trying the database once the TTL runs out. Requests then
+                never wait on a database that's slow to fail. Defaults to
+                False.
+        """
+        tables = {
+            schema: OrderedDict((row.country, row) for row in snapshot.rows(schema))
+            for schema in (AirSchema, HeatSchema)
+        }
+        complete = all(len(table) <= self.max_size for table in tables.values())
+        if not complete:
+            tables = {
+                schema: OrderedDict(list(table.items())[: self.max_size])
+                for schema, table in tables.items()
+            }
+        self._swap(tables, complete, "snapshot")
+        self._held = until_loaded
+
+    def _swap(self, tables: dict, complete: bool, source: str) -> None:
+        """Builds the engine of the tables and swaps them in."""
+        engine = None
+        version = None
+        if complete:
+            engine = PredictionEngine(
+                list(tables[AirSchema].values()), list(tables[HeatSchema].values())
+            )
+            version = fingerprint(tables)
+
+        with self._lock:
+            self._tables = tables
+            self._complete = complete
+            self._engine = engine
+            self._version = version
+            self._loaded_at = monotonic()
+            self.source = source
+            self.reloads += 1
+
+    async def _reload(self, session: AsyncSession) -> None:
+        """Reloads the tables, keeps serving the ones already loaded if the
+        database can't be read. They're retried after another TTL."""
+        try:
+            await self.load(session)
+        except (SQLAlchemyError, OSError) as err:
+            if self.source is None:
+                raise
+            log.warning(
+                "Unable to reload the coefficients, serving the loaded ones.",
+                exc_info=err,
+            )
+            with self._lock:
+                self._loaded_at = monotonic()
+
+    async def version(self, session: AsyncSession) -> Optional[str]:
+        """Returns the version of the coefficient tables, reloading them if
+        they're stale.
+
+        Args:
+            session (AsyncSession): Session used if the database has to be
+                read.
+
+        Returns:
+            Optional[str]: A hash of the contents of both tables, None if the
+            tables are too big to cache.
+        """
+        if self._stale():
+            await self._reload(session)
+        return self._version
+
+    async def _use_snapshot(self, session: AsyncSession) -> bool:
+        """Reloads the snapshot if it's stale and counts the hit or miss.
+
+        Returns:
+            bool: Whether or not the snapshot holds the full tables.
+        """
+        if not self._stale() and self._complete:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        if self._stale():
+            await self._reload(session)
+        return self._complete
+
+    def invalidate(self) -> None:
+        """Marks the cache as stale, the next read reloads it."""
+        with self._lock:
+            self._loaded_at = None
+
+    async def get(
+        self, session: AsyncSession, schema: type, country: str
+    ) -> Optional[Schema]:
+        """Returns the coefficients of one country, reading through on a miss.
+
+        Args:
+            session (AsyncSession): Session used if the database has to be
+                read.
+            schema (type): Either AirSchema or HeatSchema.
+            country (str): The country to look up.
+
+        Returns:
+            Optional[Schema]: The coefficient row or None if the country isn't
+            in the dataset.
+        """
+        if self._stale():
+            await self._reload(session)
+
+        table = self._tables[schema]
+        row = table.get(country)
+        if row is not None or self._complete:
+            # A complete snapshot also answers for countries that don't exist.
+            self.hits += 1
+            if not self._complete:
+                table.move_to_end(country)
+            return row
+
+        self.misses += 1
+        result = await session.execute(select(schema).where(schema.country == country))
+        row = result.scalars().first()
+        if row is None:
+            return None
+
+        session.expunge(row)
+        with self._lock:
+            table[country] = row
+            while len(table) > self.max_size:
+                table.popitem(last=False)
+
+        return row
+
+    async def engine(self, session: AsyncSession) -> PredictionEngine:
+        """Returns the prediction engine holding every country's coefficients.
+
+        Args:
+            session (AsyncSession): Session used if the database has to be
+                read.
+
+        Returns:
+            PredictionEngine: Engine built from the cached tables, or from the
+            database when the tables are too big to cache.
+        """
+        if await self._use_snapshot(session):
+            return self._engine
+
+        return PredictionEngine(
+            (await session.execute(select(AirSchema))).scalars().all(),
+            (await session.execute(select(HeatSchema))).scalars().all(),
+        )
+
+    def stats(self) -> dict:
+        """Returns the cache counters.
+
+        Returns:
+            dict: The hit, miss and reload counters along with the number of
+            countries cached per table.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "air": len(self._tables[AirSchema]),
+            "heat": len(self._tables[HeatSchema]),
+            "complete": self._complete,
+            "version": self._version,
+            "source": self.source,
+        }
@@ -0,0 +1,155 @@
+from typing import Iterator, List
+import pandas as pd
+
+CSV = "csv"
+PARQUET = "parquet"
+ARROW = "arrow"
+ARROW_STREAM = "arrow_stream"
+
+# Leading bytes of the columnar formats, anything else is read as a CSV. Arrow
+# IPC files and Feather V2 are the same format, Arrow IPC streams start with a
+# continuation marker rather than a magic string.
+MAGIC_BYTES = (
+    (b"PAR1", PARQUET),
+    (b"ARROW1", ARROW),
+    (b"\xff\xff\xff\xff", ARROW_STREAM),
+)
+
+# Feather V1 predates the Arrow IPC format and pyarrow deprecated it.
+FEATHER_V1_MAGIC = b"FEA1"
+
+# Bytes checked for a NUL before a dataset is read as a CSV, text has none.
+TEXT_SAMPLE_SIZE = 1024
+
+
+def detect_format(path: str) -> str:
+    """Identifies the format of a dataset from its first bytes, so uploads
+    are read the same whatever their file name.
+
+    Args:
+        path (str): The path to the dataset.
+
+    Returns:
+        str: One of CSV, PARQUET, ARROW or ARROW_STREAM.
+
+    Raises:
+        ValueError: If the dataset is Feather V1 or another binary format,
+            rather than have the CSV reader fail on it.
+    """
+    with open(path, "rb") as dataset:
+        head = dataset.read(TEXT_SAMPLE_SIZE)
+
+    for magic, dataset_format in MAGIC_BYTES:
+        if head.startswith(magic):
+            return dataset_format
+
+    if head.startswith(FEATHER_V1_MAGIC):
+        raise ValueError(
+            "Unsupported dataset format Feather V1, write it as Feather V2."
+        )
+    if b"\0" in head:
+        raise ValueError("Unsupported dataset format, expected CSV, Parquet or Arrow.")
+    return CSV
+
+
+def read_header(path: str) -> List[str]:
+    """Returns the column names of the dataset without reading its rows."""
+    dataset_format = detect_format(path)
+    if dataset_format == PARQUET:
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(path).names
+
+    if dataset_format == ARROW:
+        import pyarrow as pa
+
+        return pa.ipc.open_file(pa.memory_map(path)).schema.names
+
+    if dataset_format == ARROW_STREAM:
+        import pyarrow as pa
+
+        return pa.ipc.open_stream(pa.memory_map(path)).schema.names
+
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def read_dataset(path: str, columns: List[str]) -> pd.DataFrame:
+    """Reads only the columns of the dataset.
+
+    The columnar formats are read straight into typed columns, without
+    parsing text, and dates stay datetimes.
+
+    Args:
+        path (str): The path to the dataset.
+        columns (List[str]): The columns to read.
+
+    Returns:
+        pd.DataFrame: The columns of every row.
+    """
+    dataset_format = detect_format(path)
+    if dataset_format == PARQUET:
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    elif dataset_format == ARROW:
+        import pyarrow.feather as feather
+
+        table = feather.read_table(path, columns=columns, memory_map=True)
+    elif dataset_format == ARROW_STREAM:
+        import pyarrow as pa
+
+        table = pa.ipc.open_stream(pa.memory_map(path)).read_all().select(columns)
+    else:
+        return pd.read_csv(path, usecols=columns)
+
+    return table.to_pandas(date_as_object=False)
+
+
+def read_chunks(
+    path: str, columns: List[str], chunksize: int
+) -> Iterator[pd.DataFrame]:
+    """Reads only the columns of the dataset, a chunk of rows at a time.
+
+    Parquet files are read a row group at a time and Arrow files and streams
+    a record batch at a time, so only the rows of one are decoded at once.
+
+    Args:
+        path (str): The path to the dataset.
+        columns (List[str]): The columns to read.
+        chunksize (int): The most rows in a chunk.
+
+    Yields:
+        pd.DataFrame: The columns of the next rows.
+    """
+    dataset_format = detect_format(path)
+    if dataset_format == PARQUET:
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(
+            batch_size=chunksize, columns=columns
+        )
+    elif dataset_format in (ARROW, ARROW_STREAM):
+        import pyarrow as pa
+
+        if dataset_format == ARROW:
+            reader = pa.ipc.open_file(pa.memory_map(path))
+            read = map(reader.get_batch, range(reader.num_record_batches))
+        else:
+            reader = pa.ipc.open_stream(pa.memory_map(path))
+            read = iter(reader)
+
+        indices = [reader.schema.get_field_index(name) for name in columns]
+        batches = (
+            pa.RecordBatch.from_arrays(
+                [batch.column(index) for index in indices], names=columns
+            )
+            for batch in read
+        )
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+
+    for batch in batches:
+        # Arrow files can be written in batches of any size.
+        for offset in range(0, batch.num_rows, chunksize):
+            yield batch.slice(offset, chunksize).to_pandas(date_as_object=False)
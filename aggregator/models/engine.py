@@ -0,0 +1,253 @@
+from typing import Iterable, Optional, Union
+import numpy as np
+from models.schemas import (
+    AirSchema,
+    HeatSchema,
+    CARBON_DIOXIDE_MAX_CONST,
+    NITROUS_OXIDE_MAX_CONST,
+    MAX_HEAT_CONST,
+)
+
+Years = Union[int, float, np.ndarray]
+
+
+def coefficient_column(rows: list, attribute: str) -> np.ndarray:
+    """Collects one coefficient of every row into a float array.
+
+    Mirrors the type check in AirSchema.predict, anything that isn't a float or
+    an int, such as a NULL column, is stored as NaN.
+
+    Args:
+        rows (list): The schema rows to read.
+        attribute (str): Name of the coefficient column.
+
+    Returns:
+        np.ndarray: Array of the coefficients, one per row.
+    """
+    values = [getattr(row, attribute) for row in rows]
+    return np.array(
+        [value if type(value) in (float, int) else np.nan for value in values],
+        dtype=float,
+    )
+
+
+def line(gradient: np.ndarray, offset: np.ndarray, years: Years) -> np.ndarray:
+    """Evaluates the linear equations of every country against the years.
+
+    A scalar year returns one value per country, an array of years returns a
+    country by year grid.
+
+    Args:
+        gradient (np.ndarray): The gradients, one per country.
+        offset (np.ndarray): The offsets, one per country.
+        years (Years): The year or years to predict.
+
+    Returns:
+        np.ndarray: The predicted values.
+    """
+    years = np.asarray(years, dtype=float)
+    shape = (-1,) + (1,) * years.ndim
+    return gradient.reshape(shape) + offset.reshape(shape) * years
+
+
+class PredictionEngine:
+    """Columnar version of the AirSchema and HeatSchema predictions.
+
+    Holds the coefficients of every country in NumPy arrays indexed by a dense
+    country id and evaluates the whole world in a handful of ufunc calls. The
+    None and NaN branches of the scalar code become masks, a value is
+    "present" where the scalar code would return something truthy.
+    """
+
+    def __init__(self, air_rows: list[AirSchema], heat_rows: list[HeatSchema]):
+        """Builds the coefficient arrays from the schema rows.
+
+        Countries are numbered in the order of the air rows followed by the
+        countries that only have heat rows, which is the order the scalar code
+        built the world map in.
+
+        Args:
+            air_rows (list[AirSchema]): Every row of the air table.
+            heat_rows (list[HeatSchema]): Every row of the heat table.
+        """
+        self.countries = list(
+            dict.fromkeys([row.country for row in (*air_rows, *heat_rows)])
+        )
+        self.index = index = {country: i for i, country in enumerate(self.countries)}
+
+        self.air_ids = np.array([index[row.country] for row in air_rows], dtype=int)
+        self.heat_ids = np.array([index[row.country] for row in heat_rows], dtype=int)
+
+        count = len(self.countries)
+        self.has_air = np.zeros(count, dtype=bool)
+        self.has_air[self.air_ids] = True
+        self.has_heat = np.zeros(count, dtype=bool)
+        self.has_heat[self.heat_ids] = True
+
+        def scatter(rows: list, attribute: str, ids: np.ndarray) -> np.ndarray:
+            column = np.full(count, np.nan)
+            column[ids] = coefficient_column(rows, attribute)
+            return column
+
+        self.co2_gradient = scatter(air_rows, "co2_gradient", self.air_ids)
+        self.co2_offset = scatter(air_rows, "co2_offset", self.air_ids)
+        self.no_gradient = scatter(air_rows, "no_gradient", self.air_ids)
+        self.no_offset = scatter(air_rows, "no_offset", self.air_ids)
+        self.avg_gradient = scatter(heat_rows, "avg_gradient", self.heat_ids)
+        self.avg_offset = scatter(heat_rows, "avg_offset", self.heat_ids)
+
+    def __len__(self) -> int:
+        return len(self.countries)
+
+    @staticmethod
+    def _normalize_air(values: np.ndarray, max_const: float) -> np.ndarray:
+        """Vector form of AirSchema.normalize_carbon_dioxide and
+        normalize_nitrous_oxide, negative values come back as NaN."""
+        with np.errstate(invalid="ignore"):
+            normalized = np.where(values > max_const, 1.0, values / (max_const - 0))
+            return np.where(values < 0, np.nan, normalized)
+
+    def predict_air(self, years: Years) -> tuple[np.ndarray, np.ndarray]:
+        """Vector form of AirSchema.predict for every country.
+
+        Args:
+            years (Years): The year or years to predict.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The air scores and the mask of where
+            the scalar code would have returned a value rather than None.
+        """
+        with np.errstate(invalid="ignore"):
+            carbon = line(self.co2_gradient, self.co2_offset, years)
+            nitrogen = line(self.no_gradient, self.no_offset, years)
+
+            carbon_valid = ~np.isnan(self.co2_gradient).reshape(
+                (-1,) + (1,) * (carbon.ndim - 1)
+            )
+            nitrogen_valid = ~np.isnan(self.no_gradient).reshape(
+                (-1,) + (1,) * (nitrogen.ndim - 1)
+            )
+
+            # Negative predictions are None in the scalar code and zero is
+            # falsy, neither count. NaN is truthy and carries through.
+            carbon_present = carbon_valid & ~(carbon < 0) & (carbon != 0)
+            nitrogen_present = nitrogen_valid & ~(nitrogen < 0) & (nitrogen != 0)
+
+            carbon = self._normalize_air(carbon, CARBON_DIOXIDE_MAX_CONST)
+            nitrogen = self._normalize_air(nitrogen, NITROUS_OXIDE_MAX_CONST)
+
+            scores = np.where(
+                carbon_present & nitrogen_present,
+                (carbon + nitrogen) / 2,
+                np.where(carbon_present, carbon, nitrogen),
+            )
+        return scores, carbon_present | nitrogen_present
+
+    def predict_heat(self, years: Years) -> tuple[np.ndarray, np.ndarray]:
+        """Vector form of HeatSchema.predict for every country.
+
+        Args:
+            years (Years): The year or years to predict.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The heat scores and the mask of the
+            countries that have heat coefficients.
+        """
+        temperature = line(self.avg_gradient, self.avg_offset, years)
+        with np.errstate(all="ignore"):
+            scores = np.where(
+                (temperature < 1) | (temperature > MAX_HEAT_CONST - 1),
+                1.0,
+                np.abs(np.log(MAX_HEAT_CONST / temperature - 1) / 5),
+            )
+        present = np.broadcast_to(
+            self.has_heat.reshape((-1,) + (1,) * (scores.ndim - 1)), scores.shape
+        )
+        return scores, present
+
+    def predict_score(self, years: Years) -> tuple[np.ndarray, np.ndarray]:
+        """Vector form of calculate_score over the air and heat predictions.
+
+        Args:
+            years (Years): The year or years to predict.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The combined scores and the mask of
+            where at least one of the air and heat scores counted.
+        """
+        air, air_present = self.predict_air(years)
+        heat, heat_present = self.predict_heat(years)
+
+        # Zero scores are skipped by calculate_score, same as None.
+        air_present = air_present & (air != 0)
+        heat_present = heat_present & (heat != 0)
+
+        counter = np.where(heat_present, heat, 0) + np.where(air_present, air, 0)
+        division_counter = heat_present.astype(int) + air_present.astype(int)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = counter / division_counter
+        return scores, division_counter > 0
+
+    def _to_dict(
+        self, ids: Iterable[int], values: np.ndarray, present: np.ndarray
+    ) -> dict:
+        """Converts the value arrays back into a country keyed dictionary, with
+        None where the value isn't present."""
+        values = values.tolist()
+        present = present.tolist()
+        return {self.countries[i]: values[i] if present[i] else None for i in ids}
+
+    def air(self, year: int) -> dict:
+        """Returns the air score of every country in the air table."""
+        return self._to_dict(self.air_ids.tolist(), *self.predict_air(year))
+
+    def heat(self, year: int) -> dict:
+        """Returns the heat score of every country in the heat table."""
+        return self._to_dict(self.heat_ids.tolist(), *self.predict_heat(year))
+
+    def score(self, year: int) -> dict:
+        """Returns the combined score of every country in either table."""
+        return self._to_dict(range(len(self)), *self.predict_score(year))
+
+    def _select(self, ids: np.ndarray, countries: Optional[list[str]]) -> list[int]:
+        """Restricts the ids to the requested countries, keeping the requested
+        order and dropping countries that aren't in the table."""
+        if countries is None:
+            return ids.tolist()
+
+        in_table = set(ids.tolist())
+        selected = (self.index.get(country) for country in dict.fromkeys(countries))
+        return [i for i in selected if i in in_table]
+
+    def _to_grid(
+        self, ids: Iterable[int], values: np.ndarray, present: np.ndarray
+    ) -> dict:
+        """Converts country by year arrays into a country keyed dictionary of
+        per year lists, with None where the value isn't present."""
+        values = values.tolist()
+        present = present.tolist()
+        return {
+            self.countries[i]: [
+                value if is_present else None
+                for value, is_present in zip(values[i], present[i])
+            ]
+            for i in ids
+        }
+
+    def air_range(self, years: np.ndarray, countries: list[str] = None) -> dict:
+        """Returns the air score of every country in the air table, or only the
+        requested countries, for each of the years."""
+        ids = self._select(self.air_ids, countries)
+        return self._to_grid(ids, *self.predict_air(years))
+
+    def heat_range(self, years: np.ndarray, countries: list[str] = None) -> dict:
+        """Returns the heat score of every country in the heat table, or only
+        the requested countries, for each of the years."""
+        ids = self._select(self.heat_ids, countries)
+        return self._to_grid(ids, *self.predict_heat(years))
+
+    def score_range(self, years: np.ndarray, countries: list[str] = None) -> dict:
+        """Returns the combined score of every country, or only the requested
+        countries, for each of the years."""
+        ids = self._select(np.arange(len(self)), countries)
+        return self._to_grid(ids, *self.predict_score(years))
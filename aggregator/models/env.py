@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 # Postgres failure misc settings.
 MAX_RETRY_COUNT = 1
 RETRY_SLEEP_COUNT = 5
@@ -254,4 +257,98 @@ COUNTRIES = [
     "AX",
 ]
 
-DATABASE_URL = "postgresql+psycopg2://postgres:postgres@db:5432/models"
+DATABASE_URL = os.getenv(
+    "DATABASE_URL", "postgresql+psycopg2://postgres:postgres@db:5432/models"
+)
+
+# The read endpoints connect through asyncpg, by default to the same database.
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    DATABASE_URL.replace("+psycopg2", "+asyncpg").replace(
+        "sqlite:", "sqlite+aiosqlite:", 1
+    ),
+)
+
+# Seconds the read endpoints wait for a database connection before failing, so
+# a database that's down but doesn't refuse connections isn't waited on for the
+# driver's default.
+DATABASE_CONNECT_TIMEOUT = float(os.getenv("DATABASE_CONNECT_TIMEOUT", "5"))
+
+# Coefficient cache settings. The size bounds the number of countries held per
+# table and the TTL forces a reload when ingest happens in another process.
+COEFFICIENT_CACHE_SIZE = int(os.getenv("COEFFICIENT_CACHE_SIZE", "1024"))
+COEFFICIENT_CACHE_TTL = int(os.getenv("COEFFICIENT_CACHE_TTL", "300"))
+
+# Longest span of years a single range request may ask for.
+MAX_RANGE_YEARS = int(os.getenv("MAX_RANGE_YEARS", "200"))
+
+# Datasets bigger than the threshold (in bytes) are streamed through ingest in
+# chunks of this many rows, so memory stays flat however big the file is.
+INGEST_STREAM_THRESHOLD = int(os.getenv("INGEST_STREAM_THRESHOLD", str(256 * 2**20)))
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000000"))
+
+# strptime format of the heat dataset's Date column. Left unset the format is
+# detected from the first date, falling back to pandas' own parsing.
+HEAT_DATE_FORMAT = os.getenv("HEAT_DATE_FORMAT") or None
+
+# Uploads are ingested in a pool of this many worker processes, further uploads
+# queue until a worker is free. Finished jobs are kept for /jobs up to the
+# history limit.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+
+# Uploads are written here while they're hashed, defaults to the system's
+# temporary directory.
+INGEST_UPLOAD_DIR = os.getenv("INGEST_UPLOAD_DIR") or None
+
+# Seconds after which a dataset claimed for ingest that never completed, e.g.
+# because its worker died, can be claimed again.
+DATASET_CLAIM_TIMEOUT = int(os.getenv("DATASET_CLAIM_TIMEOUT", "3600"))
+
+# Folders watched for new air and heat datasets, watching is off while unset.
+# A dropped file is ingested once it hasn't changed for the debounce seconds.
+WATCH_AIR_DIR = os.getenv("WATCH_AIR_DIR") or None
+WATCH_HEAT_DIR = os.getenv("WATCH_HEAT_DIR") or None
+WATCH_DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", "2"))
+
+# Seconds browsers and the frontend may reuse a prediction before checking its
+# ETag with the API again.
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))
+
+# Redis shared by the API workers and replicas for computed prediction maps,
+# the result cache is off while unset. Results are kept for the TTL seconds.
+REDIS_URL = os.getenv("REDIS_URL") or None
+REDIS_RESULT_TTL = int(os.getenv("REDIS_RESULT_TTL", "3600"))
+
+# Years past the current one the scores are precomputed for at ingest, later
+# years are computed from the coefficients on request.
+SCORE_HORIZON_YEARS = int(os.getenv("SCORE_HORIZON_YEARS", "100"))
+
+# Per request profiling, off unless PROFILING_ENABLED is 1. A request is
+# profiled when it sends an X-Profile: 1 header or ?profile=1, and every Nth
+# request is when the sample interval is set. Profiles are kept in the folder,
+# the newest PROFILE_KEEP of them.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(
+    tempfile.gettempdir(), "aggregator-profiles"
+)
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+
+# Statements taking at least this many milliseconds are logged along with
+# their parameters and the route that issued them.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+
+# Seconds startup waits before retrying an unreachable database, doubling on
+# every attempt up to the maximum.
+STARTUP_RETRY_INITIAL = float(os.getenv("STARTUP_RETRY_INITIAL", "0.5"))
+STARTUP_RETRY_MAX = float(os.getenv("STARTUP_RETRY_MAX", "30"))
+
+# Seconds /readyz waits on the database before reporting it unreachable.
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))
+
+# Binary snapshot of both coefficient tables, written on every ingest. The API
+# serves from it while the database is unreachable, set it empty to disable.
+COEFFICIENT_SNAPSHOT = (
+    os.getenv("COEFFICIENT_SNAPSHOT", "coefficients.snapshot") or None
+)
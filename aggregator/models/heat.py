@@ -1,14 +1,28 @@
-import sys
-from typing import List, Union
-from time import sleep
-import psycopg2
+from datetime import datetime
+from typing import List, Tuple, Union
 import pandas as pd
 import os
-import numpy as np
+from models.datasets import read_chunks, read_dataset, read_header
 from models.logger import setup_logging_config
-from models.maths import linear_regression, get_hash, hash_already_completed
-from models.schemas import HeatSchema
-from models.env import MAX_RETRY_COUNT, RETRY_SLEEP_COUNT
+from models.metrics import phase, timed
+from models.maths import (
+    grouped_linear_regression,
+    linear_regression_from_sums,
+    regression_terms,
+    segment_sums,
+    get_hash,
+)
+from models.registry import claim
+from models.schemas import HeatSchema, upsert
+from models.scores import refresh_scores
+from models.snapshot import write_snapshot
+from models.env import (
+    HEAT_DATE_FORMAT,
+    INGEST_CHUNK_SIZE,
+    INGEST_STREAM_THRESHOLD,
+    MAX_RETRY_COUNT,
+    RETRY_SLEEP_COUNT,
+)
 from sqlalchemy.orm import Session
 
 log = setup_logging_config(__name__, "heat.log")
@@ -40,18 +54,17 @@ def update_database(update_values: List[HeatSchema], session: Session) -> bool:
     Returns:
         bool: Returns a bool based on the success of the function.
     """
-    for model in update_values:
-
-        result = (
-            session.query(HeatSchema).filter(HeatSchema.country == model.country).all()
-        )
-        result_length = len(result)
-
-        if result_length == 0:
-            session.add(model)
-        else:
-            log.error("This shouldn't happen.")
-            continue
+    table = HeatSchema.__table__
+    columns = [column.name for column in table.columns]
+
+    upsert(
+        session,
+        table,
+        [{name: getattr(model, name) for name in columns} for model in update_values],
+        lambda excluded: {
+            name: excluded[name] for name in columns if name != "country"
+        },
+    )
 
     log.info(
         "Successfully inserted Linear Regression Coefficients into the database..."
@@ -60,32 +73,28 @@ def update_database(update_values: List[HeatSchema], session: Session) -> bool:
     return True
 
 
-def process_dataset(dataset_path: str) -> Union[List[HeatSchema], None]:
-    """Parses the dataset and extracts the countries and their average
-    temperatures per date.
+# How the per year minimum, maximum and first date of each country are
+# aggregated, partial aggregates of the same year merge with the same rules.
+EXTREMES = {"min": "min", "max": "max", "date": "min"}
+
 
-    Uses pandas to read the CSV for the location that was returned by watchdog
-    it then checks to make sure that all the headers of the CSV match up. Then
-    parses them based on date and runs them through linear regression models.
+def locate_columns(columns: List[str]) -> Union[tuple, None]:
+    """Finds the columns needed for the regressions in the dataset headers.
 
     Args:
-        dataset_path (str): The path to the dataset CSV
+        columns (list[str]): The column headers of the dataset.
 
     Returns:
-        Union[list[LinearModel], None]: Returns a list of LinearModels schema
-        defined in the database, if there was an error. It will return nothing.
+        Union[tuple, None]: The date, temperature and country column names.
+        Returns nothing if any of them weren't found.
     """
-
     date_column_name = None
     temp_column_name = None
     country_column_name = None
 
-    # Read in the CSV file into pandas.
-    data = pd.read_csv(dataset_path)
-
     # Fuzz the column headers identified by pandas, both the date and
     # average temperature are needed to be passed.
-    for col in data.columns:
+    for col in columns:
         if col == "Date":
             date_column_name = col
         elif col == "AverageTemperature":
@@ -95,18 +104,6 @@ def process_dataset(dataset_path: str) -> Union[List[HeatSchema], None]:
         else:
             pass
 
-    # Format the date column as a datetime format
-    data[date_column_name] = pd.to_datetime(data[date_column_name])
-
-    # Create a new column with the name or the original with "_formatted", this
-    # contains the date in a formatted string e.g. 01-01-2000 = 20000101
-    # This is so that we can easily manipulate the numbers dates without having
-    # to worry strongly about parsing to a datetime format later.
-    date_formatted_column = f"{date_column_name}_formatted"
-    data[date_formatted_column] = (
-        data[date_column_name].dt.strftime("%Y%m%d").astype(int)
-    )
-
     # If not all the required information was found, raise error and return.
     if country_column_name is None:
         log.debug("Couldn't locate the country column in the supplied dataset.")
@@ -120,97 +117,371 @@ def process_dataset(dataset_path: str) -> Union[List[HeatSchema], None]:
         log.debug("Couldn't locate the temperature column in the supplied dataset.")
         return
 
-    # Split the dataframes based on the country names
-    grouped = data.groupby(data[country_column_name])
+    return date_column_name, temp_column_name, country_column_name
 
-    # Iterates the dataframe by country
-    linear_models = []
-    for key in grouped.groups.keys():
-        country_dataframe = grouped.get_group(key)
 
-        # Iterate through the pandas group using itertuples, much faster than
-        # iterrows. Additionally, remove the enumerator added by pandas. Not
-        # necessary
-        country_by_year = country_dataframe.groupby(
-            country_dataframe[date_column_name].dt.year
-        )
+# Date formats tried against the first date of a dataset, in order. Only
+# formats pandas would read the same way without one are listed, so a detected
+# format never changes the parsed dates.
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d", "%m/%d/%Y")
 
-        pandas_data = {"min": [], "max": [], "date": []}
 
-        for year in country_by_year.groups.keys():
-            year_group = country_by_year.get_group(year)
-            temperatures_per_country_per_year = year_group[temp_column_name]
-            temperatures_per_country_per_year_date = year_group[date_formatted_column]
+def detect_date_format(dates: pd.Series) -> Union[str, None]:
+    """Finds the format of the date column from its first date.
 
-            pandas_data["max"].append(np.amax(temperatures_per_country_per_year))
+    Args:
+        dates (pd.Series): The raw date column.
 
-            pandas_data["min"].append(np.amin(temperatures_per_country_per_year))
+    Returns:
+        Union[str, None]: The first of DATE_FORMATS the first date matches,
+        nothing if it matches none of them.
+    """
+    first = dates.dropna().iloc[:1]
+    if first.empty:
+        return
 
-            pandas_data["date"].append(min(temperatures_per_country_per_year_date))
+    for date_format in DATE_FORMATS:
+        try:
+            datetime.strptime(str(first.iloc[0]), date_format)
+        except ValueError:
+            continue
+        return date_format
+
+
+def parse_dates(dates: pd.Series, date_format: str = None) -> pd.Series:
+    """Parses the date column, with a fixed format where there's one.
 
-        pandas_dataframe = pd.DataFrame(data=pandas_data)
+    Parsing every date against a known format skips pandas inferring the
+    format of each value. If the column doesn't all match the format it's
+    parsed the way pandas would without one.
 
-        average_linear_regression = linear_regression(
-            country_dataframe[date_formatted_column],
-            country_dataframe[temp_column_name],
+    Args:
+        dates (pd.Series): The raw date column.
+        date_format (str, optional): The strptime format of the dates.
+            Defaults to HEAT_DATE_FORMAT, or the detected format.
+
+    Returns:
+        pd.Series: The parsed dates.
+    """
+    # Parquet and Arrow datasets can store the dates as dates already.
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+
+    date_format = date_format or HEAT_DATE_FORMAT or detect_date_format(dates)
+    if date_format is not None:
+        try:
+            return pd.to_datetime(dates, format=date_format)
+        except (TypeError, ValueError):
+            log.debug(f"Not every date matches {date_format}, inferring them.")
+
+    return pd.to_datetime(dates)
+
+
+def format_dates(dates: pd.Series) -> pd.Series:
+    """Returns the dates as integers e.g. 01-01-2000 = 20000101.
+
+    Computed from the date fields rather than through strftime, which would
+    format every date to a string and parse it back.
+
+    Args:
+        dates (pd.Series): The parsed dates.
+
+    Returns:
+        pd.Series: The formatted dates, NaN where the date is missing.
+    """
+    return dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+
+
+def first_date(dates: pd.Series, date_format: str = None) -> float:
+    """Returns the first date of the column in its formatted integer form, or
+    zero if the column has no dates."""
+    first = dates.dropna().iloc[:1]
+    if first.empty:
+        return 0.0
+    return float(format_dates(parse_dates(first, date_format)).iloc[0])
+
+
+def summarize(
+    data: pd.DataFrame,
+    columns: tuple,
+    x_shift: float,
+    date_format: str = None,
+    stats: dict = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Reduces rows of the dataset to what the regressions need.
+
+    Both results are per country aggregates of the rows, so the summaries of
+    separate chunks of a dataset can be merged into the summary of the whole.
+
+    Args:
+        data (pd.DataFrame): Rows of the dataset.
+        columns (tuple): The columns found by locate_columns.
+        x_shift (float): The constant subtracted from the formatted dates
+            before summing.
+        date_format (str, optional): The format of the dates, see
+            parse_dates.
+        stats (dict, optional): Filled in with the time spent parsing and
+            reducing, see models.metrics.phase.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: The summed regression terms of the
+        average temperature per country, and the minimum and maximum
+        temperature along with the first formatted date per country per year.
+    """
+    date_column_name, temp_column_name, country_column_name = columns
+
+    # Format the date column as a datetime format, then as an integer e.g.
+    # 01-01-2000 = 20000101 so the dates can be regressed against.
+    with phase(stats, "parse"):
+        dates = parse_dates(data[date_column_name], date_format)
+        dates_formatted = format_dates(dates)
+        countries = data[country_column_name]
+        temperatures = data[temp_column_name]
+
+        country_ids, country_names = pd.factorize(countries, sort=True)
+
+    with phase(stats, "regress"):
+        average_totals = pd.DataFrame(
+            segment_sums(
+                regression_terms(dates_formatted - x_shift, temperatures),
+                country_ids,
+                len(country_names),
+            ),
+            index=pd.Index(country_names, name=country_column_name),
         )
 
-        min_linear_regression = linear_regression(
-            pandas_dataframe["date"], pandas_dataframe["min"]
+        yearly_extremes = (
+            pd.DataFrame(
+                {"min": temperatures, "max": temperatures, "date": dates_formatted}
+            )
+            .groupby([countries, dates.dt.year])
+            .agg(EXTREMES)
         )
 
-        max_linear_regression = linear_regression(
-            pandas_dataframe["date"], pandas_dataframe["max"]
+    return average_totals, yearly_extremes
+
+
+def fit(
+    average_totals: pd.DataFrame, yearly_extremes: pd.DataFrame, x_shift: float
+) -> List[HeatSchema]:
+    """Solves the average, minimum and maximum regressions of every country.
+
+    Args:
+        average_totals (pd.DataFrame): The summed regression terms of the
+            average temperature per country, as returned by summarize.
+        yearly_extremes (pd.DataFrame): The yearly extremes per country, as
+            returned by summarize.
+        x_shift (float): The constant the dates were shifted by.
+
+    Returns:
+        list[HeatSchema]: The coefficients of every country.
+    """
+    countries = average_totals.index
+    average_gradients, average_offsets, degenerate = linear_regression_from_sums(
+        {column: average_totals[column].to_numpy() for column in average_totals},
+        x_shift,
+    )
+
+    # Regress the yearly extremes against the first date of each year.
+    country_ids = countries.get_indexer(yearly_extremes.index.get_level_values(0))
+    min_gradients, min_offsets, min_degenerate = grouped_linear_regression(
+        yearly_extremes["date"], yearly_extremes["min"], country_ids, len(countries)
+    )
+    max_gradients, max_offsets, max_degenerate = grouped_linear_regression(
+        yearly_extremes["date"], yearly_extremes["max"], country_ids, len(countries)
+    )
+
+    degenerate = degenerate | min_degenerate | max_degenerate
+    if degenerate.any():
+        log.debug(
+            f"Not enough readings to fit {', '.join(countries[degenerate])}, "
+            "their coefficients are left as NaN."
         )
 
-        linear_models.append(
-            HeatSchema(
-                key,
-                min_linear_regression.gradient,
-                min_linear_regression.offset,
-                average_linear_regression.gradient,
-                average_linear_regression.offset,
-                max_linear_regression.gradient,
-                max_linear_regression.offset,
-            )
+    return [
+        HeatSchema(key, *coefficients)
+        for key, *coefficients in zip(
+            countries,
+            min_gradients.tolist(),
+            min_offsets.tolist(),
+            average_gradients.tolist(),
+            average_offsets.tolist(),
+            max_gradients.tolist(),
+            max_offsets.tolist(),
         )
+    ]
+
+
+def process_dataset(
+    dataset_path: str, stats: dict = None
+) -> Union[List[HeatSchema], None]:
+    """Parses the dataset and extracts the countries and their average
+    temperatures per date.
+
+    Reads only the needed columns of the CSV, Parquet or Arrow file at the
+    location that was returned by watchdog, checking all the headers match
+    up. Then reduces every country and year at once and solves the linear
+    regressions of all the countries together.
+
+    Args:
+        dataset_path (str): The path to the dataset
+        stats (dict, optional): Filled in with the number of rows read.
+
+    Returns:
+        Union[list[LinearModel], None]: Returns a list of LinearModels schema
+        defined in the database, if there was an error. It will return nothing.
+    """
+    with phase(stats, "read"):
+        columns = locate_columns(read_header(dataset_path))
+        if columns is None:
+            return
+
+        # Read in the dataset into pandas.
+        data = read_dataset(dataset_path, list(columns))
+    if stats is not None:
+        stats["rows"] = len(data)
+
+    if data.empty:
+        log.debug("The supplied dataset didn't contain any rows.")
+        return []
+
+    # Shift the dates by the first one to keep the squares small.
+    with phase(stats, "parse"):
+        date_format = HEAT_DATE_FORMAT or detect_date_format(data[columns[0]])
+        x_shift = first_date(data[columns[0]], date_format)
+
+    summary = summarize(data, columns, x_shift, date_format, stats)
+    with phase(stats, "regress"):
+        return fit(*summary, x_shift)
+
 
-    return linear_models
+def stream_dataset(
+    dataset_path: str, chunksize: int = INGEST_CHUNK_SIZE, stats: dict = None
+) -> Union[List[HeatSchema], None]:
+    """Streaming version of process_dataset for datasets too big for memory.
 
+    Reads the dataset in chunks, keeping the summed regression terms of the
+    average temperature per country and the running min and max temperature
+    per country per year. Memory stays constant in the file size and the
+    resulting coefficients are the same as process_dataset's.
 
-def generate_heat(path: str, session: Session):
+    Args:
+        dataset_path (str): The path to the dataset
+        chunksize (int, optional): Number of rows read per chunk. Defaults to
+            INGEST_CHUNK_SIZE.
+        stats (dict, optional): Filled in with the number of rows read.
+
+    Returns:
+        Union[list[LinearModel], None]: Returns a list of LinearModels schema
+        defined in the database, if there was an error. It will return nothing.
+    """
+    columns = locate_columns(read_header(dataset_path))
+    if columns is None:
+        return
+
+    average_totals = None
+    yearly_extremes = None
+    x_shift = None
+    date_format = None
+    rows = 0
+
+    chunks = read_chunks(dataset_path, list(columns), chunksize)
+    for chunk in timed(chunks, stats, "read"):
+        rows += len(chunk)
+        if not len(chunk):
+            continue
+
+        # Shift the dates by the first one seen to keep the squares small.
+        if x_shift is None:
+            date_format = HEAT_DATE_FORMAT or detect_date_format(chunk[columns[0]])
+            x_shift = first_date(chunk[columns[0]], date_format)
+
+        totals, extremes = summarize(chunk, columns, x_shift, date_format, stats)
+        if average_totals is None:
+            average_totals, yearly_extremes = totals, extremes
+            continue
+
+        with phase(stats, "regress"):
+            average_totals = average_totals.add(totals, fill_value=0)
+
+            # A year can straddle two chunks, merge the partial extremes.
+            yearly_extremes = (
+                pd.concat([yearly_extremes, extremes])
+                .groupby(level=[0, 1])
+                .agg(EXTREMES)
+            )
+
+    if stats is not None:
+        stats["rows"] = rows
+
+    if average_totals is None:
+        log.debug("The supplied dataset didn't contain any rows.")
+        return
+
+    with phase(stats, "regress"):
+        return fit(average_totals, yearly_extremes, x_shift)
+
+
+def generate_heat(
+    path: str, session: Session, stats: dict = None, file_hash: str = None
+):
     """Callback function from watchdog, called when a new file is created.
 
     This callback function is called when watchdog events detect that a new file
     was created in the specified directory. It will check to see if the file has
-    been seen already by checking the hash of the file and checking it against
-    the completed.txt file. If the file has not been seen before, it will parse.
+    been seen already by claiming the hash of the file in the dataset registry.
+    If the file hasn't been ingested, or isn't being ingested elsewhere, it
+    will parse.
 
     Args:
         event (_type_): Class of the event that was triggered.
+        stats (dict, optional): Filled in with the number of rows read and
+            countries fitted, whether the dataset was skipped as already
+            completed and the error if it couldn't be ingested.
+        file_hash (str, optional): The hash of the file if it's already
+            known, otherwise the file is read to hash it.
     """
+    stats = {} if stats is None else stats
+    stats.update(rows=0, countries=0, skipped=False, error=None, phases={})
+
     log.debug(f"File {path} has been identified, parsing...")
-    # Get the file path of the completed.txt file. Should be in the same
-    # directory as the datasets.
-    completed_file_path = "completed.txt"
 
-    # Get the fie hash
-    file_hash = get_hash(path)
+    # Get the fie hash, unless it was taken while the file was uploaded.
+    if file_hash is None:
+        with phase(stats, "read"):
+            file_hash = get_hash(path)
 
-    # Iterate through the completed file and check to see if the found hash
-    # was already processed successfully.
-    if hash_already_completed(completed_file_path, file_hash):
+    # Claim the dataset in the registry, if it was already processed, or
+    # another worker is processing it, there's nothing to do.
+    dataset = claim(session, file_hash, "heat")
+    if dataset is None:
         log.debug(f"Moved {file_hash} has already been processed once...")
+        stats["skipped"] = True
         return
 
-    linear_regression_models = process_dataset(path)
-    result = update_database(linear_regression_models, session)
-    if not result:
-        log.debug("Unable to upload dataset to database...")
-        return
-
-    # If it returned successfully write the hash to the completed file.
-    if len(linear_regression_models) > 0:
-        with open(completed_file_path, "a+") as complete:
-            complete.write(file_hash + "\n")
-        log.debug("Successfully updated completed file to include new dataset...")
+    # Leaving the block without completing the dataset releases the claim.
+    with dataset:
+        # Stream large datasets so they don't have to fit in memory.
+        if os.path.getsize(path) > INGEST_STREAM_THRESHOLD:
+            linear_regression_models = stream_dataset(path, INGEST_CHUNK_SIZE, stats)
+        else:
+            linear_regression_models = process_dataset(path, stats)
+        if not linear_regression_models:
+            log.debug("No linear regression models were found.")
+            stats["error"] = "No linear regression models were found."
+            return
+
+        with phase(stats, "commit"):
+            result = update_database(linear_regression_models, session)
+            if not result:
+                log.debug("Unable to upload dataset to database...")
+                stats["error"] = "Unable to upload dataset to database."
+                return
+            stats["countries"] = len(linear_regression_models)
+
+            # Serve the new coefficients' predictions straight away.
+            refresh_scores(session)
+            write_snapshot(session)
+
+            dataset.complete(stats["rows"], stats["countries"])
+        log.debug("Successfully registered the dataset as completed...")
@@ -0,0 +1,339 @@
+import asyncio
+import multiprocessing
+import os
+from collections import OrderedDict
+from contextlib import suppress
+from concurrent.futures import ProcessPoolExecutor
+from time import monotonic, time
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+from models.env import DATABASE_URL
+from models.logger import setup_logging_config
+from models.metrics import observe_ingest
+from models.profiling import profiled
+
+log = setup_logging_config(__name__, "jobs.log")
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# The order of the states, a job only ever moves to a later stage.
+STAGES = {QUEUED: 0, RUNNING: 1, COMPLETED: 2, FAILED: 2}
+
+# Session factory of a worker process, created by the first job it runs.
+_worker_sessions = None
+
+
+def ingest(
+    kind: str,
+    path: str,
+    file_hash: str = None,
+    remove: bool = False,
+    profile: str = None,
+) -> dict:
+    """Ingests a dataset, run inside a worker process of the job queue.
+
+    Each worker connects to the database on its own, engines can't be shared
+    with the process that submitted the job.
+
+    Args:
+        kind (str): Either "air" or "heat".
+        path (str): The path to the dataset.
+        file_hash (str, optional): The hash of the dataset, if it's known.
+        remove (bool, optional): Whether or not to delete the dataset once
+            it's ingested. Defaults to False.
+        profile (str, optional): Profile id to run the ingest under cProfile
+            with, see models.profiling. Defaults to None.
+
+    Returns:
+        dict: The stats filled in by generate_air or generate_heat.
+    """
+    global _worker_sessions
+    if _worker_sessions is None:
+        _worker_sessions = sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            bind=sqlalchemy.create_engine(DATABASE_URL),
+        )
+
+    # Imported here so the serving process doesn't pay for pandas.
+    if kind == "air":
+        from models.air import generate_air as generate
+    else:
+        from models.heat import generate_heat as generate
+
+    stats = {}
+    session = _worker_sessions()
+    try:
+        with profiled(profile, "ingest"):
+            generate(path, session, stats, file_hash)
+    finally:
+        session.close()
+        if remove:
+            os.remove(path)
+    return stats
+
+
+class IngestJob:
+    """The state of one dataset being ingested by the job queue."""
+
+    def __init__(
+        self, kind: str, filename: str, file_hash: str = None, profile: str = None
+    ) -> None:
+        """Initializes a queued job.
+
+        Args:
+            kind (str): Either "air" or "heat".
+            filename (str): Name of the uploaded dataset.
+            file_hash (str, optional): The hash of the dataset, if it's known.
+            profile (str, optional): Profile id the ingest is profiled under.
+        """
+        self.id = uuid4().hex
+        self.kind = kind
+        self.filename = filename
+        self.file_hash = file_hash
+        self.profile = profile
+        self.state = QUEUED
+        self.rows = 0
+        self.countries = 0
+        self.skipped = False
+        self.error = None
+        self.submitted_at = time()
+        self.started_at = None
+        self._started = None
+        self._finished = None
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        """Seconds the job has been running for, or ran for once finished."""
+        if self._started is None:
+            return None
+        return (self._finished or monotonic()) - self._started
+
+    @property
+    def stage(self) -> int:
+        """The position of the job's state in the order of STAGES."""
+        return STAGES[self.state]
+
+    @property
+    def finished(self) -> bool:
+        """Whether or not the job completed or failed."""
+        return self.state in (COMPLETED, FAILED)
+
+    def to_dict(self) -> dict:
+        """Returns the job as reported by the /jobs endpoint."""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "filename": self.filename,
+            "state": self.state,
+            "rows": self.rows,
+            "countries": self.countries,
+            "skipped": self.skipped,
+            "elapsed": self.elapsed,
+            "error": self.error,
+            "profile": self.profile,
+        }
+
+
+class JobQueue:
+    """Runs dataset ingest in a pool of worker processes.
+
+    Parsing and fitting a dataset is CPU bound, running it in the API process
+    would block the event loop for every other request. Jobs are handed to a
+    process pool with at most `max_workers` processes, once a job commits the
+    `on_complete` callback runs in the event loop, e.g. to reload the
+    coefficient cache.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        on_complete: Callable[[IngestJob], Awaitable] = None,
+        history: int = 1000,
+        on_update: Callable[[IngestJob], Awaitable] = None,
+    ) -> None:
+        """Initializes the queue, the pool is started by the first job.
+
+        Args:
+            max_workers (int, optional): Number of datasets ingested at once.
+                Defaults to 2.
+            on_complete (Callable[[IngestJob], Awaitable], optional):
+                Coroutine function awaited after a job completes. Defaults to
+                None.
+            history (int, optional): Number of finished jobs kept. Defaults
+                to 1000.
+            on_update (Callable[[IngestJob], Awaitable], optional):
+                Coroutine function awaited with the job when it starts and
+                finishes, e.g. to share its state with the other API workers.
+                Defaults to None.
+        """
+        self.max_workers = max_workers
+        self.on_complete = on_complete
+        self.history = history
+        self.on_update = on_update
+        self._jobs = OrderedDict()
+        self._tasks = set()
+        self._pool = None
+        self._slots = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        """Returns the process pool, starting it if it isn't running."""
+        if self._pool is None:
+            # Spawn rather than fork, the API process holds an event loop and
+            # open database connections a forked worker mustn't inherit.
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def submit(
+        self,
+        kind: str,
+        path: str,
+        filename: str = None,
+        file_hash: str = None,
+        remove: bool = False,
+        profile: str = None,
+    ) -> IngestJob:
+        """Queues a dataset for ingest, must be called from the event loop.
+
+        Args:
+            kind (str): Either "air" or "heat".
+            path (str): The path to the dataset.
+            filename (str, optional): Name reported for the job. Defaults to
+                the path.
+            file_hash (str, optional): The hash of the dataset, if it's
+                known. Defaults to hashing it in the worker.
+            remove (bool, optional): Whether or not the dataset is deleted
+                once it's ingested, for temporary files. Defaults to False.
+            profile (str, optional): Profile id to profile the ingest under.
+                Defaults to None.
+
+        Returns:
+            IngestJob: The queued job.
+        """
+        job = self._add(IngestJob(kind, filename or path, file_hash, profile))
+        task = asyncio.ensure_future(self._run(job, path, file_hash, remove))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def skip(self, kind: str, filename: str, file_hash: str = None) -> IngestJob:
+        """Records a dataset that was already ingested as a finished job,
+        without running anything.
+
+        Args:
+            kind (str): Either "air" or "heat".
+            filename (str): Name reported for the job.
+            file_hash (str, optional): The hash of the dataset.
+
+        Returns:
+            IngestJob: The completed job, marked as skipped.
+        """
+        job = IngestJob(kind, filename, file_hash)
+        job.state = COMPLETED
+        job.skipped = True
+        return self._add(job)
+
+    async def record(self, job: IngestJob) -> None:
+        """Passes the job's current state to on_update, a failure is only
+        logged, the job carries on."""
+        if self.on_update is None:
+            return
+
+        try:
+            await self.on_update(job)
+        except Exception:
+            log.exception(f"Unable to record ingest job {job.id}.")
+
+    def _add(self, job: IngestJob) -> IngestJob:
+        """Starts tracking the job, forgetting the oldest finished ones."""
+        self._jobs[job.id] = job
+        self._forget_finished()
+        return job
+
+    async def _run(
+        self, job: IngestJob, path: str, file_hash: str, remove: bool
+    ) -> None:
+        """Waits for a free worker and runs the job in it."""
+        # Created here rather than in __init__, it has to belong to the
+        # running event loop.
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+        # Hold jobs back until a worker is free, so a job handed to the pool
+        # starts right away and is only reported running once it has.
+        try:
+            async with self._slots:
+                await self._execute(job, path, file_hash, remove)
+        finally:
+            # The worker removes the dataset once it's ingested, unless the
+            # job never got to it, e.g. the pool broke or the queue stopped.
+            if remove:
+                with suppress(FileNotFoundError):
+                    os.remove(path)
+
+    async def _execute(
+        self, job: IngestJob, path: str, file_hash: str, remove: bool
+    ) -> None:
+        """Runs the job in a free worker and records how it went."""
+        loop = asyncio.get_event_loop()
+        job.state = RUNNING
+        job.started_at = time()
+        job._started = monotonic()
+        await self.record(job)
+
+        stats = {}
+        try:
+            stats = await loop.run_in_executor(
+                self._executor(),
+                ingest,
+                job.kind,
+                path,
+                file_hash,
+                remove,
+                job.profile,
+            )
+            job.rows = stats.get("rows", 0)
+            job.countries = stats.get("countries", 0)
+            job.skipped = stats.get("skipped", False)
+            job.error = stats.get("error")
+
+            if job.error is None and self.on_complete is not None:
+                await self.on_complete(job)
+        except Exception as err:
+            log.exception(f"Ingest job {job.id} of {job.filename} failed.")
+            job.error = f"{type(err).__name__}: {err}"
+
+        job._finished = monotonic()
+        job.state = FAILED if job.error else COMPLETED
+        observe_ingest(job.kind, job.state, stats)
+        log.info(f"Ingest job {job.id} {job.state} in {job.elapsed:.3f}s.")
+        await self.record(job)
+
+    def _forget_finished(self) -> None:
+        """Drops the oldest finished jobs beyond the history limit."""
+        finished = [job.id for job in self._jobs.values() if job.finished]
+        for job_id in finished[: max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        """Returns the job with the id, if it's known."""
+        return self._jobs.get(job_id)
+
+    async def join(self) -> None:
+        """Waits for every submitted job to finish."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    def shutdown(self) -> None:
+        """Stops the worker processes, waiting for running jobs."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
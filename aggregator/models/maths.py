@@ -1,4 +1,5 @@
 from hashlib import sha1
+from typing import BinaryIO
 import numpy as np
 
 def predict(gradient:float, offset:float, new_x_value:float) -> float:
@@ -99,6 +100,28 @@ def get_hash(path:str) -> str:
             sha.update(data)
     return sha.hexdigest()
 
+def copy_and_hash(source:BinaryIO, destination:BinaryIO) -> str:
+    """Copies a file object to another while hashing it, so the bytes are only
+    read once.
+
+    Args:
+        source (BinaryIO): The file object to read, such as an upload.
+        destination (BinaryIO): The file object the bytes are written to.
+
+    Returns:
+        str: The hash in string format, the same as get_hash of the copy.
+    """
+    sha = sha1()
+
+    while True:
+        data = source.read(65536)
+        if not data:
+            break
+
+        sha.update(data)
+        destination.write(data)
+    return sha.hexdigest()
+
 def hash_already_completed(completed_file_dir:str, file_hash:str) -> bool:
     """Checks if the hash passed exists in the a file by iterating line by
     line.
@@ -117,3 +140,163 @@ def hash_already_completed(completed_file_dir:str, file_hash:str) -> bool:
             if hash_in_file.strip() == file_hash:
                 return True
         return False
+
+# Per row terms that linear_regression can be recovered from once summed. The
+# x and y means skip their own missing values while the cross terms only count
+# rows where both are present, the same as pandas does in linear_regression.
+REGRESSION_SUMS = (
+    "n_x",
+    "sum_x",
+    "sum_xx",
+    "n_y",
+    "sum_y",
+    "n_xy",
+    "sum_x_xy",
+    "sum_y_xy",
+    "sum_xy",
+)
+
+def regression_terms(x_axis:np.ndarray, y_axis:np.ndarray) -> dict:
+    """Returns the per row terms of the regression sufficient statistics.
+
+    Summing the terms over any set of rows, in any number of chunks, gives the
+    statistics linear_regression_from_sums needs for those rows.
+
+    Args:
+        x_axis (np.ndarray): The x values, NaN where missing.
+        y_axis (np.ndarray): The y values, NaN where missing.
+
+    Returns:
+        dict: One array per name in REGRESSION_SUMS.
+    """
+    x_axis = np.asarray(x_axis, dtype=float)
+    y_axis = np.asarray(y_axis, dtype=float)
+
+    x_valid = ~np.isnan(x_axis)
+    y_valid = ~np.isnan(y_axis)
+    both_valid = x_valid & y_valid
+
+    return {
+        "n_x": x_valid.astype(float),
+        "sum_x": np.where(x_valid, x_axis, 0),
+        "sum_xx": np.where(x_valid, x_axis * x_axis, 0),
+        "n_y": y_valid.astype(float),
+        "sum_y": np.where(y_valid, y_axis, 0),
+        "n_xy": both_valid.astype(float),
+        "sum_x_xy": np.where(both_valid, x_axis, 0),
+        "sum_y_xy": np.where(both_valid, y_axis, 0),
+        "sum_xy": np.where(both_valid, x_axis * y_axis, 0),
+    }
+
+# The x variance of a series, relative to its sum of squares, under which the
+# series is treated as having no variance at all. Summing the squares leaves
+# rounding error in the variance of a constant series rather than exact zero.
+DEGENERATE_VARIANCE = 1e-12
+
+def linear_regression_from_sums(sums:dict, x_shift:float = 0) -> tuple:
+    """Solves linear_regression from summed regression_terms.
+
+    Works on scalars or arrays of sums, one per series, so every series of a
+    grouped dataset is solved at once. The x values can be shifted by a
+    constant before summing to keep the squares small, the shift is added
+    back to the result.
+
+    A series without two points to fit or without any variance in x has no
+    line of best fit, rather than an inf or NaN falling out of the division
+    its gradient and offset are both NaN and it's flagged as degenerate.
+
+    Args:
+        sums (dict): The summed terms, keyed by the names in REGRESSION_SUMS.
+        x_shift (float, optional): The constant subtracted from the x values
+            before summing. Defaults to 0.
+
+    Returns:
+        tuple: The gradients and offsets, in the same sense as
+        LinearEquation, followed by the mask of degenerate series.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = sums["sum_x"] / sums["n_x"]
+        y_mean = sums["sum_y"] / sums["n_y"]
+
+        # pandas sums an empty series to zero, as in linear_regression.
+        b1_num = np.where(
+            sums["n_xy"] > 0,
+            sums["sum_xy"]
+            - y_mean * sums["sum_x_xy"]
+            - x_mean * sums["sum_y_xy"]
+            + sums["n_xy"] * x_mean * y_mean,
+            0,
+        )
+        b1_den = sums["sum_xx"] - sums["n_x"] * x_mean * x_mean
+
+        degenerate = (sums["n_xy"] < 2) | ~(
+            b1_den > DEGENERATE_VARIANCE * np.asarray(sums["sum_xx"])
+        )
+
+        offset = np.where(degenerate, np.nan, b1_num / b1_den)
+        gradient = np.where(degenerate, np.nan, y_mean - offset * (x_mean + x_shift))
+
+    return gradient, offset, degenerate
+
+def segment_sums(terms:dict, group_ids:np.ndarray, groups:int) -> dict:
+    """Sums each of the regression_terms per group.
+
+    Args:
+        terms (dict): Per row terms, as returned by regression_terms.
+        group_ids (np.ndarray): The group of every row, numbered from 0. Rows
+            with a negative id belong to no group and are left out.
+        groups (int): The number of groups.
+
+    Returns:
+        dict: One array of length groups per name in REGRESSION_SUMS.
+    """
+    group_ids = np.asarray(group_ids)
+    member = group_ids >= 0
+
+    return {
+        name: np.bincount(
+            group_ids[member], weights=np.asarray(values)[member], minlength=groups
+        )
+        for name, values in terms.items()
+    }
+
+def grouped_linear_regression(
+    x_axis:np.ndarray,
+    y_axis:np.ndarray,
+    group_ids:np.ndarray,
+    groups:int = None,
+) -> tuple:
+    """Creates a linear regression equation for every group of values at once.
+
+    The grouped form of linear_regression, the series are given as one set of
+    x and y values along with the group each row belongs to. Rows missing an x
+    or y value are masked out the same way pandas skips them. Every group is
+    solved in a single pass over the rows using segment sums.
+
+    Args:
+        x_axis (np.ndarray): The x values, NaN where missing.
+        y_axis (np.ndarray): The y values, NaN where missing.
+        group_ids (np.ndarray): The group of every row, numbered from 0, such
+            as the codes of pd.factorize. Negative ids are left out.
+        groups (int, optional): The number of groups. Defaults to one more
+            than the largest id.
+
+    Returns:
+        tuple: The gradients and offsets of every group, in the same sense as
+        LinearEquation, followed by the mask of degenerate groups. See
+        linear_regression_from_sums.
+    """
+    x_axis = np.asarray(x_axis, dtype=float)
+    group_ids = np.asarray(group_ids, dtype=np.intp)
+    if groups is None:
+        groups = int(group_ids.max()) + 1 if len(group_ids) else 0
+
+    # Shift the x values by the smallest one to keep the squares small.
+    x_shift = 0.0
+    if not np.isnan(x_axis).all():
+        x_shift = float(np.nanmin(x_axis))
+
+    sums = segment_sums(
+        regression_terms(x_axis - x_shift, y_axis), group_ids, groups
+    )
+    return linear_regression_from_sums(sums, x_shift)
@@ -0,0 +1,233 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Iterator, Optional
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import REGISTRY, CounterMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+from models.env import SLOW_QUERY_MS
+from models.logger import setup_logging_config
+
+log = setup_logging_config(__name__, "queries.log")
+
+# The phases an ingest is timed in, see phase.
+INGEST_PHASES = ("read", "parse", "regress", "commit")
+
+REQUESTS = Counter(
+    "http_requests_total", "Requests handled.", ["method", "route", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Seconds taken to handle a request.",
+    ["method", "route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed.", ["engine"])
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Seconds taken to execute a SQL statement.",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+INGEST_JOBS = Counter("ingest_jobs_total", "Ingest jobs finished.", ["kind", "state"])
+INGEST_ROWS = Counter("ingest_rows_total", "Dataset rows ingested.", ["kind"])
+INGEST_PHASE_DURATION = Histogram(
+    "ingest_phase_duration_seconds",
+    "Seconds an ingest job spent in each phase.",
+    ["kind", "phase"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
+
+# Longest parameters logged with a slow statement, an executemany can have
+# thousands of rows.
+SLOW_QUERY_PARAMETERS = 1000
+
+
+class RequestQueries:
+    """The statements a request has issued so far and the seconds they took,
+    returned in the X-DB-Queries and X-DB-Time-ms headers."""
+
+    def __init__(self, scope: dict) -> None:
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Set by MetricsMiddleware for the request being handled. Starlette copies the
+# context into the threadpool and SQLAlchemy into its greenlets, so the
+# statements of both engines are counted.
+_request_queries: ContextVar[Optional[RequestQueries]] = ContextVar(
+    "request_queries", default=None
+)
+
+
+@contextmanager
+def phase(stats: Optional[dict], name: str):
+    """Adds the seconds spent in the block to the phase's total in
+    stats["phases"].
+
+    Ingest runs in worker processes, the phases travel back to the job queue
+    in the stats and are recorded there by observe_ingest.
+
+    Args:
+        stats (Optional[dict]): The ingest stats, nothing is recorded if None.
+        name (str): One of INGEST_PHASES.
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            phases = stats.setdefault("phases", {})
+            phases[name] = phases.get(name, 0.0) + perf_counter() - start
+
+
+def timed(items: Iterable, stats: Optional[dict], name: str) -> Iterator:
+    """Yields the items, adding the time spent fetching each one to the
+    phase, e.g. the reading of chunks from a CSV."""
+    items = iter(items)
+    while True:
+        with phase(stats, name):
+            item = next(items, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def observe_ingest(kind: str, state: str, stats: dict) -> None:
+    """Records a finished ingest job.
+
+    Args:
+        kind (str): Either "air" or "heat".
+        state (str): The state the job finished in.
+        stats (dict): The stats the job returned.
+    """
+    INGEST_JOBS.labels(kind, state).inc()
+    INGEST_ROWS.labels(kind).inc(stats.get("rows", 0))
+    for name, seconds in stats.get("phases", {}).items():
+        INGEST_PHASE_DURATION.labels(kind, name).observe(seconds)
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """Counts and times every statement the engine executes, adding them to
+    the request issuing them and logging the ones slower than SLOW_QUERY_MS.
+
+    Args:
+        engine (Engine): A synchronous engine, use sync_engine of an asyncio
+            one.
+        name (str): The engine label of the metrics.
+    """
+    queries = DB_QUERIES.labels(name)
+    durations = DB_QUERY_DURATION.labels(name)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, *args):
+        connection.info.setdefault("query_start", []).append(perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, *args):
+        seconds = perf_counter() - connection.info["query_start"].pop()
+        queries.inc()
+        durations.observe(seconds)
+
+        request = _request_queries.get()
+        if request is not None:
+            request.count += 1
+            request.seconds += seconds
+
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            route = route_name(request.scope) if request is not None else "ingest"
+            log.warning(
+                f"Slow query on {name} took {seconds * 1000:.1f}ms for {route}: "
+                f"{statement} {repr(parameters)[:SLOW_QUERY_PARAMETERS]}"
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches after_cursor_execute.
+        if context.connection is not None and context.cursor is not None:
+            context.connection.info.get("query_start", [None]).pop()
+
+
+def route_name(scope: dict) -> str:
+    """Returns the path template of the route the request matched, so
+    /jobs/{job_id} is one series rather than one per job."""
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing every request by route, and
+    returning the number of statements it issued and their total time in the
+    X-DB-Queries and X-DB-Time-ms headers."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        status = 500
+        request = RequestQueries(scope)
+        token = _request_queries.set(request)
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"x-db-queries", str(request.count).encode()),
+                        (b"x-db-time-ms", f"{request.seconds * 1000:.2f}".encode()),
+                    ],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_queries.reset(token)
+            route = route_name(scope)
+            REQUESTS.labels(scope["method"], route, str(status)).inc()
+            REQUEST_DURATION.labels(scope["method"], route).observe(
+                perf_counter() - start
+            )
+
+
+class CacheCollector:
+    """Exposes the hit and miss counters the caches already keep, read when
+    the metrics are scraped rather than on every lookup."""
+
+    def __init__(self, caches: Callable[[], Dict[str, dict]]) -> None:
+        """Initializes the collector.
+
+        Args:
+            caches (Callable[[], Dict[str, dict]]): Returns the stats of every
+                cache, keyed by the cache label.
+        """
+        self.caches = caches
+
+    def collect(self):
+        hits = CounterMetricFamily("cache_hits", "Cache hits.", labels=["cache"])
+        misses = CounterMetricFamily("cache_misses", "Cache misses.", labels=["cache"])
+        for cache, stats in self.caches().items():
+            hits.add_metric([cache], stats["hits"])
+            misses.add_metric([cache], stats["misses"])
+        yield hits
+        yield misses
+
+
+def register_caches(caches: Callable[[], Dict[str, dict]]) -> None:
+    """Registers the caches' counters with the metrics, see CacheCollector."""
+    REGISTRY.register(CacheCollector(caches))
@@ -0,0 +1,170 @@
+import cProfile
+import glob
+import io
+import itertools
+import os
+import pstats
+import re
+from contextlib import contextmanager
+from typing import Optional
+from urllib.parse import parse_qs
+from uuid import uuid4
+from models.env import (
+    PROFILE_DIR,
+    PROFILE_KEEP,
+    PROFILE_SAMPLE_EVERY,
+    PROFILING_ENABLED,
+)
+from models.logger import setup_logging_config
+
+log = setup_logging_config(__name__, "profiling.log")
+
+# Profile ids are generated here, anything else asked for isn't a profile.
+PROFILE_ID = re.compile(r"^[0-9a-f]{16}$")
+
+_requests = itertools.count(1)
+
+# Only one profiler can be enabled at a time, requests arriving while one is
+# running aren't profiled.
+_active = False
+
+
+def wants_profile(scope: dict) -> bool:
+    """Whether or not the request asked to be profiled, or was sampled.
+
+    Args:
+        scope (dict): The ASGI scope of the request.
+
+    Returns:
+        bool: True if the request should be profiled.
+    """
+    if not PROFILING_ENABLED:
+        return False
+
+    for name, value in scope.get("headers", ()):
+        if name == b"x-profile" and value in (b"1", b"true"):
+            return True
+
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if query.get("profile", [None])[-1] in ("1", "true"):
+        return True
+
+    return PROFILE_SAMPLE_EVERY > 0 and next(_requests) % PROFILE_SAMPLE_EVERY == 0
+
+
+def profile_path(profile_id: str, part: str) -> str:
+    """Returns where one part of a profile, e.g. the request or the ingest it
+    queued, is stored."""
+    return os.path.join(PROFILE_DIR, f"{profile_id}-{part}.pstats")
+
+
+def save(profiler: cProfile.Profile, profile_id: str, part: str) -> None:
+    """Stores the profile, deleting the oldest ones past PROFILE_KEEP.
+
+    Args:
+        profiler (cProfile.Profile): The finished profiler.
+        profile_id (str): The id the profile is reported under.
+        part (str): Which part of the profile it is.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(profile_path(profile_id, part))
+
+    profiles = sorted(
+        glob.glob(os.path.join(PROFILE_DIR, "*.pstats")), key=os.path.getmtime
+    )
+    for path in profiles[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else ():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def profiled(profile_id: Optional[str], part: str):
+    """Profiles the block if it's given a profile id, e.g. an ingest queued
+    by a profiled upload.
+
+    Args:
+        profile_id (Optional[str]): The id to store the profile under, the
+            block isn't profiled if None.
+        part (str): Which part of the profile the block is.
+    """
+    if profile_id is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        save(profiler, profile_id, part)
+
+
+def report(profile_id: str, limit: int = 50) -> Optional[str]:
+    """Renders every stored part of a profile, slowest first.
+
+    Args:
+        profile_id (str): The id of the profile.
+        limit (int, optional): Number of functions listed per part. Defaults
+            to 50.
+
+    Returns:
+        Optional[str]: The pstats report of each part, or None if there's no
+        such profile.
+    """
+    if not PROFILE_ID.match(profile_id):
+        return None
+
+    paths = sorted(glob.glob(profile_path(profile_id, "*")))
+    if not paths:
+        return None
+
+    output = io.StringIO()
+    for path in paths:
+        part = os.path.basename(path)[len(profile_id) + 1 : -len(".pstats")]
+        output.write(f"==== {part} ====\n")
+        stats = pstats.Stats(path, stream=output)
+        stats.sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that runs the requests asking for it under cProfile.
+
+    The profile id is returned in the X-Profile-Id header and put on the
+    request state, so the upload handlers can profile the ingest they queue
+    under the same id. The event loop is shared, a profile also picks up
+    whatever other requests ran while the profiled one was awaiting.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        global _active
+        if scope["type"] != "http" or _active or not wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid4().hex[:16]
+        scope.setdefault("state", {})["profile"] = profile_id
+
+        async def send_with_id(message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = cProfile.Profile()
+        _active = True
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.disable()
+            _active = False
+            save(profiler, profile_id, "request")
+            log.info(f"Profiled {scope['method']} {scope['path']} as {profile_id}.")
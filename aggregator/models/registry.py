@@ -0,0 +1,255 @@
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from time import perf_counter, time
+from typing import Iterable, Optional
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from models.env import DATASET_CLAIM_TIMEOUT
+from models.logger import setup_logging_config
+from models.schemas import DatasetSchema, JobSchema, dialect_insert
+
+PROCESSING = "processing"
+COMPLETED = "completed"
+
+log = setup_logging_config(__name__, "registry.log")
+
+
+class Claim:
+    """An ingest's exclusive hold on a dataset.
+
+    Used as a context manager around the ingest, if the block is left before
+    complete is called, by an error or an early return, the claim is released
+    so the dataset can be ingested again.
+    """
+
+    def __init__(self, session: Session, file_hash: str) -> None:
+        self.session = session
+        self.file_hash = file_hash
+        self.completed = False
+        self._started = perf_counter()
+
+    def __enter__(self) -> "Claim":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.completed:
+            return
+
+        # The ingest may have left the session in a failed transaction.
+        self.session.rollback()
+        try:
+            release(self.session, self.file_hash)
+        except Exception:
+            # Raising here would hide why the ingest stopped, the claim is
+            # taken over once it times out instead.
+            log.exception(f"Unable to release the claim on {self.file_hash}.")
+            self.session.rollback()
+
+    def complete(self, rows: int, countries: int) -> None:
+        """Marks the dataset completed, recording the details of the ingest.
+
+        Args:
+            rows (int): Number of rows read from the dataset.
+            countries (int): Number of countries fitted.
+        """
+        table = DatasetSchema.__table__
+        self.session.execute(
+            update(table)
+            .where(table.c.hash == self.file_hash)
+            .values(
+                state=COMPLETED,
+                rows=rows,
+                countries=countries,
+                duration=perf_counter() - self._started,
+                completed_at=datetime.now(timezone.utc),
+            )
+        )
+        self.session.commit()
+        self.completed = True
+        completed_datasets.add(self.file_hash)
+
+
+def claim(session: Session, file_hash: str, kind: str) -> Optional[Claim]:
+    """Claims the dataset for ingest, unless it was already ingested or is
+    being ingested elsewhere.
+
+    The claim is a single INSERT, the database decides which of any
+    concurrent ingests of the same dataset wins. A claim older than
+    DATASET_CLAIM_TIMEOUT that never completed is taken over.
+
+    Args:
+        session (Session): Session to claim the dataset in, the claim is
+            committed straight away.
+        file_hash (str): The hash of the dataset.
+        kind (str): Either "air" or "heat".
+
+    Returns:
+        Optional[Claim]: The claim, or None if the dataset is taken.
+    """
+    table = DatasetSchema.__table__
+    now = datetime.now(timezone.utc)
+
+    statement = dialect_insert(session, table).values(
+        hash=file_hash, kind=kind, state=PROCESSING, claimed_at=now
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.hash],
+        set_={"kind": kind, "claimed_at": now},
+        where=(table.c.state == PROCESSING)
+        & (table.c.claimed_at < now - timedelta(seconds=DATASET_CLAIM_TIMEOUT)),
+    )
+    claimed = session.execute(statement).rowcount == 1
+    session.commit()
+
+    if not claimed:
+        return None
+    return Claim(session, file_hash)
+
+
+def release(session: Session, file_hash: str) -> None:
+    """Gives up the claim on a dataset that wasn't ingested."""
+    table = DatasetSchema.__table__
+    session.execute(
+        delete(table).where((table.c.hash == file_hash) & (table.c.state == PROCESSING))
+    )
+    session.commit()
+
+
+class CompletedDatasets:
+    """In memory set of the hashes of every completed dataset.
+
+    Lets an upload of a dataset that was already ingested be turned away
+    without touching the database. The set only grows, a hash that isn't in
+    it may still have been completed by another process, the claim is what
+    decides.
+    """
+
+    def __init__(self) -> None:
+        self._hashes = set()
+        self._lock = Lock()
+
+    def __contains__(self, file_hash: str) -> bool:
+        return file_hash in self._hashes
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, file_hash: str) -> None:
+        """Records the dataset as completed."""
+        with self._lock:
+            self._hashes.add(file_hash)
+
+    async def load(self, session: AsyncSession) -> None:
+        """Loads the hashes of every completed dataset.
+
+        Args:
+            session (AsyncSession): Session used to read the registry.
+        """
+        result = await session.execute(
+            select(DatasetSchema.hash).where(DatasetSchema.state == COMPLETED)
+        )
+        hashes = set(result.scalars().all())
+        with self._lock:
+            self._hashes |= hashes
+
+    async def import_hashes(self, session: AsyncSession, hashes: Iterable[str]) -> int:
+        """Records datasets completed before the registry existed, such as the
+        hashes in completed.txt, skipping those already registered.
+
+        Args:
+            session (AsyncSession): Session used to write the registry.
+            hashes (Iterable[str]): The hashes of the completed datasets.
+
+        Returns:
+            int: The number of hashes that weren't registered yet.
+        """
+        result = await session.execute(select(DatasetSchema.hash))
+        known = set(result.scalars().all())
+        new = set(hashes) - known
+
+        now = datetime.now(timezone.utc)
+        session.add_all(
+            [
+                DatasetSchema(
+                    hash=file_hash, state=COMPLETED, claimed_at=now, completed_at=now
+                )
+                for file_hash in new
+            ]
+        )
+        await session.commit()
+
+        for file_hash in new:
+            self.add(file_hash)
+        return len(new)
+
+
+async def record_job(session: AsyncSession, job) -> None:
+    """Records the state of an ingest job, so any API worker can report it.
+
+    The job's own task and the upload that queued it record it concurrently,
+    an update of an earlier stage than the recorded one is ignored.
+
+    Args:
+        session (AsyncSession): Session to record the job in.
+        job (models.jobs.IngestJob): The job, in its current state.
+    """
+    table = JobSchema.__table__
+    values = {
+        "kind": job.kind,
+        "filename": job.filename,
+        "state": job.state,
+        "stage": job.stage,
+        "rows": job.rows,
+        "countries": job.countries,
+        "skipped": job.skipped,
+        "error": job.error,
+        "profile": job.profile,
+        "started_at": job.started_at,
+        "elapsed": job.elapsed if job.finished else None,
+    }
+    statement = dialect_insert(session, table).values(id=job.id, **values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_=values,
+        where=table.c.stage <= job.stage,
+    )
+    await session.execute(statement)
+    await session.commit()
+
+
+async def find_job(session: AsyncSession, job_id: str) -> Optional[dict]:
+    """Returns a job recorded by any API worker, as the /jobs endpoint
+    reports it.
+
+    Args:
+        session (AsyncSession): Session used to read the job.
+        job_id (str): The id returned when the dataset was uploaded.
+
+    Returns:
+        Optional[dict]: The job, or None if no worker recorded it.
+    """
+    row = await session.get(JobSchema, job_id)
+    if row is None:
+        return None
+
+    elapsed = row.elapsed
+    if elapsed is None and row.started_at is not None:
+        elapsed = time() - row.started_at
+
+    return {
+        "id": row.id,
+        "kind": row.kind,
+        "filename": row.filename,
+        "state": row.state,
+        "rows": row.rows,
+        "countries": row.countries,
+        "skipped": row.skipped,
+        "elapsed": elapsed,
+        "error": row.error,
+        "profile": row.profile,
+    }
+
+
+# The completed datasets of this process.
+completed_datasets = CompletedDatasets()
@@ -0,0 +1,165 @@
+import asyncio
+import json
+from typing import Any, Callable, Optional
+from redis import RedisError
+from redis.asyncio import Redis
+from models.env import REDIS_RESULT_TTL, REDIS_URL
+from models.logger import setup_logging_config
+
+log = setup_logging_config(__name__, "results.log")
+
+
+class ResultCache:
+    """Redis backed cache of computed prediction maps, shared by every API
+    worker and replica.
+
+    Results are keyed by the coefficient version they were computed from along
+    with the endpoint, year and countries, so a worker that hasn't reloaded
+    its coefficients yet can never serve or overwrite the results of a newer
+    dataset. Once a dataset is ingested, invalidate drops the stored results
+    and publishes a message every worker's listener picks up to reload its own
+    coefficients. Redis is only ever a shortcut, when it can't be reached the
+    result is computed as if it wasn't configured.
+    """
+
+    def __init__(
+        self, client: Redis, ttl: int = 3600, prefix: str = "livelong"
+    ) -> None:
+        """Initializes the cache over a Redis client.
+
+        Args:
+            client (Redis): An asyncio Redis client.
+            ttl (int, optional): Seconds a result is kept. Defaults to 3600.
+            prefix (str, optional): Prefix of the keys and channel, to share a
+                Redis with other applications. Defaults to "livelong".
+        """
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.channel = f"{prefix}:invalidate"
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+        self._listener = None
+
+    def key(self, version: str, endpoint: str, year: str, countries: str) -> str:
+        """Returns the key a result is stored under."""
+        return f"{self.prefix}:result:{version}:{endpoint}:{year}:{countries}"
+
+    async def get(
+        self, version: str, endpoint: str, year: str, countries: str = ""
+    ) -> Optional[Any]:
+        """Returns a stored result.
+
+        Args:
+            version (str): The version of the coefficients.
+            endpoint (str): The endpoint the result is for.
+            year (str): The year, or years, predicted.
+            countries (str, optional): The countries requested, if any.
+
+        Returns:
+            Optional[Any]: The result or None if it isn't stored, or Redis
+            couldn't be reached.
+        """
+        try:
+            value = await self.client.get(self.key(version, endpoint, year, countries))
+        except (RedisError, OSError) as err:
+            self.errors += 1
+            log.warning(f"Unable to read a result from redis: {err}")
+            return None
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(value)
+
+    async def set(
+        self, version: str, endpoint: str, year: str, countries: str, value: Any
+    ) -> None:
+        """Stores a result for the other workers, see get for the arguments."""
+        try:
+            await self.client.set(
+                self.key(version, endpoint, year, countries),
+                json.dumps(value),
+                ex=self.ttl,
+            )
+        except (RedisError, OSError) as err:
+            self.errors += 1
+            log.warning(f"Unable to store a result in redis: {err}")
+
+    async def invalidate(self) -> None:
+        """Drops every stored result and tells the workers the coefficients
+        changed."""
+        try:
+            keys = [
+                key
+                async for key in self.client.scan_iter(
+                    match=f"{self.prefix}:result:*", count=1000
+                )
+            ]
+            if keys:
+                await self.client.delete(*keys)
+            await self.client.publish(self.channel, "coefficients")
+        except (RedisError, OSError) as err:
+            # The results are keyed on the version, so the other workers
+            # still pick up the new dataset once their coefficients expire.
+            self.errors += 1
+            log.warning(f"Unable to invalidate the results in redis: {err}")
+
+    async def _listen(self, callback: Callable[[], None]) -> None:
+        """Calls back on every invalidation message, resubscribing whenever
+        the connection drops."""
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=1.0
+                    )
+                    if message is not None:
+                        callback()
+            except (RedisError, OSError) as err:
+                log.warning(f"Lost the redis invalidation channel: {err}")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.close()
+
+    def listen(self, callback: Callable[[], None]) -> None:
+        """Starts listening for invalidations in the background.
+
+        Args:
+            callback (Callable[[], None]): Called on every invalidation, such
+                as the coefficient cache's invalidate.
+        """
+        if self._listener is None:
+            self._listener = asyncio.get_event_loop().create_task(
+                self._listen(callback)
+            )
+
+    async def close(self) -> None:
+        """Stops listening and closes the connection."""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+        await self.client.close()
+
+    def stats(self) -> dict:
+        """Returns the hit, miss and error counters."""
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+
+def results_from_env() -> Optional[ResultCache]:
+    """Creates the result cache if a Redis URL is configured."""
+    if not REDIS_URL:
+        return None
+    return ResultCache(Redis.from_url(REDIS_URL), REDIS_RESULT_TTL)
@@ -1,7 +1,10 @@
 import math
+import numpy as np
 import sqlalchemy
 
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
 from models.maths import predict
 
 Base = declarative_base()
@@ -9,6 +12,51 @@ CARBON_DIOXIDE_MAX_CONST = 444.7619
 NITROUS_OXIDE_MAX_CONST = 555.9525
 MAX_HEAT_CONST = 40
 
+# Rows per INSERT statement when upserting, keeps well under the bind
+# parameter limits of both Postgres and SQLite.
+UPSERT_BATCH_SIZE = 1000
+
+
+def dialect_insert(session: Session, table: sqlalchemy.Table):
+    """Returns an INSERT for the table that supports ON CONFLICT, in the
+    dialect of the session's database."""
+    dialect = session.get_bind().dialect.name
+    insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+    return insert(table)
+
+
+def upsert(session: Session, table: sqlalchemy.Table, rows: list[dict], set_) -> None:
+    """Inserts the rows, updating the existing row on a primary key conflict.
+
+    Issues one INSERT ... ON CONFLICT DO UPDATE per batch of rows instead of a
+    SELECT and INSERT per row.
+
+    Args:
+        session (Session): Session to execute the statements in.
+        table (sqlalchemy.Table): The table to write to.
+        rows (list[dict]): The rows to write, keyed by column name.
+        set_ (Callable): Takes the statement's excluded row and returns the
+            columns to update on conflict.
+    """
+    # The regressions return NumPy floats, which not every driver can adapt.
+    rows = [
+        {
+            name: value.item() if isinstance(value, np.generic) else value
+            for name, value in row.items()
+        }
+        for row in rows
+    ]
+
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        statement = dialect_insert(session, table).values(
+            rows[start : start + UPSERT_BATCH_SIZE]
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_=set_(statement.excluded),
+        )
+        session.execute(statement)
+
 
 class AirSchema(Base):
     """LinearModel contains all required information to create a prediction
@@ -194,3 +242,89 @@ class HeatSchema(Base):
         return self.normalize(
             predict(self.avg_gradient, self.avg_offset, user_input_date)
         )
+
+
+class DatasetSchema(Base):
+    """A dataset that was ingested, or is being ingested, keyed by its hash.
+
+    A row is inserted as "processing" when an ingest claims the dataset and
+    marked "completed" along with the details of the ingest once its
+    coefficients are committed.
+    """
+
+    __tablename__ = "datasets"
+    hash = sqlalchemy.Column(sqlalchemy.String(40), primary_key=True)
+    kind = sqlalchemy.Column(sqlalchemy.String)
+    state = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    rows = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+    countries = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
+    duration = sqlalchemy.Column(sqlalchemy.Float, nullable=True)
+    claimed_at = sqlalchemy.Column(sqlalchemy.DateTime(timezone=True))
+    completed_at = sqlalchemy.Column(sqlalchemy.DateTime(timezone=True), nullable=True)
+
+    def __repr__(self) -> str:
+        """Displays the hash in a string format for debugging the class.
+
+        Returns:
+            str: String object as defined in the string below.
+        """
+        return f"<Dataset {self.hash} {self.state}>"
+
+
+class JobSchema(Base):
+    """The last recorded state of an ingest job, keyed by its id.
+
+    Jobs run in the process of the API worker that accepted them, the row lets
+    every other worker answer for them too. Stage orders the states, so an
+    update that lands after a later one is ignored.
+    """
+
+    __tablename__ = "jobs"
+    id = sqlalchemy.Column(sqlalchemy.String(32), primary_key=True)
+    kind = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    filename = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+    state = sqlalchemy.Column(sqlalchemy.String, nullable=False)
+    stage = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    rows = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    countries = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    skipped = sqlalchemy.Column(sqlalchemy.Boolean, nullable=False)
+    error = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+    profile = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+    started_at = sqlalchemy.Column(sqlalchemy.Float, nullable=True)
+    elapsed = sqlalchemy.Column(sqlalchemy.Float, nullable=True)
+
+    def __repr__(self) -> str:
+        """Displays the id in a string format for debugging the class.
+
+        Returns:
+            str: String object as defined in the string below.
+        """
+        return f"<Job {self.id} {self.state}>"
+
+
+class ScoreSchema(Base):
+    """The air, heat and combined score of a country in one year, computed
+    from the coefficients when a dataset is ingested.
+
+    The flags record whether the country is in the air and heat tables, a
+    NULL score means there's no prediction the same way None does.
+    """
+
+    __tablename__ = "scores"
+    country = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    year = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    position = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    has_air = sqlalchemy.Column(sqlalchemy.Boolean, nullable=False)
+    has_heat = sqlalchemy.Column(sqlalchemy.Boolean, nullable=False)
+    air = sqlalchemy.Column(sqlalchemy.Float, nullable=True)
+    heat = sqlalchemy.Column(sqlalchemy.Float, nullable=True)
+    score = sqlalchemy.Column(sqlalchemy.Float, nullable=True)
+
+    def __repr__(self) -> str:
+        """Displays the country and year in a string format for debugging the
+        class.
+
+        Returns:
+            str: String object as defined in the string below.
+        """
+        return f"<Score {self.country} {self.year}>"
@@ -0,0 +1,242 @@
+from contextlib import suppress
+from datetime import datetime
+from functools import wraps
+from typing import Callable, List, Optional
+import numpy as np
+import sqlalchemy
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from models.engine import PredictionEngine
+from models.env import SCORE_HORIZON_YEARS
+from models.schemas import AirSchema, HeatSchema, ScoreSchema
+
+# The score column of each endpoint, along with the flag of the countries the
+# endpoint covers. The combined score covers every country.
+KINDS = {
+    "air": ("air", "has_air"),
+    "heat": ("heat", "has_heat"),
+    "score": ("score", None),
+}
+
+
+def unless_unreachable(missing: Callable[[], object]):
+    """Answers a score read as if nothing was precomputed when the database
+    can't be reached, the endpoints then predict from the cached coefficients.
+
+    Args:
+        missing (Callable[[], object]): Returns the read's answer for scores
+            that weren't precomputed.
+    """
+
+    def decorator(read):
+        @wraps(read)
+        async def wrapper(session: AsyncSession, *args, **kwargs):
+            try:
+                return await read(session, *args, **kwargs)
+            except (SQLAlchemyError, OSError):
+                with suppress(SQLAlchemyError, OSError):
+                    await session.rollback()
+                return missing()
+
+        return wrapper
+
+    return decorator
+
+
+def score_years(horizon: int = SCORE_HORIZON_YEARS) -> np.ndarray:
+    """Returns the years the scores are precomputed for, from the current
+    year to the horizon inclusive."""
+    current_year = datetime.now().year
+    return np.arange(current_year, current_year + horizon + 1)
+
+
+def materialize(engine: PredictionEngine, years: np.ndarray) -> list[dict]:
+    """Computes the score rows of every country for each of the years.
+
+    Args:
+        engine (PredictionEngine): Engine holding every country's coefficients.
+        years (np.ndarray): The years to compute.
+
+    Returns:
+        list[dict]: One ScoreSchema row per country and year, keyed by column.
+    """
+    grids = {
+        "air": engine.predict_air(years),
+        "heat": engine.predict_heat(years),
+        "score": engine.predict_score(years),
+    }
+    grids = {
+        name: (values.tolist(), present.tolist())
+        for name, (values, present) in grids.items()
+    }
+    has_air = engine.has_air.tolist()
+    has_heat = engine.has_heat.tolist()
+    years = [int(year) for year in years]
+
+    rows = []
+    for position, country in enumerate(engine.countries):
+        for column, year in enumerate(years):
+            row = {
+                "country": country,
+                "year": year,
+                "position": position,
+                "has_air": has_air[position],
+                "has_heat": has_heat[position],
+            }
+            for name, (values, present) in grids.items():
+                row[name] = (
+                    values[position][column] if present[position][column] else None
+                )
+            rows.append(row)
+    return rows
+
+
+def refresh_scores(session: Session, years: np.ndarray = None) -> int:
+    """Recomputes the score table from the coefficient tables in a single
+    transaction, readers see either the old scores or the new ones.
+
+    Refreshes are serialized, the coefficients are only read once the score
+    table is locked, so a refresh never overwrites a newer one.
+
+    Args:
+        session (Session): Session to read the coefficients and write the
+            scores with, it's committed.
+        years (np.ndarray, optional): The years to compute. Defaults to
+            score_years().
+
+    Returns:
+        int: The number of score rows written.
+    """
+    years = score_years() if years is None else years
+    table = ScoreSchema.__table__
+
+    # SQLite takes its database wide write lock on the DELETE.
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(sqlalchemy.text("LOCK TABLE scores IN EXCLUSIVE MODE"))
+    session.execute(table.delete())
+
+    engine = PredictionEngine(
+        session.query(AirSchema).all(), session.query(HeatSchema).all()
+    )
+    rows = materialize(engine, years)
+    if rows:
+        # An executemany, the driver batches the rows itself.
+        session.execute(table.insert(), rows)
+
+    session.commit()
+    return len(rows)
+
+
+def scores_stale(session: Session, years: np.ndarray = None) -> bool:
+    """Whether or not the score table doesn't cover exactly the years, such
+    as after the year turns over or before it was ever refreshed.
+
+    Args:
+        session (Session): Session to read the score table with.
+        years (np.ndarray, optional): The years the table should cover.
+            Defaults to score_years().
+
+    Returns:
+        bool: True if the table has to be refreshed.
+    """
+    years = score_years() if years is None else years
+    first, last = session.execute(
+        select(
+            sqlalchemy.func.min(ScoreSchema.year), sqlalchemy.func.max(ScoreSchema.year)
+        )
+    ).one()
+    return (first, last) != (int(years[0]), int(years[-1]))
+
+
+@unless_unreachable(dict)
+async def year_scores(session: AsyncSession, kind: str, year: int) -> dict:
+    """Returns the scores of every country the endpoint covers in the year.
+
+    Args:
+        session (AsyncSession): Session to read the score table with.
+        kind (str): Either "air", "heat" or "score".
+        year (int): The year predicted.
+
+    Returns:
+        dict: The scores keyed by country, empty if the year wasn't
+        precomputed.
+    """
+    column, flag = KINDS[kind]
+    statement = select(ScoreSchema.country, getattr(ScoreSchema, column)).where(
+        ScoreSchema.year == int(year)
+    )
+    if flag is not None:
+        statement = statement.where(getattr(ScoreSchema, flag))
+
+    result = await session.execute(statement.order_by(ScoreSchema.position))
+    return dict(result.all())
+
+
+@unless_unreachable(lambda: None)
+async def range_scores(
+    session: AsyncSession,
+    kind: str,
+    years: np.ndarray,
+    countries: Optional[List[str]] = None,
+) -> Optional[dict]:
+    """Returns the scores of every country the endpoint covers, or only the
+    requested ones, for each of the years.
+
+    Args:
+        session (AsyncSession): Session to read the score table with.
+        kind (str): Either "air", "heat" or "score".
+        years (np.ndarray): The consecutive years predicted.
+        countries (Optional[List[str]], optional): Countries to return,
+            defaults to every country.
+
+    Returns:
+        Optional[dict]: Per year lists of scores keyed by country, None if
+        any of the years weren't precomputed.
+    """
+    column, flag = KINDS[kind]
+    statement = select(ScoreSchema.country, getattr(ScoreSchema, column)).where(
+        ScoreSchema.year.between(int(years[0]), int(years[-1]))
+    )
+    if flag is not None:
+        statement = statement.where(getattr(ScoreSchema, flag))
+    if countries:
+        statement = statement.where(ScoreSchema.country.in_(countries))
+
+    result = await session.execute(
+        statement.order_by(ScoreSchema.position, ScoreSchema.year)
+    )
+    grid = {}
+    for country, value in result.all():
+        grid.setdefault(country, []).append(value)
+
+    if not grid or any(len(values) != len(years) for values in grid.values()):
+        return None
+
+    if countries:
+        # Keep the requested order, the same as the prediction engine.
+        return {
+            country: grid[country]
+            for country in dict.fromkeys(countries)
+            if country in grid
+        }
+    return grid
+
+
+@unless_unreachable(lambda: None)
+async def country_scores(
+    session: AsyncSession, country: str, year: int
+) -> Optional[ScoreSchema]:
+    """Returns the scores of one country in the year.
+
+    Args:
+        session (AsyncSession): Session to read the score table with.
+        country (str): The country to look up.
+        year (int): The year predicted.
+
+    Returns:
+        Optional[ScoreSchema]: The scores or None if the country isn't in the
+        dataset or the year wasn't precomputed.
+    """
+    return await session.get(ScoreSchema, (country, int(year)))
@@ -0,0 +1,207 @@
+import hashlib
+import os
+import struct
+import tempfile
+from typing import List, Optional
+import numpy as np
+from sqlalchemy.orm import Session
+from models.cache import fingerprint
+from models.env import COEFFICIENT_SNAPSHOT
+from models.logger import setup_logging_config
+from models.schemas import AirSchema, HeatSchema
+
+log = setup_logging_config(__name__, "snapshot.log")
+
+# The file starts with a fixed header, followed by the air records then the
+# heat records. Records are fixed width, one per country, so both tables can
+# be mapped straight into NumPy structured arrays.
+SNAPSHOT_MAGIC = b"LLCOEF\0\0"
+SNAPSHOT_FORMAT = 1
+
+# Magic, format, country width, air count, heat count, coefficient version and
+# SHA-256 of the records, padded so the records start 8 byte aligned.
+HEADER = struct.Struct("<8sHHII40s32s4x")
+
+
+def coefficient_columns(schema: type) -> List[str]:
+    """Returns the coefficient columns of the schema, in table order."""
+    return [column.name for column in schema.__table__.columns][1:]
+
+
+def record_dtype(schema: type, country_width: int) -> np.dtype:
+    """Returns the fixed width record of a schema's rows.
+
+    Bit i of nulls is set when the i-th coefficient is NULL, so NULL and NaN
+    coefficients, which the scalar predictions tell apart, survive a round
+    trip.
+    """
+    return np.dtype(
+        [
+            ("country", f"S{country_width}"),
+            ("nulls", "<u2"),
+            *((name, "<f8") for name in coefficient_columns(schema)),
+        ],
+        align=True,
+    )
+
+
+class Snapshot:
+    """A verified snapshot of both coefficient tables.
+
+    The records are views over the memory mapped file, rows() turns them back
+    into schema rows.
+    """
+
+    def __init__(self, version: str, air: np.ndarray, heat: np.ndarray) -> None:
+        self.version = version
+        self.air = air
+        self.heat = heat
+
+    def rows(self, schema: type) -> list:
+        """Returns the records of the table as detached schema rows.
+
+        Args:
+            schema (type): Either AirSchema or HeatSchema.
+
+        Returns:
+            list: The rows, in the order they were written.
+        """
+        records = self.air if schema is AirSchema else self.heat
+        columns = coefficient_columns(schema)
+        rows = []
+        for record in records:
+            nulls = int(record["nulls"])
+            rows.append(
+                schema(
+                    record["country"].decode(),
+                    *(
+                        None if nulls >> bit & 1 else float(record[name])
+                        for bit, name in enumerate(columns)
+                    ),
+                )
+            )
+        return rows
+
+
+def records(schema: type, rows: list, country_width: int) -> np.ndarray:
+    """Packs the schema rows into fixed width records."""
+    columns = coefficient_columns(schema)
+    packed = np.zeros(len(rows), dtype=record_dtype(schema, country_width))
+    for index, row in enumerate(rows):
+        values = [getattr(row, name) for name in columns]
+        packed[index]["country"] = row.country.encode()
+        packed[index]["nulls"] = sum(
+            1 << bit for bit, value in enumerate(values) if value is None
+        )
+        for name, value in zip(columns, values):
+            packed[index][name] = np.nan if value is None else value
+    return packed
+
+
+def dump(path: str, air_rows: list, heat_rows: list, version: str) -> None:
+    """Writes the snapshot, replacing any existing one atomically.
+
+    Args:
+        path (str): Where to write the snapshot.
+        air_rows (list): Every row of the air table.
+        heat_rows (list): Every row of the heat table.
+        version (str): The coefficient version of the rows, see
+            models.cache.fingerprint.
+    """
+    countries = [row.country.encode() for row in (*air_rows, *heat_rows)]
+    # Rounded up to keep the coefficients 8 byte aligned.
+    country_width = -(-max(map(len, countries), default=1) // 8) * 8
+
+    body = b"".join(
+        records(schema, rows, country_width).tobytes()
+        for schema, rows in ((AirSchema, air_rows), (HeatSchema, heat_rows))
+    )
+    header = HEADER.pack(
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_FORMAT,
+        country_width,
+        len(air_rows),
+        len(heat_rows),
+        version.encode(),
+        hashlib.sha256(body).digest(),
+    )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as snapshot:
+            snapshot.write(header)
+            snapshot.write(body)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def load(path: str) -> Optional[Snapshot]:
+    """Maps the snapshot into memory after verifying it.
+
+    Args:
+        path (str): Where the snapshot was written.
+
+    Returns:
+        Optional[Snapshot]: The snapshot, or None if there isn't one or it's
+        truncated, corrupt or of another format.
+    """
+    try:
+        mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    except (OSError, ValueError):
+        return None
+
+    if len(mapped) < HEADER.size:
+        log.error(f"The coefficient snapshot {path} is truncated.")
+        return None
+
+    magic, file_format, country_width, air_count, heat_count, version, digest = (
+        HEADER.unpack_from(mapped)
+    )
+    if magic != SNAPSHOT_MAGIC or file_format != SNAPSHOT_FORMAT:
+        log.error(f"{path} isn't a coefficient snapshot this version can read.")
+        return None
+
+    air_dtype = record_dtype(AirSchema, country_width)
+    heat_dtype = record_dtype(HeatSchema, country_width)
+    size = (
+        HEADER.size + air_count * air_dtype.itemsize + heat_count * heat_dtype.itemsize
+    )
+    if len(mapped) != size or hashlib.sha256(mapped[HEADER.size :]).digest() != digest:
+        log.error(f"The coefficient snapshot {path} is corrupt.")
+        return None
+
+    air = np.frombuffer(mapped, air_dtype, air_count, HEADER.size)
+    heat = np.frombuffer(mapped, heat_dtype, heat_count, HEADER.size + air.nbytes)
+    return Snapshot(version.decode(), air, heat)
+
+
+def write_snapshot(
+    session: Session, path: Optional[str] = COEFFICIENT_SNAPSHOT
+) -> None:
+    """Snapshots both coefficient tables as committed, after an ingest.
+
+    A failed write is only logged, the database stays the source of truth.
+
+    Args:
+        session (Session): Session to read the tables with.
+        path (Optional[str], optional): Where to write the snapshot, nothing
+            is written if None. Defaults to COEFFICIENT_SNAPSHOT.
+    """
+    if path is None:
+        return
+
+    air_rows = session.query(AirSchema).all()
+    heat_rows = session.query(HeatSchema).all()
+    tables = {
+        AirSchema: {row.country: row for row in air_rows},
+        HeatSchema: {row.country: row for row in heat_rows},
+    }
+    try:
+        dump(path, air_rows, heat_rows, fingerprint(tables))
+    except OSError as err:
+        log.error(f"Unable to write the coefficient snapshot {path}: {err}")
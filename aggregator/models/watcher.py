@@ -0,0 +1,237 @@
+import asyncio
+import fcntl
+import os
+import signal
+from time import monotonic
+from typing import Dict, Optional
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+from models.env import (
+    INGEST_JOB_HISTORY,
+    INGEST_WORKERS,
+    WATCH_AIR_DIR,
+    WATCH_DEBOUNCE,
+    WATCH_HEAT_DIR,
+)
+from models.jobs import IngestJob, JobQueue
+from models.logger import setup_logging_config
+
+log = setup_logging_config(__name__, "watcher.log")
+
+# Extensions of the files picked up from the watched folders.
+DATASET_EXTENSIONS = (".csv", ".parquet", ".arrow", ".arrows", ".feather")
+
+# Held by the one process watching a folder, in the folder itself.
+LOCK_FILE = ".watcher.lock"
+
+
+class _FolderHandler(FileSystemEventHandler):
+    """Passes the watchdog events of one folder on to the watcher, from the
+    observer's thread to the event loop."""
+
+    def __init__(self, watcher: "DatasetWatcher", kind: str, folder: str) -> None:
+        self.watcher = watcher
+        self.kind = kind
+        self.folder = os.path.abspath(folder)
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        if event.is_directory or event.event_type not in (
+            "created",
+            "modified",
+            "moved",
+            "closed",
+        ):
+            return
+
+        # A move into the folder is a new file at the destination, a move out
+        # of it is only a file gone.
+        path = getattr(event, "dest_path", None) or event.src_path
+        if os.path.dirname(os.path.abspath(path)) != self.folder:
+            return
+        self.watcher.loop.call_soon_threadsafe(self.watcher.touch, self.kind, path)
+
+
+class DatasetWatcher:
+    """Ingests datasets dropped into the watched air and heat folders.
+
+    Files still being written keep generating events, so a file is only
+    queued once it has had no events for `debounce` seconds and its size
+    hasn't changed between two checks. Queued files go to the job queue,
+    which bounds how many are ingested at once and skips datasets the
+    registry already completed. Files already in the folders when the watcher
+    starts are picked up too, for backfills.
+
+    Each folder is only watched by the process holding its lock file, so of
+    several uvicorn workers, only one hashes and queues a folder's files.
+    """
+
+    def __init__(
+        self, jobs: JobQueue, folders: Dict[str, str], debounce: float = 2
+    ) -> None:
+        """Initializes the watcher, call start to begin watching.
+
+        Args:
+            jobs (JobQueue): The queue the datasets are ingested through.
+            folders (Dict[str, str]): The folder to watch per kind of dataset,
+                "air" and/or "heat".
+            debounce (float, optional): Seconds a file has to be left alone
+                before it's ingested. Defaults to 2.
+        """
+        self.jobs = jobs
+        self.folders = folders
+        self.debounce = debounce
+        self.loop = None
+
+        # Files waiting to settle, with their kind, time of the last event
+        # and size at the last check.
+        self._pending = {}
+        self._locks = []
+        self._observer = None
+        self._task = None
+
+    def touch(self, kind: str, path: str) -> None:
+        """Records an event on a file, restarting its debounce."""
+        if not path.lower().endswith(DATASET_EXTENSIONS):
+            return
+
+        path = os.path.abspath(path)
+        _, _, size = self._pending.get(path, (kind, 0, None))
+        self._pending[path] = (kind, monotonic(), size)
+
+    def _settled(self) -> list:
+        """Returns the pending files that stopped changing, forgetting them."""
+        now = monotonic()
+        settled = []
+        for path, (kind, touched, size) in list(self._pending.items()):
+            if now - touched < self.debounce:
+                continue
+
+            try:
+                current = os.path.getsize(path)
+            except OSError:
+                # Deleted or moved away before it settled.
+                del self._pending[path]
+                continue
+
+            if current != size:
+                self._pending[path] = (kind, touched, current)
+                continue
+
+            del self._pending[path]
+            settled.append((kind, path))
+        return settled
+
+    async def _dispatch(self) -> None:
+        """Queues the files as they settle."""
+        while True:
+            for kind, path in self._settled():
+                job = self.jobs.submit(kind, path)
+                log.info(f"Queued {path} as {kind} ingest job {job.id}.")
+            await asyncio.sleep(self.debounce / 2)
+
+    def _lock(self, folder: str) -> bool:
+        """Takes the folder's lock file, unless another process holds it.
+
+        The lock is released when the file is closed, by stop or by the
+        process exiting however it does.
+        """
+        lock = open(os.path.join(folder, LOCK_FILE), "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+
+        self._locks.append(lock)
+        return True
+
+    def start(self) -> None:
+        """Starts watching the folders, must be called from the event loop."""
+        self.loop = asyncio.get_event_loop()
+        self._observer = Observer()
+
+        for kind, folder in self.folders.items():
+            os.makedirs(folder, exist_ok=True)
+            if not self._lock(folder):
+                log.info(f"{folder} is watched by another process.")
+                continue
+
+            for name in sorted(os.listdir(folder)):
+                self.touch(kind, os.path.join(folder, name))
+
+            self._observer.schedule(_FolderHandler(self, kind, folder), folder)
+            log.info(f"Watching {folder} for {kind} datasets.")
+
+        self._observer.start()
+        self._task = asyncio.ensure_future(self._dispatch())
+
+    async def stop(self) -> None:
+        """Stops watching, files still settling aren't ingested."""
+        if self._observer is not None:
+            self._observer.stop()
+            await self.loop.run_in_executor(None, self._observer.join)
+            self._observer = None
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for lock in self._locks:
+            lock.close()
+        self._locks = []
+
+
+def configured_folders() -> Dict[str, str]:
+    """Returns the watched folders set in the environment, per kind."""
+    folders = {"air": WATCH_AIR_DIR, "heat": WATCH_HEAT_DIR}
+    return {kind: folder for kind, folder in folders.items() if folder}
+
+
+def watcher_from_env(jobs: JobQueue) -> Optional[DatasetWatcher]:
+    """Creates a watcher for the configured folders, if there are any."""
+    folders = configured_folders()
+    if not folders:
+        return None
+    return DatasetWatcher(jobs, folders, WATCH_DEBOUNCE)
+
+
+async def main() -> None:
+    """Runs the watcher on its own, without the API, e.g. for a backfill."""
+    from models.results import results_from_env
+
+    results = results_from_env()
+
+    async def invalidate_results(job: IngestJob) -> None:
+        # The API workers reload their coefficients on the message.
+        if results is not None and not job.skipped:
+            await results.invalidate()
+
+    watcher = watcher_from_env(
+        JobQueue(INGEST_WORKERS, invalidate_results, INGEST_JOB_HISTORY)
+    )
+    if watcher is None:
+        log.error("Set WATCH_AIR_DIR and/or WATCH_HEAT_DIR to watch for datasets.")
+        return
+
+    # Stop cleanly on Ctrl+C or a TERM from the container runtime, so the
+    # worker processes are shut down with the watcher.
+    stopped = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_event_loop().add_signal_handler(signal_number, stopped.set)
+
+    watcher.start()
+    try:
+        await stopped.wait()
+    finally:
+        await watcher.stop()
+        watcher.jobs.shutdown()
+        if results is not None:
+            await results.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
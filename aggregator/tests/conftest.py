@@ -0,0 +1,13 @@
+import os
+import tempfile
+
+# main binds its engines on import and models.env reads the URL once, point
+# both at a throwaway database before any test module imports them. The same
+# goes for the coefficient snapshot ingest writes.
+os.environ.setdefault(
+    "DATABASE_URL",
+    "sqlite:///{}".format(os.path.join(tempfile.mkdtemp(), "aggregator.db")),
+)
+os.environ.setdefault(
+    "COEFFICIENT_SNAPSHOT", os.path.join(tempfile.mkdtemp(), "coefficients.snapshot")
+)
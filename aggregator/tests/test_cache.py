@@ -0,0 +1,121 @@
+import asyncio
+import os
+import tempfile
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from models.cache import CoefficientCache
+from models.schemas import Base, AirSchema, HeatSchema
+
+loop = asyncio.new_event_loop()
+
+
+def run(coroutine):
+    """Runs the coroutine on the module's event loop."""
+    return loop.run_until_complete(coroutine)
+
+
+def make_session():
+    """Creates a database holding a single air and heat row and returns a
+    synchronous session for setup along with an asyncio one for the cache."""
+    path = os.path.join(tempfile.mkdtemp(), "cache.db")
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(AirSchema("CN", 3, 5, 2, 3))
+    session.add(HeatSchema("CN", 0.1, 0.1, 0.2, 0.2, 0.3, 0.3))
+    session.commit()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async_session = sessionmaker(bind=async_engine, class_=AsyncSession)()
+    return session, async_session
+
+
+def test_cache_serves_from_memory():
+    """Once loaded, lookups are answered without touching the database."""
+
+    session, async_session = make_session()
+    cache = CoefficientCache()
+    run(cache.load(async_session))
+
+    session.query(AirSchema).delete()
+    session.commit()
+
+    row = run(cache.get(async_session, AirSchema, "CN"))
+    if row is None or row.co2_gradient != 3:
+        assert False
+
+    # A complete snapshot answers for countries that don't exist too.
+    if run(cache.get(async_session, AirSchema, "GB")) is not None:
+        assert False
+
+    if len(run(cache.engine(async_session)).heat(2022)) != 1:
+        assert False
+
+    stats = cache.stats()
+    if stats["hits"] != 3 or stats["misses"] != 0 or stats["reloads"] != 1:
+        assert False
+
+    run(async_session.close())
+
+
+def test_cache_reload_after_invalidate():
+    """Invalidating the cache makes the next read reload both tables."""
+
+    session, async_session = make_session()
+    cache = CoefficientCache()
+    run(cache.load(async_session))
+
+    session.add(AirSchema("GB", 1, 1))
+    session.commit()
+    cache.invalidate()
+
+    if run(cache.get(async_session, AirSchema, "GB")) is None:
+        assert False
+
+    if cache.stats()["reloads"] != 2:
+        assert False
+
+    run(async_session.close())
+
+
+def test_cache_bounded_read_through():
+    """Tables bigger than the cache fall back to reading through."""
+
+    session, async_session = make_session()
+    session.add(AirSchema("GB", 1, 1))
+    session.add(AirSchema("FR", 2, 2))
+    session.commit()
+
+    cache = CoefficientCache(max_size=1)
+    run(cache.load(async_session))
+
+    if cache.stats()["complete"]:
+        assert False
+
+    for country in ("GB", "FR", "CN"):
+        if run(cache.get(async_session, AirSchema, country)) is None:
+            assert False
+
+    if cache.stats()["air"] != 1 or cache.stats()["misses"] < 2:
+        assert False
+
+    if len(run(cache.engine(async_session)).air(2022)) != 3:
+        assert False
+
+    run(async_session.close())
+
+
+def test_cache_ttl():
+    """A zero TTL reloads the tables on every read."""
+
+    session, async_session = make_session()
+    cache = CoefficientCache(ttl=0)
+    run(cache.load(async_session))
+    run(cache.engine(async_session))
+    run(cache.engine(async_session))
+
+    if cache.stats()["reloads"] != 3:
+        assert False
+
+    run(async_session.close())
@@ -0,0 +1,130 @@
+import math
+import random
+import numpy as np
+from models.engine import PredictionEngine
+from models.schemas import AirSchema, HeatSchema
+
+
+def make_rows(count: int = 200):
+    """Creates random air and heat rows, including the None, negative, zero
+    and out of range cases the scalar code branches on."""
+    generator = random.Random(1)
+    air_rows = [
+        AirSchema("CO2ONLY", 100.0, 0.01),
+        AirSchema("NOONLY", None, None, 200.0, 0.02),
+        AirSchema("NEGATIVE", -5000.0, 0.0, 10.0, 0.0),
+        AirSchema("ZERO", 0.0, 0.0, 0.0, 0.0),
+        AirSchema("NAN", float("nan"), 1.0, None, None),
+        AirSchema("HUGE", 1e6, 1.0, 1e6, 1.0),
+    ]
+    heat_rows = [
+        HeatSchema("NOONLY", 0, 0, 20.0, 0.0, 0, 0),
+        HeatSchema("COLD", 0, 0, -10.0, 0.0, 0, 0),
+        HeatSchema("HOT", 0, 0, 45.0, 0.0, 0, 0),
+    ]
+    for index in range(count):
+        air_rows.append(
+            AirSchema(
+                f"C{index}",
+                generator.uniform(-100, 500),
+                generator.uniform(-0.1, 0.1),
+                generator.choice([None, generator.uniform(-100, 600)]),
+                generator.uniform(-0.1, 0.1),
+            )
+        )
+        heat_rows.append(
+            HeatSchema(
+                f"C{index + count // 2}",
+                0,
+                0,
+                generator.uniform(-5, 45),
+                generator.uniform(-0.001, 0.001),
+                0,
+                0,
+            )
+        )
+    return air_rows, heat_rows
+
+
+def same(left, right) -> bool:
+    """Compares two scalar results, treating None and NaN as equal to
+    themselves."""
+    if left is None or right is None:
+        return left is right
+    if math.isnan(left) or math.isnan(right):
+        return math.isnan(left) and math.isnan(right)
+    return math.isclose(left, right, rel_tol=1e-12)
+
+
+def test_engine_matches_scalar_air():
+    """The vector air predictions equal AirSchema.predict per country."""
+
+    air_rows, heat_rows = make_rows()
+    engine = PredictionEngine(air_rows, heat_rows)
+
+    for year in (2022, 2050, 2300):
+        result = engine.air(year)
+        if list(result) != [row.country for row in air_rows]:
+            assert False
+
+        for row in air_rows:
+            if not same(result[row.country], row.predict(year)):
+                assert False
+
+
+def test_engine_matches_scalar_heat():
+    """The vector heat predictions equal HeatSchema.predict per country."""
+
+    air_rows, heat_rows = make_rows()
+    engine = PredictionEngine(air_rows, heat_rows)
+
+    for year in (2022, 2050, 2300):
+        result = engine.heat(year)
+        if list(result) != [row.country for row in heat_rows]:
+            assert False
+
+        for row in heat_rows:
+            if not same(result[row.country], row.predict(year)):
+                assert False
+
+
+def test_engine_empty():
+    """An engine without any rows returns empty maps."""
+
+    engine = PredictionEngine([], [])
+    if engine.score(2022) or engine.air(2022) or engine.heat(2022):
+        assert False
+
+
+def test_engine_range_matches_single_years():
+    """Each column of the range grid equals the single year predictions."""
+
+    air_rows, heat_rows = make_rows()
+    engine = PredictionEngine(air_rows, heat_rows)
+    years = np.arange(2022, 2123)
+
+    for single, ranged in (
+        (engine.air, engine.air_range),
+        (engine.heat, engine.heat_range),
+        (engine.score, engine.score_range),
+    ):
+        grid = ranged(years)
+        for column, year in enumerate(years.tolist()):
+            expected = single(year)
+            if list(grid) != list(expected):
+                assert False
+
+            for country, value in expected.items():
+                if not same(grid[country][column], value):
+                    assert False
+
+
+def test_engine_range_countries():
+    """The range grid only holds the requested countries in the dataset."""
+
+    air_rows, heat_rows = make_rows()
+    engine = PredictionEngine(air_rows, heat_rows)
+
+    grid = engine.air_range(np.arange(2030, 2040), ["C3", "COLD", "C1", "C3"])
+    if list(grid) != ["C3", "C1"] or len(grid["C1"]) != 10:
+        assert False
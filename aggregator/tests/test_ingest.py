@@ -0,0 +1,296 @@
+import math
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+from models import air, heat
+from models.datasets import ARROW, ARROW_STREAM, CSV, PARQUET, detect_format
+from models.maths import linear_regression
+from models.schemas import Base, AirSchema, HeatSchema
+
+AIR_COLUMNS = ["co2_gradient", "co2_offset", "no_gradient", "no_offset"]
+HEAT_COLUMNS = [
+    "min_gradient",
+    "min_offset",
+    "avg_gradient",
+    "avg_offset",
+    "max_gradient",
+    "max_offset",
+]
+
+
+def write_air_dataset(path: str):
+    """Writes a small OWID style dataset with gaps in both levels."""
+    generator = np.random.default_rng(1)
+    rows = []
+    for country in ("Albania", "Brazil", "Chad", "Denmark"):
+        for year in range(1900, 1960):
+            co2 = generator.uniform(0, 400)
+            nitrous_oxide = generator.uniform(0, 500)
+            if country == "Chad" or generator.random() < 0.2:
+                co2 = np.nan
+            if generator.random() < 0.2:
+                nitrous_oxide = np.nan
+            rows.append((country, year, 1, co2, nitrous_oxide))
+
+    pd.DataFrame(
+        rows, columns=["country", "year", "population", "co2", "nitrous_oxide"]
+    ).to_csv(path, index=False)
+
+
+def write_heat_dataset(path: str):
+    """Writes a small monthly temperature dataset with missing readings."""
+    generator = np.random.default_rng(2)
+    rows = []
+    for country in ("Albania", "Brazil", "Chad"):
+        for date in pd.date_range("1890-01-01", "1930-12-01", freq="MS"):
+            temperature = generator.uniform(-5, 35)
+            if generator.random() < 0.1:
+                temperature = np.nan
+            rows.append((date.strftime("%Y-%m-%d"), temperature, country))
+
+    pd.DataFrame(rows, columns=["Date", "AverageTemperature", "Country"]).to_csv(
+        path, index=False
+    )
+
+
+def same_models(expected: list, result: list, columns: list) -> bool:
+    """Compares two lists of schema rows column by column."""
+    if [row.country for row in expected] != [row.country for row in result]:
+        return False
+
+    for expected_row, row in zip(expected, result):
+        for column in columns:
+            left = getattr(expected_row, column)
+            right = getattr(row, column)
+            if left is None or right is None:
+                if left is not right:
+                    return False
+            elif math.isnan(left) or math.isnan(right):
+                if not (math.isnan(left) and math.isnan(right)):
+                    return False
+            elif not math.isclose(left, right, rel_tol=1e-9, abs_tol=1e-12):
+                return False
+    return True
+
+
+def test_air_stream_matches_process():
+    """Streaming the air dataset in chunks gives the same coefficients as
+    reading it whole."""
+
+    path = os.path.join(tempfile.mkdtemp(), "air.csv")
+    write_air_dataset(path)
+
+    expected = air.process_dataset(path)
+    for chunksize in (7, 1000):
+        result = air.stream_dataset(path, chunksize)
+        if not same_models(expected, result, AIR_COLUMNS):
+            assert False
+
+
+def test_heat_stream_matches_process():
+    """Streaming the heat dataset in chunks gives the same coefficients as
+    reading it whole."""
+
+    path = os.path.join(tempfile.mkdtemp(), "heat.csv")
+    write_heat_dataset(path)
+
+    expected = heat.process_dataset(path)
+    for chunksize in (13, 100000):
+        result = heat.stream_dataset(path, chunksize)
+        if not same_models(expected, result, HEAT_COLUMNS):
+            assert False
+
+
+def write_columnar(data: pd.DataFrame, directory: str) -> dict:
+    """Writes the rows as Parquet, as an Arrow file and as an Arrow stream, in
+    row groups and record batches smaller than the dataset. The files are
+    named .csv, as an upload might be, only their contents tell the formats
+    apart."""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    paths = {PARQUET: os.path.join(directory, "parquet.csv")}
+    data.to_parquet(paths[PARQUET], index=False, row_group_size=50)
+
+    paths[ARROW] = os.path.join(directory, "arrow.csv")
+    feather.write_feather(data, paths[ARROW], chunksize=70)
+
+    paths[ARROW_STREAM] = os.path.join(directory, "stream.csv")
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    with pa.ipc.new_stream(paths[ARROW_STREAM], table.schema) as stream:
+        stream.write_table(table, max_chunksize=70)
+    return paths
+
+
+def test_columnar_datasets():
+    """Parquet and Arrow datasets, with extra columns and the heat dates as
+    dates, give the same coefficients as the CSV both whole and streamed."""
+
+    directory = tempfile.mkdtemp()
+    for module, write, columns in (
+        (air, write_air_dataset, AIR_COLUMNS),
+        (heat, write_heat_dataset, HEAT_COLUMNS),
+    ):
+        path = os.path.join(directory, "dataset.csv")
+        write(path)
+        expected = module.process_dataset(path)
+
+        data = pd.read_csv(path)
+        if "Date" in data:
+            data["Date"] = pd.to_datetime(data["Date"])
+        data["unused"] = "text"
+
+        for dataset_format, columnar in write_columnar(data, directory).items():
+            if detect_format(columnar) != dataset_format:
+                assert False
+
+            for result in (
+                module.process_dataset(columnar),
+                module.stream_dataset(columnar, 33),
+            ):
+                if not same_models(expected, result, columns):
+                    assert False
+
+        if detect_format(path) != CSV:
+            assert False
+
+
+def test_unsupported_datasets():
+    """Feather V1 and other binary files are rejected before the CSV reader
+    sees them."""
+
+    directory = tempfile.mkdtemp()
+    for name, content in (
+        ("feather.csv", b"FEA1" + bytes(64)),
+        ("archive.csv", b"PK\x03\x04" + bytes(64)),
+    ):
+        path = os.path.join(directory, name)
+        with open(path, "wb") as dataset:
+            dataset.write(content)
+
+        try:
+            air.process_dataset(path)
+        except ValueError as err:
+            if "Unsupported dataset format" not in str(err):
+                assert False
+        else:
+            assert False
+
+
+def test_heat_process_matches_per_country_regressions():
+    """The grouped heat fit gives the coefficients of regressing each country
+    and its yearly extremes one by one."""
+
+    path = os.path.join(tempfile.mkdtemp(), "heat.csv")
+    write_heat_dataset(path)
+
+    data = pd.read_csv(path)
+    dates = pd.to_datetime(data["Date"])
+    data["formatted"] = dates.dt.strftime("%Y%m%d").astype(int)
+    data["year"] = dates.dt.year
+
+    expected = []
+    for country, rows in data.groupby("Country"):
+        yearly = rows.groupby("year").agg(
+            min=("AverageTemperature", "min"),
+            max=("AverageTemperature", "max"),
+            date=("formatted", "min"),
+        )
+        low = linear_regression(yearly["date"], yearly["min"])
+        average = linear_regression(rows["formatted"], rows["AverageTemperature"])
+        high = linear_regression(yearly["date"], yearly["max"])
+        expected.append(
+            HeatSchema(
+                country,
+                low.gradient,
+                low.offset,
+                average.gradient,
+                average.offset,
+                high.gradient,
+                high.offset,
+            )
+        )
+
+    if not same_models(expected, heat.process_dataset(path), HEAT_COLUMNS):
+        assert False
+
+
+def test_heat_date_formats():
+    """Dates are formatted the same as through strftime whichever format the
+    dataset uses, including formats that have to be inferred."""
+
+    for raw in (
+        ["1890-01-01", "1999-12-31", "2000-02-29"],
+        ["1890/01/01", "1999/12/31", "2000/02/29"],
+        ["01/01/1890", "12/31/1999", "02/29/2000"],
+        ["1 January 1890", "31 December 1999", "29 February 2000"],
+    ):
+        raw = pd.Series(raw)
+        expected = pd.to_datetime(raw).dt.strftime("%Y%m%d").astype(int)
+        if heat.format_dates(heat.parse_dates(raw)).tolist() != expected.tolist():
+            assert False
+
+    if heat.detect_date_format(pd.Series([None, "01/31/1890"])) != "%m/%d/%Y":
+        assert False
+
+    if heat.detect_date_format(pd.Series(["31 December 1999"])) is not None:
+        assert False
+
+
+def make_session():
+    """Creates an empty coefficient database and a session bound to it."""
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def count_statements(session, function) -> int:
+    """Counts the SQL statements issued while running the function."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    sqlalchemy.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        function()
+    finally:
+        sqlalchemy.event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+
+def test_air_update_database():
+    """Air coefficients are upserted in one statement and a NULL fit doesn't
+    overwrite the stored one."""
+
+    session = make_session()
+    air.update_database([AirSchema("GB", 1, 2, 3, 4)], session)
+
+    models = [AirSchema("GB", None, None, 5, 6)]
+    models += [AirSchema(f"C{index}", 1, 1) for index in range(300)]
+    if count_statements(session, lambda: air.update_database(models, session)) > 3:
+        assert False
+
+    row = session.query(AirSchema).filter(AirSchema.country == "GB").one()
+    stored = (row.co2_gradient, row.co2_offset, row.no_gradient, row.no_offset)
+    if stored != (1, 2, 5, 6):
+        assert False
+
+    if session.query(AirSchema).count() != 301:
+        assert False
+
+
+def test_heat_update_database():
+    """Heat coefficients of countries already stored are updated."""
+
+    session = make_session()
+    heat.update_database([HeatSchema("GB", 1, 1, 1, 1, 1, 1)], session)
+    heat.update_database([HeatSchema("GB", 2, 2, 2, 2, 2, 2)], session)
+
+    row = session.query(HeatSchema).one()
+    if row.avg_gradient != 2 or row.max_offset != 2:
+        assert False
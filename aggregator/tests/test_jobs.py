@@ -0,0 +1,217 @@
+import asyncio
+import time
+import os
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+import sqlalchemy
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+from models.env import DATABASE_URL
+from models import registry
+from models.jobs import COMPLETED, FAILED, JobQueue
+from models.maths import get_hash
+from models.schemas import Base, AirSchema
+
+engine = sqlalchemy.create_engine(DATABASE_URL)
+Base.metadata.create_all(engine)
+
+loop = asyncio.new_event_loop()
+
+
+def write_dataset(countries: list) -> str:
+    """Writes a small air dataset, ten years per country."""
+    rows = [
+        (country, year, 100 + year - 2000 + index, 5 + index)
+        for index, country in enumerate(countries)
+        for year in range(2000, 2010)
+    ]
+    path = os.path.join(tempfile.mkdtemp(), "air.csv")
+    pd.DataFrame(rows, columns=["country", "year", "co2", "nitrous_oxide"]).to_csv(
+        path, index=False
+    )
+    return path
+
+
+def run_jobs(queue: JobQueue, *submissions) -> list:
+    """Submits the datasets to the queue and waits for them all to finish."""
+
+    async def submit():
+        submitted = [queue.submit(kind, path) for kind, path in submissions]
+        await queue.join()
+        return submitted
+
+    try:
+        return loop.run_until_complete(submit())
+    finally:
+        queue.shutdown()
+
+
+def test_jobs_ingest_in_workers():
+    """Datasets are ingested by the worker processes, the jobs report what was
+    read and the completion callback runs once per committed dataset."""
+
+    completed = []
+
+    async def on_complete(job):
+        completed.append(job.id)
+
+    queue = JobQueue(max_workers=1, on_complete=on_complete)
+    first = write_dataset(["JOB1", "JOB2"])
+    second = write_dataset(["JOB3"])
+    jobs = run_jobs(queue, ("air", first), ("air", second), ("air", first))
+
+    states = [(job.state, job.rows, job.countries, job.skipped) for job in jobs]
+    if states != [
+        (COMPLETED, 20, 2, False),
+        (COMPLETED, 10, 1, False),
+        (COMPLETED, 0, 0, True),
+    ]:
+        assert False
+
+    if completed != [job.id for job in jobs] or queue.get(jobs[0].id) is not jobs[0]:
+        assert False
+
+    if any(job.elapsed is None or job.elapsed <= 0 for job in jobs):
+        assert False
+
+    with sessionmaker(bind=engine)() as session:
+        stored = session.query(AirSchema).filter(AirSchema.country.like("JOB%"))
+        if sorted(row.country for row in stored) != ["JOB1", "JOB2", "JOB3"]:
+            assert False
+
+
+def test_jobs_report_errors():
+    """A dataset that can't be ingested fails its job with the reason."""
+
+    path = os.path.join(tempfile.mkdtemp(), "broken.csv")
+    pd.DataFrame({"country": ["JOB4"], "population": [1]}).to_csv(path, index=False)
+
+    missing, broken = run_jobs(
+        JobQueue(max_workers=2),
+        ("air", os.path.join(tempfile.mkdtemp(), "missing.csv")),
+        ("heat", path),
+    )
+
+    if missing.state != FAILED or "FileNotFoundError" not in missing.error:
+        assert False
+
+    if broken.state != FAILED or broken.to_dict()["error"] is None:
+        assert False
+
+
+def test_jobs_remove_unqueued_upload():
+    """An upload the pool never picks up is still removed once its job
+    fails."""
+
+    class BrokenPool:
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("A child process terminated abruptly.")
+
+    queue = JobQueue(max_workers=1)
+    queue._executor = BrokenPool
+    path = write_dataset(["JOB7"])
+
+    async def submit():
+        job = queue.submit("air", path, remove=True)
+        await queue.join()
+        return job
+
+    job = loop.run_until_complete(submit())
+    if job.state != FAILED or "BrokenProcessPool" not in job.error:
+        assert False
+
+    if os.path.exists(path):
+        assert False
+
+
+def test_upload_returns_job():
+    """Uploads are accepted straight away with a job to poll, uploading the
+    same dataset again is skipped without queueing it."""
+    import main
+
+    with open(write_dataset(["JOB5"]), "rb") as file:
+        dataset = file.read()
+
+    with TestClient(main.app) as client:
+        response = client.post("/upl/air/file", files={"file": ("air.csv", dataset)})
+        if response.status_code != 202 or response.json()["state"] == FAILED:
+            assert False
+
+        job_id = response.json()["id"]
+        for _ in range(600):
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["state"] in (COMPLETED, FAILED):
+                break
+            time.sleep(0.05)
+
+        if job["state"] != COMPLETED or job["countries"] != 1 or job["rows"] != 10:
+            assert False
+
+        response = client.post("/upl/air/file", files={"file": ("air.csv", dataset)})
+        if response.status_code != 200 or not response.json()["skipped"]:
+            assert False
+
+        if "error" not in client.get("/jobs/missing").json():
+            assert False
+
+
+def test_upload_after_failed_concurrent_ingest():
+    """An upload skipped while another ingest holds the dataset is accepted
+    again once that ingest gives up its claim."""
+    import main
+
+    path = write_dataset(["JOB6"])
+    with open(path, "rb") as file:
+        dataset = file.read()
+
+    def upload(client):
+        response = client.post("/upl/air/file", files={"file": ("air.csv", dataset)})
+        job_id = response.json()["id"]
+        for _ in range(600):
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["state"] in (COMPLETED, FAILED):
+                break
+            time.sleep(0.05)
+        return response.status_code, job
+
+    with TestClient(main.app) as client, sessionmaker(bind=engine)() as session:
+        concurrent = registry.claim(session, get_hash(path), "air")
+        status, job = upload(client)
+        if status != 202 or not job["skipped"]:
+            assert False
+
+        # The concurrent ingest fails, releasing its claim.
+        with concurrent:
+            pass
+
+        status, job = upload(client)
+        if status != 202 or job["skipped"] or job["countries"] != 1:
+            assert False
+
+
+def test_job_status_from_another_worker():
+    """A job accepted by one API worker is reported by the others, which only
+    know it from the jobs table."""
+    import main
+
+    with open(write_dataset(["JOB8"]), "rb") as file:
+        dataset = file.read()
+
+    with TestClient(main.app) as client:
+        response = client.post("/upl/air/file", files={"file": ("air.csv", dataset)})
+        job_id = response.json()["id"]
+
+        # Another worker never saw the job.
+        main.jobs._jobs.clear()
+        for _ in range(600):
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["state"] in (COMPLETED, FAILED):
+                break
+            time.sleep(0.05)
+
+    if job["state"] != COMPLETED or job["countries"] != 1 or job["rows"] != 10:
+        assert False
+
+    if job["elapsed"] is None or job["elapsed"] <= 0:
+        assert False
@@ -0,0 +1,335 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import sqlalchemy
+from fastapi import Response
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+import main
+from models import snapshot
+from models.schemas import Base, AirSchema, HeatSchema
+from models.scores import refresh_scores
+
+Base.metadata.create_all(main.engine)
+
+loop = asyncio.new_event_loop()
+
+
+def request(endpoint, headers: dict = None, response: Response = None, **params):
+    """Calls the endpoint with an asyncio session, as FastAPI would."""
+    http_request = Request(
+        {
+            "type": "http",
+            "headers": [
+                (name.lower().encode(), value.encode())
+                for name, value in (headers or {}).items()
+            ],
+        }
+    )
+
+    async def call():
+        async with main.async_session_local() as session:
+            return await endpoint(
+                request=http_request,
+                response=response or Response(),
+                session=session,
+                **params,
+            )
+
+    return loop.run_until_complete(call())
+
+
+def populate(country_count: int):
+    """Replaces both coefficient tables with `country_count` countries each,
+    overlapping on half of them."""
+    with main.session_local() as session:
+        session.query(AirSchema).delete()
+        session.query(HeatSchema).delete()
+        for index in range(country_count):
+            session.add(AirSchema(f"A{index}", 3, 0.01, 2, 0.01))
+            session.add(HeatSchema(f"A{index + country_count // 2}", 0, 0, 20, 0, 0, 0))
+        session.commit()
+        refresh_scores(session)
+
+
+def count_statements(function) -> int:
+    """Counts the SQL statements issued while running the function."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = main.async_engine.sync_engine
+    sqlalchemy.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        function()
+    finally:
+        sqlalchemy.event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+
+async def reload_coefficients():
+    """Loads the coefficient cache from the database, as the warm up does."""
+    async with main.async_session_local() as session:
+        await main.coefficients.load(session)
+
+
+def world_score() -> dict:
+    """Requests the all countries score with a cold coefficient cache."""
+    main.coefficients.invalidate()
+    return request(main.score)
+
+
+def test_score_statement_count_is_constant():
+    """The all countries score issues the same number of statements no matter
+    how many countries are in the dataset."""
+
+    counts = []
+    for country_count in (4, 40, 200):
+        populate(country_count)
+
+        result = {}
+        counts.append(count_statements(lambda: result.update(world_score())))
+
+        # Air only, heat only and overlapping countries are all scored.
+        if len(result) != country_count + country_count // 2:
+            assert False
+
+    if len(set(counts)) != 1:
+        assert False
+
+    # Loading both coefficient tables, then the year's precomputed scores.
+    if counts[0] > 3:
+        assert False
+
+
+def test_score_matches_scalar():
+    """The all countries score equals calculate_score over the scalar
+    predictions of each country."""
+
+    populate(40)
+    main.coefficients.invalidate()
+    result = world_score()
+
+    with main.session_local() as session:
+        air = {row.country: row for row in session.query(AirSchema).all()}
+        heat = {row.country: row for row in session.query(HeatSchema).all()}
+
+    year = main.datetime.now().year
+    for country, value in result.items():
+        expected = main.calculate_score(
+            heat[country].predict(year) if country in heat else None,
+            air[country].predict(year) if country in air else None,
+        )
+        if expected is None or value is None:
+            if expected is not value:
+                assert False
+        elif abs(expected - value) > 1e-12:
+            assert False
+
+
+def test_score_range():
+    """The range endpoint returns a score per year for the requested
+    countries and rejects invalid ranges."""
+
+    populate(10)
+    with main.session_local() as session:
+        session.add(AirSchema("GB", 3, 0.01, 2, 0.01))
+        session.add(HeatSchema("FR", 0, 0, 20, 0.01, 0, 0))
+        session.commit()
+        refresh_scores(session)
+
+    main.coefficients.invalidate()
+    year = main.datetime.now().year
+
+    result = request(
+        main.score_range,
+        start_year=year,
+        end_year=year + 9,
+        countries=["FR", "DE", "GB"],
+    )
+    if result["years"] != list(range(year, year + 10)):
+        assert False
+
+    if list(result["countries"]) != ["FR", "GB"]:
+        assert False
+
+    if len(result["countries"]["GB"]) != 10:
+        assert False
+
+    result = request(
+        main.score_range, start_year=year + 5, end_year=year, countries=None
+    )
+    if "error" not in result:
+        assert False
+
+    result = request(
+        main.score_range, start_year=year - 1, end_year=year, countries=None
+    )
+    if "error" not in result:
+        assert False
+
+
+def test_etag_not_modified():
+    """Predictions are tagged with the dataset version and year, a client
+    holding the current tag gets a 304 and a new dataset changes the tag."""
+
+    populate(10)
+    main.coefficients.invalidate()
+
+    response = Response()
+    request(main.score, response=response)
+    etag = response.headers.get("etag")
+    if etag is None or "max-age" not in response.headers.get("cache-control", ""):
+        assert False
+
+    if request(main.score, headers={"If-None-Match": etag}).status_code != 304:
+        assert False
+
+    if request(main.score, headers={"If-None-Match": f"W/{etag}"}).status_code != 304:
+        assert False
+
+    # Another year is another tag.
+    year = main.datetime.now().year + 1
+    response = Response()
+    result = request(
+        main.heat_prediction,
+        headers={"If-None-Match": etag},
+        response=response,
+        day=1,
+        month=1,
+        year=year,
+    )
+    if not isinstance(result, dict) or response.headers["etag"] == etag:
+        assert False
+
+    with main.session_local() as session:
+        session.add(AirSchema("GB", 3, 0.01, 2, 0.01))
+        session.commit()
+        refresh_scores(session)
+    main.coefficients.invalidate()
+
+    response = Response()
+    result = request(main.score, headers={"If-None-Match": etag}, response=response)
+    if not isinstance(result, dict) or response.headers["etag"] == etag:
+        assert False
+
+
+def test_errors_not_cached():
+    """Errors aren't tagged or cacheable, even for a client sending a tag."""
+
+    populate(10)
+    main.coefficients.invalidate()
+
+    for country in ("Nowhere", "GB"):
+        response = Response()
+        result = request(
+            main.heat_prediction,
+            headers={"If-None-Match": "*"},
+            response=response,
+            country=country,
+        )
+        if not isinstance(result, dict) or "error" not in result:
+            assert False
+
+        if "etag" in response.headers or "cache-control" in response.headers:
+            assert False
+
+
+def test_snapshot_served_without_database():
+    """Until the coefficients are loaded from the database, the predictions
+    are served from the snapshot without a single statement."""
+
+    populate(10)
+    path = os.path.join(main.tempfile.mkdtemp(), "coefficients.snapshot")
+    with main.session_local() as session:
+        snapshot.write_snapshot(session, path)
+
+    main.coefficients.load_snapshot(snapshot.load(path), until_loaded=True)
+    try:
+        results = []
+        statements = count_statements(
+            lambda: results.extend(
+                [
+                    request(main.score),
+                    request(main.score, country="A1"),
+                    request(main.heat_prediction_range, countries=None),
+                ]
+            )
+        )
+        if statements != 0 or len(results[0]) != 15 or "error" in results[2]:
+            assert False
+    finally:
+        main.coefficients.invalidate()
+        loop.run_until_complete(reload_coefficients())
+
+    if main.coefficients.stats()["source"] != "database":
+        assert False
+
+
+def test_probes():
+    """/healthz answers straight away, /readyz once the warm up is done."""
+
+    with TestClient(main.app) as client:
+        if client.get("/healthz").json() != {"status": "ok"}:
+            assert False
+
+        for _ in range(100):
+            response = client.get("/readyz")
+            if response.status_code == 200:
+                break
+            time.sleep(0.05)
+
+        expected = {"database": True, "tables": True, "caches": True}
+        if response.json() != {**expected, "degraded": False}:
+            assert False
+
+
+def test_warm_up_retries(monkeypatch):
+    """Startup keeps retrying an unreachable database with growing delays."""
+
+    attempts = []
+    prepare = main.prepare
+
+    async def flaky_prepare():
+        attempts.append(time.perf_counter())
+        if len(attempts) < 4:
+            raise ConnectionRefusedError
+        await prepare()
+
+    monkeypatch.setattr(main, "prepare", flaky_prepare)
+    monkeypatch.setattr(main, "STARTUP_RETRY_INITIAL", 0.02)
+    monkeypatch.setattr(main, "warm", False)
+    loop.run_until_complete(main.warm_up())
+
+    if len(attempts) != 4 or not main.warm:
+        assert False
+
+    # Each delay is at least half of a doubling one.
+    if attempts[3] - attempts[2] < 0.04:
+        assert False
+
+
+def test_serving_imports():
+    """The API workers don't import the ingest code or pandas, nor Redis and
+    watchdog while they aren't configured."""
+
+    environment = dict(os.environ)
+    for name in ("REDIS_URL", "WATCH_AIR_DIR", "WATCH_HEAT_DIR"):
+        environment.pop(name, None)
+
+    heavy = ["pandas", "redis", "watchdog", "models.air", "models.heat"]
+    code = f"import sys, main; print([m for m in {heavy} if m in sys.modules])"
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    if output.strip().splitlines()[-1] != "[]":
+        assert False
@@ -0,0 +1,118 @@
+import logging
+import os
+import tempfile
+import time
+import sqlalchemy
+from fastapi.testclient import TestClient
+from prometheus_client.core import REGISTRY
+from sqlalchemy.orm import sessionmaker
+import main
+from models import metrics
+from models.air import generate_air
+from models.heat import generate_heat
+from models.metrics import INGEST_PHASES, observe_ingest
+from models.schemas import Base
+
+
+def sample(name: str, **labels) -> float:
+    """Returns the current value of a metric sample, zero if there isn't one."""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_metrics_endpoint():
+    """Requests are counted per route template along with the queries they
+    make and the coefficient cache's hits."""
+
+    route = {"method": "GET", "route": "/jobs/{job_id}", "status": "200"}
+    before = sample("http_requests_total", **route)
+    queries = sample("db_queries_total", engine="async")
+
+    with TestClient(main.app) as client:
+        client.get("/jobs/first")
+        client.get("/jobs/second")
+        client.get("/score")
+        text = client.get("/metrics").text
+
+    if sample("http_requests_total", **route) != before + 2:
+        assert False
+
+    if sample("db_queries_total", engine="async") <= queries:
+        assert False
+
+    for name in (
+        "http_request_duration_seconds_bucket",
+        "db_query_duration_seconds_count",
+        'cache_hits_total{cache="coefficients"}',
+    ):
+        if name not in text:
+            assert False
+
+
+def test_ingest_phases():
+    """Both kinds of ingest time every phase and the job queue records them
+    along with the rows."""
+
+    directory = tempfile.mkdtemp()
+    air_path = os.path.join(directory, "air.csv")
+    with open(air_path, "w") as dataset:
+        dataset.write("country,year,co2,nitrous_oxide\n")
+        for year in range(1990, 2000):
+            dataset.write(f"Albania,{year},{year - 1980},{2000 - year}\n")
+
+    heat_path = os.path.join(directory, "heat.csv")
+    with open(heat_path, "w") as dataset:
+        dataset.write("Date,AverageTemperature,Country\n")
+        for year in range(1990, 2000):
+            dataset.write(f"{year}-01-01,{year - 1980},Albania\n")
+
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    for kind, generate, path in (
+        ("air", generate_air, air_path),
+        ("heat", generate_heat, heat_path),
+    ):
+        stats = {}
+        generate(path, session, stats)
+        if sorted(stats["phases"]) != sorted(INGEST_PHASES):
+            assert False
+
+        rows = sample("ingest_rows_total", kind=kind)
+        observe_ingest(kind, "completed", stats)
+        if sample("ingest_rows_total", kind=kind) != rows + 10:
+            assert False
+
+        if not sample("ingest_phase_duration_seconds_count", kind=kind, phase="commit"):
+            assert False
+
+
+def test_request_queries(monkeypatch, caplog):
+    """Responses carry the statements their request issued, and statements
+    over the threshold are logged with the route that issued them."""
+
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0)
+    caplog.set_level(logging.WARNING, logger="models.metrics")
+
+    with TestClient(main.app) as client:
+        # Until the warm up is done the coefficient snapshot is served,
+        # without any statements.
+        for _ in range(100):
+            if client.get("/readyz").status_code == 200:
+                break
+            time.sleep(0.05)
+
+        job = client.get("/healthz")
+        score = client.get("/score")
+
+    if job.headers["x-db-queries"] != "0" or job.headers["x-db-time-ms"] != "0.00":
+        assert False
+
+    if int(score.headers["x-db-queries"]) < 1:
+        assert False
+
+    if float(score.headers["x-db-time-ms"]) <= 0:
+        assert False
+
+    if not any("for /score: SELECT" in message for message in caplog.messages):
+        assert False
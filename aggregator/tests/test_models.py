@@ -1,6 +1,8 @@
+import io
 import numpy as np
+import pandas as pd
 from models.maths import predict, LinearEquation, linear_regression, get_hash, \
-    hash_already_completed
+    hash_already_completed, grouped_linear_regression, copy_and_hash
 
 def test_predict():
     """ Tests the predict function """
@@ -42,6 +44,53 @@ def test_linear_regression():
     if not linear_regression_test.predict(5) == 7.0:
         assert False
 
+def test_grouped_linear_regression():
+    """ The grouped linear regression fits every group of the rows at once,
+    giving the same lines as linear_regression on each group. Rows missing a
+    value are skipped and rows with a negative group id are left out.
+    """
+
+    x_axis = np.array([1, 2, 3, 4, 1, 2, np.nan, 4, 9])
+    y_axis = np.array([3, 5, 7, 9, 2, np.nan, 6, 5, 100])
+    group_ids = np.array([0, 0, 0, 0, 1, 1, 1, 1, -1])
+
+    gradients, offsets, degenerate = grouped_linear_regression(
+        x_axis, y_axis, group_ids)
+
+    if len(gradients) != 2 or degenerate.any():
+        assert False
+
+    for group in (0, 1):
+        expected = linear_regression(
+            pd.Series(x_axis[group_ids == group]),
+            pd.Series(y_axis[group_ids == group]))
+        if not np.isclose(gradients[group], expected.gradient):
+            assert False
+
+        if not np.isclose(offsets[group], expected.offset):
+            assert False
+
+def test_grouped_linear_regression_degenerate():
+    """ Groups with a single point, no variance in x or no rows at all are
+    flagged and come back as NaN rather than inf.
+    """
+
+    x_axis = np.array([1, 2, 5, 5, 5, 1, 2])
+    y_axis = np.array([1, np.nan, 1, 2, 3, 2, 4])
+    group_ids = np.array([0, 0, 1, 1, 1, 3, 3])
+
+    gradients, offsets, degenerate = grouped_linear_regression(
+        x_axis, y_axis, group_ids)
+
+    if degenerate.tolist() != [True, True, True, False]:
+        assert False
+
+    if not np.isnan(gradients[:3]).all() or not np.isnan(offsets[:3]).all():
+        assert False
+
+    if gradients[3] != 0 or offsets[3] != 2:
+        assert False
+
 def test_get_hash():
     """Gets the SHA1 hash of a file."""
     
@@ -62,6 +111,21 @@ ut ultricies lectus. Mauris sit amet pharetra ante. Nam sit amet arcu elit.""")
         print(result)
         assert False
 
+def test_copy_and_hash():
+    """Copies a file object while hashing it, giving the same hash as reading
+    the copy back with get_hash."""
+
+    source = io.BytesIO(bytes(range(256)) * 1000)
+    with open('sample_hash_file.txt', 'wb') as destination:
+        result = copy_and_hash(source, destination)
+
+    if result != get_hash('sample_hash_file.txt'):
+        assert False
+
+    with open('sample_hash_file.txt', 'rb') as copy:
+        if copy.read() != source.getvalue():
+            assert False
+
 def test_hash_already_completed():
     """Checks a completed file to see if the entered hash exists, if it does
     the function will return true.
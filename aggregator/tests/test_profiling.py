@@ -0,0 +1,54 @@
+import tempfile
+from fastapi.testclient import TestClient
+import main
+from models import profiling
+
+
+def test_profiled_request(monkeypatch):
+    """Requests asking to be profiled return the id of a profile that can be
+    fetched, the rest aren't profiled."""
+
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tempfile.mkdtemp())
+
+    with TestClient(main.app) as client:
+        if "x-profile-id" in client.get("/score").headers:
+            assert False
+
+        profile_id = client.get("/score?profile=1").headers["x-profile-id"]
+        if client.get("/score", headers={"X-Profile": "1"}).headers.get(
+            "x-profile-id"
+        ) in (None, profile_id):
+            assert False
+
+        text = client.get(f"/profiles/{profile_id}").text
+        if "==== request ====" not in text or "function calls" not in text:
+            assert False
+
+        if "error" not in client.get("/profiles/not-a-profile").json():
+            assert False
+
+
+def test_profiling_disabled():
+    """Without PROFILING_ENABLED nothing is profiled."""
+
+    with TestClient(main.app) as client:
+        if "x-profile-id" in client.get("/score?profile=1").headers:
+            assert False
+
+
+def test_profiled_ingest(monkeypatch):
+    """The ingest of a profiled upload is stored as another part of the
+    upload's profile."""
+
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tempfile.mkdtemp())
+
+    with profiling.profiled("0123456789abcdef", "ingest"):
+        sum(range(1000))
+
+    text = profiling.report("0123456789abcdef")
+    if text is None or "==== ingest ====" not in text:
+        assert False
+
+    if profiling.report("fedcba9876543210") is not None:
+        assert False
@@ -0,0 +1,117 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+from models import registry
+from models.schemas import Base, DatasetSchema
+
+
+def make_sessions():
+    """Creates an empty registry database and returns a session factory."""
+    path = os.path.join(tempfile.mkdtemp(), "registry.db")
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def test_claim_is_exclusive():
+    """Of many workers claiming the same dataset at once only one wins."""
+
+    sessions = make_sessions()
+
+    def claim(_):
+        with sessions() as session:
+            return registry.claim(session, "a" * 40, "air") is not None
+
+    with ThreadPoolExecutor(8) as pool:
+        claimed = list(pool.map(claim, range(16)))
+
+    if claimed.count(True) != 1:
+        assert False
+
+
+def test_claim_complete_and_release():
+    """A completed dataset can't be claimed again and carries the details of
+    the ingest, a dataset whose ingest failed can."""
+
+    sessions = make_sessions()
+    session = sessions()
+
+    with registry.claim(session, "b" * 40, "heat") as dataset:
+        dataset.complete(rows=120, countries=3)
+
+    if registry.claim(session, "b" * 40, "heat") is not None:
+        assert False
+
+    row = session.get(DatasetSchema, "b" * 40)
+    if (row.kind, row.state, row.rows, row.countries) != ("heat", "completed", 120, 3):
+        assert False
+
+    if row.duration is None or row.completed_at is None:
+        assert False
+
+    if "b" * 40 not in registry.completed_datasets:
+        assert False
+
+    try:
+        with registry.claim(session, "c" * 40, "air"):
+            raise ValueError("Broken dataset")
+    except ValueError:
+        pass
+
+    if registry.claim(session, "c" * 40, "air") is None:
+        assert False
+
+
+def test_stale_claim_is_taken_over():
+    """A claim that never completed is taken over once it times out."""
+
+    sessions = make_sessions()
+    session = sessions()
+
+    if registry.claim(session, "d" * 40, "air") is None:
+        assert False
+
+    if registry.claim(session, "d" * 40, "air") is not None:
+        assert False
+
+    row = session.get(DatasetSchema, "d" * 40)
+    row.claimed_at = datetime.now(timezone.utc) - timedelta(
+        seconds=registry.DATASET_CLAIM_TIMEOUT + 1
+    )
+    session.commit()
+
+    if registry.claim(session, "d" * 40, "air") is None:
+        assert False
+
+
+def test_failed_ingest_keeps_its_error(monkeypatch):
+    """The claim of an ingest that broke its transaction is still released,
+    and the ingest's own error is raised even if releasing fails too."""
+
+    sessions = make_sessions()
+    session = sessions()
+
+    try:
+        with registry.claim(session, "e" * 40, "air"):
+            session.add(DatasetSchema(hash="e" * 40, state="completed"))
+            session.flush()
+    except sqlalchemy.exc.IntegrityError:
+        pass
+
+    if registry.claim(session, "e" * 40, "air") is None:
+        assert False
+
+    def broken_release(session, file_hash):
+        raise sqlalchemy.exc.OperationalError("DELETE", {}, "database is locked")
+
+    monkeypatch.setattr(registry, "release", broken_release)
+    try:
+        with registry.claim(session, "f" * 40, "air"):
+            raise ValueError("Broken dataset")
+    except ValueError:
+        pass
+    else:
+        assert False
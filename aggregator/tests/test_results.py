@@ -0,0 +1,139 @@
+import asyncio
+import fakeredis
+from fakeredis.aioredis import FakeRedis
+from fastapi import Response
+from starlette.requests import Request
+import main
+from models.results import ResultCache
+from models.schemas import Base, AirSchema, HeatSchema
+from models.scores import refresh_scores
+
+Base.metadata.create_all(main.engine)
+
+loop = asyncio.new_event_loop()
+
+
+def run(coroutine):
+    """Runs the coroutine on the module's event loop."""
+    return loop.run_until_complete(coroutine)
+
+
+def test_result_cache_round_trip():
+    """Results are shared between caches on the same Redis and keyed on the
+    coefficient version."""
+
+    server = fakeredis.FakeServer()
+    writer = ResultCache(FakeRedis(server=server))
+    reader = ResultCache(FakeRedis(server=server))
+
+    if run(reader.get("v1", "score", "2030")) is not None:
+        assert False
+
+    run(writer.set("v1", "score", "2030", "", {"GB": 0.5, "FR": None}))
+    if run(reader.get("v1", "score", "2030")) != {"GB": 0.5, "FR": None}:
+        assert False
+
+    # Another dataset version, year or set of countries is another result.
+    for key in (("v2", "score", "2030"), ("v1", "score", "2031")):
+        if run(reader.get(*key)) is not None:
+            assert False
+    if run(reader.get("v1", "score", "2030", "GB")) is not None:
+        assert False
+
+    if reader.stats() != {"hits": 1, "misses": 4, "errors": 0}:
+        assert False
+
+
+def test_result_cache_invalidation_reaches_listeners():
+    """Invalidating drops the stored results and every listening worker is
+    called back."""
+
+    server = fakeredis.FakeServer()
+    ingest = ResultCache(FakeRedis(server=server))
+    worker = ResultCache(FakeRedis(server=server))
+
+    async def scenario():
+        invalidated = asyncio.Event()
+        worker.listen(invalidated.set)
+        # Let the listener subscribe before publishing.
+        await asyncio.sleep(0.1)
+
+        await ingest.set("v1", "score", "2030", "", {"GB": 0.5})
+        await ingest.invalidate()
+        await asyncio.wait_for(invalidated.wait(), 5)
+
+        result = await worker.get("v1", "score", "2030")
+        await worker.close()
+        await ingest.close()
+        return result
+
+    if run(scenario()) is not None:
+        assert False
+
+
+def test_result_cache_unreachable():
+    """An unreachable Redis is skipped over rather than failing the request."""
+
+    server = fakeredis.FakeServer()
+    server.connected = False
+    cache = ResultCache(FakeRedis(server=server))
+
+    run(cache.set("v1", "score", "2030", "", {"GB": 0.5}))
+    if run(cache.get("v1", "score", "2030")) is not None:
+        assert False
+    run(cache.invalidate())
+
+    if cache.stats()["errors"] != 3:
+        assert False
+
+
+def test_world_map_served_from_redis():
+    """A prediction map computed by one worker is served to the others from
+    Redis, and the ingest invalidation makes them recompute it."""
+
+    with main.session_local() as session:
+        session.query(AirSchema).delete()
+        session.query(HeatSchema).delete()
+        session.add(AirSchema("GB", 3, 0.01, 2, 0.01))
+        session.add(HeatSchema("GB", 0, 0, 20, 0, 0, 0))
+        session.commit()
+        refresh_scores(session)
+    main.coefficients.invalidate()
+
+    http_request = Request({"type": "http", "headers": []})
+
+    async def world(endpoint, **params):
+        async with main.async_session_local() as session:
+            return await endpoint(
+                request=http_request, response=Response(), session=session, **params
+            )
+
+    year = main.datetime.now().year
+    server = fakeredis.FakeServer()
+    previous, main.results = main.results, ResultCache(FakeRedis(server=server))
+    try:
+        expected = run(world(main.score))
+        if run(world(main.score)) != expected or main.results.stats()["hits"] != 1:
+            assert False
+
+        expected = run(
+            world(main.heat_prediction_range, start_year=year, countries=None)
+        )
+        if (
+            run(world(main.heat_prediction_range, start_year=year, countries=None))
+            != expected
+        ):
+            assert False
+
+        # Another worker ingests a dataset and invalidates the results.
+        with main.session_local() as session:
+            session.query(AirSchema).delete()
+            session.commit()
+            refresh_scores(session)
+        run(ResultCache(FakeRedis(server=server)).invalidate())
+        main.coefficients.invalidate()
+
+        if run(world(main.air_pollution_prediction)) != {}:
+            assert False
+    finally:
+        main.results = previous
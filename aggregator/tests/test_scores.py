@@ -0,0 +1,133 @@
+import asyncio
+import os
+import tempfile
+import numpy as np
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from models.air import generate_air
+from models.engine import PredictionEngine
+from models.schemas import Base, AirSchema, HeatSchema, ScoreSchema
+from models.scores import (
+    country_scores,
+    range_scores,
+    refresh_scores,
+    score_years,
+    scores_stale,
+    year_scores,
+)
+
+loop = asyncio.new_event_loop()
+
+
+def run(coroutine):
+    """Runs the coroutine on the module's event loop."""
+    return loop.run_until_complete(coroutine)
+
+
+def make_session():
+    """Creates a database of air only, heat only and overlapping countries and
+    returns a synchronous session along with an asyncio one."""
+    path = os.path.join(tempfile.mkdtemp(), "scores.db")
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    for index in range(6):
+        session.add(AirSchema(f"A{index}", 3, 0.01 * index, 2, -0.001 * index))
+        session.add(HeatSchema(f"A{index + 3}", 0, 0, 20, 0.001 * index, 0, 0))
+    session.add(AirSchema("NONE", None, None))
+    session.commit()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async_session = sessionmaker(bind=async_engine, class_=AsyncSession)()
+    return session, async_session
+
+
+def test_scores_match_engine():
+    """The precomputed scores are the prediction engine's, in the same
+    country order, for whole years and ranges alike."""
+
+    session, async_session = make_session()
+    years = score_years(10)
+    if scores_stale(session, years) is not True:
+        assert False
+
+    if refresh_scores(session, years) != 10 * len(years):
+        assert False
+
+    if scores_stale(session, years) is not False:
+        assert False
+
+    engine = PredictionEngine(
+        session.query(AirSchema).all(), session.query(HeatSchema).all()
+    )
+    year = int(years[3])
+    for kind in ("air", "heat", "score"):
+        result = run(year_scores(async_session, kind, year))
+        expected = getattr(engine, kind)(year)
+        if list(result) != list(expected) or not np.allclose(
+            [np.nan if value is None else value for value in result.values()],
+            [np.nan if value is None else value for value in expected.values()],
+            equal_nan=True,
+        ):
+            assert False
+
+        for countries in (None, ["A5", "XX", "A0", "A5"]):
+            result = run(range_scores(async_session, kind, years[2:6], countries))
+            expected = getattr(engine, f"{kind}_range")(years[2:6], countries)
+            if result != expected:
+                assert False
+
+    scores = run(country_scores(async_session, "A0", year))
+    if not scores.has_air or scores.has_heat or scores.air != engine.air(year)["A0"]:
+        assert False
+
+    run(async_session.close())
+
+
+def test_scores_outside_horizon():
+    """Years that weren't precomputed are reported missing so the caller
+    falls back to the coefficients."""
+
+    session, async_session = make_session()
+    years = score_years(5)
+    refresh_scores(session, years)
+    later = years + 10
+
+    if run(year_scores(async_session, "score", int(later[0]))) != {}:
+        assert False
+
+    # A range partly past the horizon can't be served either.
+    if run(range_scores(async_session, "score", years[3:] + 2)) is not None:
+        assert False
+
+    if run(country_scores(async_session, "A0", int(later[0]))) is not None:
+        assert False
+
+    if scores_stale(session, later) is not True:
+        assert False
+
+    run(async_session.close())
+
+
+def test_ingest_refreshes_scores():
+    """Ingesting a dataset recomputes the scores from the new coefficients."""
+
+    path = os.path.join(tempfile.mkdtemp(), "air.csv")
+    with open(path, "w") as dataset:
+        dataset.write("country,year,co2,nitrous_oxide\n")
+        for year in range(1990, 2000):
+            dataset.write(f"Albania,{year},{year - 1980},{2000 - year}\n")
+
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    stats = {}
+    generate_air(path, session, stats)
+    if stats["error"] is not None:
+        assert False
+
+    rows = session.query(ScoreSchema).filter(ScoreSchema.country == "Albania").all()
+    if len(rows) != len(score_years()) or not all(row.has_air for row in rows):
+        assert False
@@ -0,0 +1,146 @@
+import asyncio
+import math
+import os
+import tempfile
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from models import snapshot
+from models.cache import CoefficientCache
+from models.schemas import Base, AirSchema, HeatSchema
+from models.scores import country_scores, year_scores
+
+loop = asyncio.new_event_loop()
+
+
+def run(coroutine):
+    """Runs the coroutine on the module's event loop."""
+    return loop.run_until_complete(coroutine)
+
+
+def make_database() -> tuple:
+    """Creates a database with NULL, NaN and non ASCII coefficients and
+    returns a synchronous session and an asyncio one over it."""
+    path = os.path.join(tempfile.mkdtemp(), "snapshot.db")
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(AirSchema("CN", 3.5, 0.25, None, None))
+    session.add(AirSchema("Côte d'Ivoire", 1.0, float("nan"), 2.0, 0.125))
+    session.add(HeatSchema("CN", 0.1, 0.1, 0.2, 0.2, 0.3, 0.3))
+    session.add(HeatSchema("Bosnia and Herzegovina", -1, 2, -3, 4, None, None))
+    session.commit()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async_session = sessionmaker(bind=async_engine, class_=AsyncSession)()
+    return session, async_session
+
+
+def unreachable_session() -> AsyncSession:
+    """Returns an asyncio session over a database that can't be opened."""
+    path = os.path.join(tempfile.mkdtemp(), "missing", "snapshot.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    return sessionmaker(bind=engine, class_=AsyncSession)()
+
+
+def same_value(left, right) -> bool:
+    """Compares two coefficients, NULL only equals NULL and NaN only NaN."""
+    if left is None or right is None:
+        return left is right
+    if math.isnan(left) or math.isnan(right):
+        return math.isnan(left) and math.isnan(right)
+    return left == right
+
+
+def test_snapshot_round_trip():
+    """A snapshot gives back the exact rows and the version the cache gives
+    the database, and a damaged one isn't loaded."""
+
+    session, async_session = make_database()
+    path = os.path.join(tempfile.mkdtemp(), "coefficients.snapshot")
+    snapshot.write_snapshot(session, path)
+
+    loaded = snapshot.load(path)
+    for schema in (AirSchema, HeatSchema):
+        expected = session.query(schema).all()
+        rows = loaded.rows(schema)
+        if [row.country for row in rows] != [row.country for row in expected]:
+            assert False
+
+        for row, expected_row in zip(rows, expected):
+            for name in snapshot.coefficient_columns(schema):
+                if not same_value(getattr(row, name), getattr(expected_row, name)):
+                    assert False
+
+    cache = CoefficientCache()
+    if run(cache.version(async_session)) != loaded.version:
+        assert False
+
+    with open(path, "rb") as original:
+        data = original.read()
+
+    with open(path, "wb") as damaged:
+        damaged.write(data[:-1] + bytes([data[-1] ^ 1]))
+    if snapshot.load(path) is not None:
+        assert False
+
+    with open(path, "wb") as truncated:
+        truncated.write(data[:50])
+    if snapshot.load(path) is not None:
+        assert False
+
+    if snapshot.load(path + ".missing") is not None:
+        assert False
+
+    run(async_session.close())
+
+
+def test_serves_snapshot_while_database_is_down():
+    """A cache loaded from the snapshot answers without the database, and
+    takes the database's tables once it's reachable."""
+
+    session, async_session = make_database()
+    path = os.path.join(tempfile.mkdtemp(), "coefficients.snapshot")
+    snapshot.write_snapshot(session, path)
+
+    cache = CoefficientCache(ttl=0)
+    cache.load_snapshot(snapshot.load(path))
+    down = unreachable_session()
+
+    row = run(cache.get(down, AirSchema, "CN"))
+    if row is None or row.co2_gradient != 3.5 or row.no_gradient is not None:
+        assert False
+
+    engine = run(cache.engine(down))
+    if list(engine.score(2030)) != ["CN", "Côte d'Ivoire", "Bosnia and Herzegovina"]:
+        assert False
+
+    if cache.stats()["source"] != "snapshot":
+        assert False
+
+    # The precomputed scores read as not precomputed, so the endpoints fall
+    # back to the coefficients.
+    if run(year_scores(down, "score", 2030)) != {}:
+        assert False
+
+    if run(country_scores(down, "CN", 2030)) is not None:
+        assert False
+
+    # A cache that never loaded anything has nothing to fall back on.
+    try:
+        run(CoefficientCache().engine(down))
+    except sqlalchemy.exc.OperationalError:
+        pass
+    else:
+        assert False
+
+    session.add(AirSchema("GB", 1, 1, 1, 1))
+    session.commit()
+    if "GB" not in run(cache.engine(async_session)).score(2030):
+        assert False
+
+    if cache.stats()["source"] != "database":
+        assert False
+
+    run(async_session.close())
+    run(down.close())
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import tempfile
+import time
+from models.watcher import DatasetWatcher
+
+loop = asyncio.new_event_loop()
+
+
+class RecordingQueue:
+    """Stands in for the JobQueue, recording what's submitted."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, kind, path):
+        self.submitted.append((kind, os.path.basename(path)))
+        return type("Job", (), {"id": len(self.submitted)})
+
+
+def wait_for(condition, timeout: float = 10):
+    """Runs the event loop until the condition holds or the timeout passes."""
+
+    async def poll():
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    loop.run_until_complete(poll())
+
+
+def test_watcher_queues_settled_files():
+    """Files already in the folder and files dropped in later are queued once
+    they stop changing, anything that isn't a dataset is ignored."""
+
+    air, heat = tempfile.mkdtemp(), tempfile.mkdtemp()
+    with open(os.path.join(air, "backfill.csv"), "w") as file:
+        file.write("country,year,co2\n")
+    with open(os.path.join(air, "notes.txt"), "w") as file:
+        file.write("not a dataset\n")
+
+    queue = RecordingQueue()
+    watcher = DatasetWatcher(queue, {"air": air, "heat": heat}, debounce=0.3)
+
+    async def start():
+        watcher.start()
+
+    loop.run_until_complete(start())
+    wait_for(lambda: len(queue.submitted) == 1)
+
+    # Keep writing to the file, it mustn't be queued while it's changing.
+    path = os.path.join(heat, "dropped.csv")
+    with open(path, "w") as file:
+        for _ in range(6):
+            file.write("Date,AverageTemperature,Country\n")
+            file.flush()
+            wait_for(lambda: False, timeout=0.1)
+
+        if len(queue.submitted) != 1:
+            assert False
+
+    wait_for(lambda: len(queue.submitted) == 2)
+    loop.run_until_complete(watcher.stop())
+
+    if queue.submitted != [("air", "backfill.csv"), ("heat", "dropped.csv")]:
+        assert False
+
+
+def test_watcher_only_queues_its_folder():
+    """A file moved out of the folder isn't queued, and a folder watched by
+    another watcher is left to it."""
+
+    air, elsewhere = tempfile.mkdtemp(), tempfile.mkdtemp()
+    queue, other_queue = RecordingQueue(), RecordingQueue()
+    watcher = DatasetWatcher(queue, {"air": air}, debounce=0.3)
+    other = DatasetWatcher(other_queue, {"air": air}, debounce=0.3)
+
+    async def start():
+        watcher.start()
+        other.start()
+
+    loop.run_until_complete(start())
+
+    path = os.path.join(air, "moved.csv")
+    with open(path, "w") as file:
+        file.write("country,year,co2\n")
+    os.rename(path, os.path.join(elsewhere, "moved.csv"))
+
+    with open(os.path.join(air, "kept.csv"), "w") as file:
+        file.write("country,year,co2\n")
+
+    wait_for(lambda: len(queue.submitted) == 1)
+    wait_for(lambda: False, timeout=0.5)
+    loop.run_until_complete(watcher.stop())
+    loop.run_until_complete(other.stop())
+
+    if queue.submitted != [("air", "kept.csv")] or other_queue.submitted:
+        assert False